@@ -1,12 +1,16 @@
-from flask import Blueprint, jsonify, request
-from models import User, Role
+from flask import Blueprint, current_app, jsonify, request
+from models import User, Role, RolePermission
 from extensions import db
 from sqlalchemy.exc import SQLAlchemyError
 import logging
-from marshmallow import Schema, fields, ValidationError
-import secrets
+from marshmallow import Schema, fields, validate, ValidationError
+from auth_tokens import TokenSecretMissing, current_principal, login_required, token_auth
+from password_hasher import HasherBusy, password_hasher
+from permissions import PERMISSIONS, mask_of, permission_table, require_permission
 
 bp = Blueprint('auth', __name__, url_prefix='/api/v1/auth')
+# Not installed when blueprints load lazily; current_principal() then authenticates on demand.
+bp.before_app_request(token_auth.authenticate)
 
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
@@ -15,7 +19,7 @@ class UserSchema(Schema):
     username = fields.String(required=True)
     password = fields.String(required=True)
     email = fields.Email(required=True)
-    role = fields.String(required=False)
+    role = fields.String(required=False)  # Only for callers holding users:manage and roles:manage
 
 class LoginSchema(Schema):
     username = fields.String(required=True)
@@ -25,6 +29,18 @@ class RoleSchema(Schema):
     name = fields.String(required=True)
     description = fields.String()
 
+class RolePermissionsSchema(Schema):
+    permissions = fields.List(fields.String(validate=validate.OneOf(PERMISSIONS)), required=True)
+
+# Registering someone with a role assigns it, so it takes roles:manage too.
+REGISTER_WITH_ROLE = ('users:manage', 'roles:manage')
+REGISTER_WITH_ROLE_MASK = mask_of(REGISTER_WITH_ROLE)
+
+def _busy():
+    response = jsonify({"error": "Too many sign-ins right now, please retry shortly"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 @bp.route('/register', methods=['POST'])
 def register():
     try:
@@ -33,9 +49,16 @@ def register():
     except ValidationError as err:
         return jsonify({"error": "Invalid input", "details": err.messages}), 400
 
+    if 'role' in data:
+        # Self-registration must not pick its own role, least of all the superuser one.
+        principal = current_principal()
+        if principal is None or not permission_table.allows(principal.role_id, REGISTER_WITH_ROLE_MASK,
+                                                            current_app.config):
+            return jsonify({"error": "Permission denied", "required": list(REGISTER_WITH_ROLE)}), 403
+
     try:
-        new_user = User(username=data['username'], email=data['email'])
-        new_user.set_password(data['password'])
+        new_user = User(username=data['username'], email=data['email'],
+                        password_hash=password_hasher.hash(data['password'], current_app.config))
         if 'role' in data:
             role = Role.query.filter_by(name=data['role']).first()
             if not role:
@@ -48,6 +71,8 @@ def register():
         logger.error(f"Database error in register: {str(e)}")
         db.session.rollback()
         return jsonify({"error": "An error occurred while registering the user"}), 500
+    except HasherBusy:
+        return _busy()
 
 @bp.route('/login', methods=['POST'])
 def login():
@@ -59,35 +84,60 @@ def login():
 
     try:
         user = User.query.filter_by(username=data['username']).first()
-        if user and user.check_password(data['password']):
-            # In a real application, you would generate and return a token here
-            return jsonify({"message": "User logged in successfully", "user_id": user.id, "role": user.role.name if user.role else None}), 200
+        if user and password_hasher.verify(user.password_hash, data['password'], current_app.config):
+            if password_hasher.upgrade(user, data['password'], current_app.config):
+                db.session.commit()
+            token, expires_in = token_auth.issue(user, current_app.config)
+            return jsonify({
+                "message": "User logged in successfully",
+                "user_id": user.id,
+                "role": user.role.name if user.role else None,
+                "access_token": token,
+                "token_type": "Bearer",
+                "expires_in": expires_in
+            }), 200
         else:
             return jsonify({"error": "Invalid credentials"}), 400
     except SQLAlchemyError as e:
         logger.error(f"Database error in login: {str(e)}")
+        db.session.rollback()
         return jsonify({"error": "An error occurred while logging in"}), 500
+    except HasherBusy:
+        return _busy()
+    except TokenSecretMissing:
+        logger.error("Cannot issue access tokens: SECRET_KEY is not set to a private value")
+        return jsonify({"error": "Sign-in is not configured on this server"}), 500
 
 @bp.route('/logout', methods=['POST'])
 def logout():
-    # In a real application, you would invalidate the user's token here
+    # Access tokens are stateless: the client drops its token and it lapses after ACCESS_TOKEN_TTL_S.
     return jsonify({"message": "User logged out successfully"}), 200
 
 @bp.route('/me', methods=['GET'])
+@login_required
 def get_current_user():
-    # In a real application, you would get the user from the token
-    # For this example, we'll just return a mock user
-    try:
-        user = {
-            "id": 1,
-            "username": "testuser",
-            "email": "testuser@example.com",
-            "role": "user"
-        }
-        return jsonify(user), 200
-    except Exception as e:
-        logger.error(f"Error in get_current_user: {str(e)}")
-        return jsonify({"error": "An error occurred while fetching user details"}), 500
+    """
+    The user the access token was issued to
+    ---
+    parameters:
+      - name: Authorization
+        in: header
+        required: true
+        type: string
+        description: Bearer access token from /login
+    responses:
+      200:
+        description: User details
+      401:
+        description: Missing, invalid or expired token
+    """
+    principal = current_principal()
+    return jsonify({
+        "id": principal.id,
+        "username": principal.username,
+        "email": principal.email,
+        "role": principal.role
+    }), 200
 
 @bp.route('/roles', methods=['GET'])
 def get_roles():
@@ -99,6 +149,7 @@ def get_roles():
         return jsonify({"error": "An error occurred while fetching roles"}), 500
 
 @bp.route('/roles', methods=['POST'])
+@require_permission('roles:manage')
 def create_role():
     try:
         schema = RoleSchema()
@@ -110,6 +161,7 @@ def create_role():
         new_role = Role(name=data['name'], description=data.get('description'))
         db.session.add(new_role)
         db.session.commit()
+        permission_table.invalidate()  # The new role may be the superuser role
         return jsonify({"message": "Role created successfully", "role_id": new_role.id}), 201
     except SQLAlchemyError as e:
         logger.error(f"Database error in create_role: {str(e)}")
@@ -117,6 +169,7 @@ def create_role():
         return jsonify({"error": "An error occurred while creating the role"}), 500
 
 @bp.route('/roles/<int:role_id>', methods=['PUT'])
+@require_permission('roles:manage')
 def update_role(role_id):
     try:
         schema = RoleSchema()
@@ -131,6 +184,8 @@ def update_role(role_id):
         role.name = data['name']
         role.description = data.get('description', role.description)
         db.session.commit()
+        token_auth.invalidate_role(role_id)
+        permission_table.invalidate()  # The rename may make or unmake the superuser role
         return jsonify({"message": "Role updated successfully"}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in update_role: {str(e)}")
@@ -138,20 +193,87 @@ def update_role(role_id):
         return jsonify({"error": "An error occurred while updating the role"}), 500
 
 @bp.route('/roles/<int:role_id>', methods=['DELETE'])
+@require_permission('roles:manage')
 def delete_role(role_id):
     try:
         role = Role.query.get(role_id)
         if not role:
             return jsonify({"error": "Role not found"}), 404
+        user_ids = [user.id for user in role.users]
         db.session.delete(role)
         db.session.commit()
+        token_auth.invalidate_role(role_id)
+        token_auth.invalidate_user(*user_ids)
+        permission_table.invalidate()
         return jsonify({"message": "Role deleted successfully"}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in delete_role: {str(e)}")
         db.session.rollback()
         return jsonify({"error": "An error occurred while deleting the role"}), 500
 
+@bp.route('/permissions', methods=['GET'])
+def get_permissions():
+    return jsonify({"permissions": list(PERMISSIONS)}), 200
+
+@bp.route('/roles/<int:role_id>/permissions', methods=['GET'])
+def get_role_permissions(role_id):
+    try:
+        role = Role.query.get(role_id)
+        if not role:
+            return jsonify({"error": "Role not found"}), 404
+        return jsonify({"role_id": role.id, "permissions": sorted(p.permission for p in role.permissions)}), 200
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in get_role_permissions: {str(e)}")
+        return jsonify({"error": "An error occurred while fetching role permissions"}), 500
+
+@bp.route('/roles/<int:role_id>/permissions', methods=['PUT'])
+@require_permission('roles:manage')
+def set_role_permissions(role_id):
+    """
+    Replace the permissions granted to a role
+    ---
+    parameters:
+      - name: permissions
+        in: body
+        required: true
+        type: array
+        items:
+          type: string
+        description: Names from GET /api/v1/auth/permissions
+    responses:
+      200:
+        description: Permissions replaced
+      400:
+        description: Bad request or unknown permission
+      401:
+        description: Missing, invalid or expired token
+      403:
+        description: Caller lacks roles:manage
+      404:
+        description: Role not found
+    """
+    try:
+        schema = RolePermissionsSchema()
+        data = schema.load(request.json)
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+
+    try:
+        role = Role.query.get(role_id)
+        if not role:
+            return jsonify({"error": "Role not found"}), 404
+        role.permissions = [RolePermission(role_id=role.id, permission=name) for name in set(data['permissions'])]
+        db.session.commit()
+        permission_table.invalidate()
+        return jsonify({"message": "Role permissions updated successfully",
+                        "permissions": sorted(set(data['permissions']))}), 200
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in set_role_permissions: {str(e)}")
+        db.session.rollback()
+        return jsonify({"error": "An error occurred while updating role permissions"}), 500
+
 @bp.route('/users/<int:user_id>/roles/<int:role_id>', methods=['POST', 'DELETE'])
+@require_permission('roles:manage')
 def manage_user_role(user_id, role_id):
     try:
         user = User.query.get(user_id)
@@ -167,6 +289,7 @@ def manage_user_role(user_id, role_id):
             message = "Role removed from user successfully"
 
         db.session.commit()
+        token_auth.invalidate_user(user_id)
         return jsonify({"message": message}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in manage_user_role: {str(e)}")
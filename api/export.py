@@ -0,0 +1,133 @@
+from flask import Blueprint, jsonify, request
+from models import Invoice, Maintenance, Trip, Vehicle
+from sqlalchemy import select
+import logging
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError
+from datetime import datetime
+from timestamps import naive_utc
+from exports import EXPORT_FORMATS, export_response
+
+bp = Blueprint('export', __name__, url_prefix='/api/v1/exports')
+
+logging.basicConfig(level=logging.ERROR)
+logger = logging.getLogger(__name__)
+
+class ExportQuerySchema(Schema):
+    format = fields.String(load_default='csv', validate=validate.OneOf(EXPORT_FORMATS))
+    start = fields.DateTime()
+    end = fields.DateTime()
+    vehicle_id = fields.Integer()
+    fleet_id = fields.Integer()
+    user_id = fields.Integer()
+    status = fields.String(validate=validate.Length(max=20))
+
+    @validates_schema
+    def validate_range(self, data, **kwargs):
+        if 'start' in data and 'end' in data and naive_utc(data['start']) >= naive_utc(data['end']):
+            raise ValidationError("start must be before end")
+
+def _time_range(stmt, column, args):
+    if 'start' in args:
+        stmt = stmt.where(column >= naive_utc(args['start']))
+    if 'end' in args:
+        stmt = stmt.where(column < naive_utc(args['end']))
+    return stmt
+
+def _trips(args):
+    stmt = _time_range(select(Trip.id, Trip.vehicle_id, Trip.start_time, Trip.end_time, Trip.start_location,
+                              Trip.end_location, Trip.fare), Trip.start_time, args)
+    if 'vehicle_id' in args:
+        stmt = stmt.where(Trip.vehicle_id == args['vehicle_id'])
+    if 'fleet_id' in args:
+        stmt = stmt.where(Trip.vehicle_id.in_(select(Vehicle.id).where(Vehicle.fleet_id == args['fleet_id'])))
+    return stmt.order_by(Trip.start_time, Trip.id)
+
+def _invoices(args):
+    stmt = _time_range(select(Invoice.id, Invoice.user_id, Invoice.amount, Invoice.description, Invoice.status,
+                              Invoice.created_at), Invoice.created_at, args)
+    if 'user_id' in args:
+        stmt = stmt.where(Invoice.user_id == args['user_id'])
+    if 'status' in args:
+        stmt = stmt.where(Invoice.status == args['status'])
+    return stmt.order_by(Invoice.created_at, Invoice.id)
+
+def _maintenance(args):
+    stmt = _time_range(select(Maintenance.id, Maintenance.vehicle_id, Maintenance.description,
+                              Maintenance.scheduled_date, Maintenance.status, Maintenance.created_at),
+                       Maintenance.created_at, args)
+    if 'vehicle_id' in args:
+        stmt = stmt.where(Maintenance.vehicle_id == args['vehicle_id'])
+    if 'status' in args:
+        stmt = stmt.where(Maintenance.status == args['status'])
+    return stmt.order_by(Maintenance.created_at, Maintenance.id)
+
+# dataset -> (query builder, filters it accepts besides start/end)
+DATASETS = {
+    'trips': (_trips, {'vehicle_id', 'fleet_id'}),
+    'invoices': (_invoices, {'user_id', 'status'}),
+    'maintenance': (_maintenance, {'vehicle_id', 'status'}),
+}
+
+@bp.route('/<dataset>', methods=['GET'])
+def export_dataset(dataset):
+    """
+    Stream every matching trip, invoice or maintenance record as CSV or NDJSON
+    ---
+    parameters:
+      - name: dataset
+        in: path
+        type: string
+        enum: [trips, invoices, maintenance]
+      - name: format
+        in: query
+        type: string
+        enum: [csv, ndjson]
+      - name: start
+        in: query
+        type: string
+        format: date-time
+        description: Inclusive lower bound on start_time (trips) or created_at
+      - name: end
+        in: query
+        type: string
+        format: date-time
+        description: Exclusive upper bound on the same column
+      - name: vehicle_id
+        in: query
+        type: integer
+        description: trips and maintenance
+      - name: fleet_id
+        in: query
+        type: integer
+        description: trips
+      - name: user_id
+        in: query
+        type: integer
+        description: invoices
+      - name: status
+        in: query
+        type: string
+        description: invoices and maintenance
+    responses:
+      200:
+        description: Chunked attachment ordered by time then id, gzip-encoded when the client accepts it
+      400:
+        description: Bad request
+      404:
+        description: Unknown dataset
+    """
+    if dataset not in DATASETS:
+        return jsonify({"error": "Unknown dataset", "datasets": sorted(DATASETS)}), 404
+    build, filters = DATASETS[dataset]
+    try:
+        schema = ExportQuerySchema()
+        args = schema.load(request.args)
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+    unsupported = sorted(set(args) - filters - {'format', 'start', 'end'})
+    if unsupported:
+        return jsonify({"error": "Invalid input",
+                        "details": {name: [f"Not a filter for {dataset}"] for name in unsupported}}), 400
+
+    filename = f"{dataset}-{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}"
+    return export_response(build(args), args['format'], filename, gzip='gzip' in request.accept_encodings)
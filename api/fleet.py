@@ -1,9 +1,10 @@
 from flask import Blueprint, jsonify, request
-from models import Fleet
+from models import Fleet, Vehicle
 from extensions import db
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 from marshmallow import Schema, fields, ValidationError
+from entity_cache import cached_entity_response, entity_cache, row_etag
 
 bp = Blueprint('fleet', __name__, url_prefix='/api/v1/fleets')
 
@@ -46,6 +47,7 @@ def update_fleet(fleet_id):
 
         fleet.name = data['name']
         db.session.commit()
+        entity_cache.invalidate('fleet', fleet_id)
         return jsonify({"message": "Fleet updated successfully"}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in update_fleet: {str(e)}")
@@ -59,26 +61,36 @@ def delete_fleet(fleet_id):
         if not fleet:
             return jsonify({"error": "Fleet not found"}), 404
 
+        # SQLite does not enforce ON DELETE SET NULL unless foreign keys are on, so detach explicitly.
+        vehicle_ids = db.session.scalars(db.select(Vehicle.id).where(Vehicle.fleet_id == fleet_id)).all()
+        Vehicle.query.filter_by(fleet_id=fleet_id).update({'fleet_id': None}, synchronize_session=False)
         db.session.delete(fleet)
         db.session.commit()
+        entity_cache.invalidate('fleet', fleet_id)
+        entity_cache.invalidate('vehicle', *vehicle_ids)
         return jsonify({"message": "Fleet deleted successfully"}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in delete_fleet: {str(e)}")
         db.session.rollback()
         return jsonify({"error": "An error occurred while deleting the fleet"}), 500
 
+def _load_fleet(fleet_id):
+    fleet = Fleet.query.get(fleet_id)
+    if not fleet:
+        return None
+    return row_etag(fleet, fleet.created_at), {
+        "id": fleet.id,
+        "name": fleet.name,
+        "created_at": fleet.created_at.isoformat()
+    }
+
 @bp.route('/<int:fleet_id>', methods=['GET'])
 def get_fleet(fleet_id):
     try:
-        fleet = Fleet.query.get(fleet_id)
-        if not fleet:
+        response = cached_entity_response('fleet', fleet_id, lambda: _load_fleet(fleet_id))
+        if response is None:
             return jsonify({"error": "Fleet not found"}), 404
-
-        return jsonify({
-            "id": fleet.id,
-            "name": fleet.name,
-            "created_at": fleet.created_at.isoformat()
-        }), 200
+        return response
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_fleet: {str(e)}")
         return jsonify({"error": "An error occurred while fetching the fleet"}), 500
@@ -0,0 +1,91 @@
+from flask import Blueprint, Response, current_app, jsonify, request, url_for
+from sqlalchemy.exc import SQLAlchemyError
+import logging
+import time
+from gbfs_snapshot import FEEDS, ensure_gbfs_snapshot, gbfs_timestamp
+
+bp = Blueprint('gbfs_publisher', __name__, url_prefix='/gbfs')
+
+logging.basicConfig(level=logging.ERROR)
+logger = logging.getLogger(__name__)
+
+def _feed_response(feed):
+    try:
+        document = ensure_gbfs_snapshot().document(feed)
+    except SQLAlchemyError as e:
+        logger.error(f"Database error loading GBFS snapshot: {str(e)}")
+        return jsonify({"error": "An error occurred while building the feed"}), 500
+
+    if request.if_none_match.contains(document.etag):
+        response = current_app.response_class(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = Response(document.gzipped, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(document.raw, mimetype='application/json')
+    response.set_etag(document.etag)
+    response.last_modified = document.last_updated
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={document.ttl}'
+    return response
+
+@bp.route('/free_bike_status.json', methods=['GET'])
+def free_bike_status():
+    """
+    GBFS 2.3 free_bike_status feed for our own fleet
+    ---
+    responses:
+      200:
+        description: Pre-serialized feed, gzip-encoded when the client accepts it
+      304:
+        description: Feed unchanged since the ETag in If-None-Match
+    """
+    return _feed_response('free_bike_status')
+
+@bp.route('/vehicle_status.json', methods=['GET'])  # where it was served before the 3.0 set had its own discovery
+@bp.route('/v3/vehicle_status.json', methods=['GET'])
+def vehicle_status():
+    """
+    GBFS 3.0 vehicle_status feed for our own fleet
+    ---
+    responses:
+      200:
+        description: Pre-serialized feed, gzip-encoded when the client accepts it
+      304:
+        description: Feed unchanged since the ETag in If-None-Match
+    """
+    return _feed_response('vehicle_status')
+
+def _discovery(version):
+    # One discovery document per GBFS version, listing only that version's feeds.
+    feeds = [{"name": feed, "url": url_for(f'.{feed}', _external=True)}
+             for feed, spec in FEEDS.items() if spec['version'] == version]
+    return jsonify({
+        "last_updated": gbfs_timestamp(int(time.time()), version),
+        "ttl": current_app.config.get('GBFS_TTL', 10),
+        "version": version,
+        # 3.0 dropped the per-language level.
+        "data": {"en": {"feeds": feeds}} if version.startswith('2.') else {"feeds": feeds}
+    }), 200
+
+@bp.route('/gbfs.json', methods=['GET'])
+def gbfs_discovery():
+    """
+    GBFS 2.3 discovery: the free_bike_status feed
+    ---
+    responses:
+      200:
+        description: Feed list of the 2.3 set
+    """
+    return _discovery('2.3')
+
+@bp.route('/v3/gbfs.json', methods=['GET'])
+def gbfs_discovery_v3():
+    """
+    GBFS 3.0 discovery: the vehicle_status feed, with RFC 3339 timestamps
+    ---
+    responses:
+      200:
+        description: Feed list of the 3.0 set
+    """
+    return _discovery('3.0')
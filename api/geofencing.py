@@ -3,8 +3,10 @@ from models import Geofence
 from extensions import db
 from sqlalchemy.exc import SQLAlchemyError
 import logging
-from marshmallow import Schema, fields, ValidationError
+from marshmallow import Schema, fields, validate, ValidationError
 import json
+from entity_cache import cached_entity_response, entity_cache, row_etag
+from geofence_index import GeofenceError, compile_geofence, ensure_geofence_index, geofence_index, index_geofence
 
 bp = Blueprint('geofencing', __name__, url_prefix='/api/v1/geofences')
 
@@ -15,6 +17,12 @@ class GeofenceSchema(Schema):
     name = fields.String(required=True)
     coordinates = fields.String(required=True)  # JSON string of coordinates
 
+class ContainsSchema(Schema):
+    lat = fields.Float(required=True, validate=validate.Range(min=-90, max=90))
+    lon = fields.Float(required=True, validate=validate.Range(min=-180, max=180))
+
+MAX_POINTS_PER_REQUEST = 100000
+
 @bp.route('', methods=['POST'])
 def create_geofence():
     try:
@@ -24,10 +32,10 @@ def create_geofence():
         return jsonify({"error": "Invalid input", "details": err.messages}), 400
 
     try:
-        # Validate coordinates JSON
-        json.loads(data['coordinates'])
-    except json.JSONDecodeError:
-        return jsonify({"error": "Invalid coordinates format"}), 400
+        # Validate coordinates and compile them before anything is stored
+        polygon = compile_geofence(None, data['name'], data['coordinates'])
+    except GeofenceError as err:
+        return jsonify({"error": "Invalid coordinates format", "details": str(err)}), 400
 
     try:
         new_geofence = Geofence(
@@ -36,6 +44,8 @@ def create_geofence():
         )
         db.session.add(new_geofence)
         db.session.commit()
+        polygon.id = new_geofence.id
+        geofence_index.upsert(polygon)
         return jsonify({"message": "Geofence created successfully", "geofence_id": new_geofence.id}), 201
     except SQLAlchemyError as e:
         logger.error(f"Database error in create_geofence: {str(e)}")
@@ -55,17 +65,22 @@ def update_geofence(geofence_id):
         if not geofence:
             return jsonify({"error": "Geofence not found"}), 404
 
-        # Validate coordinates JSON if provided
+        # Validate coordinates if provided
         if 'coordinates' in data:
             try:
-                json.loads(data['coordinates'])
-            except json.JSONDecodeError:
-                return jsonify({"error": "Invalid coordinates format"}), 400
+                compile_geofence(geofence_id, data['name'], data['coordinates'])
+            except GeofenceError as err:
+                return jsonify({"error": "Invalid coordinates format", "details": str(err)}), 400
 
         for key, value in data.items():
             setattr(geofence, key, value)
 
         db.session.commit()
+        entity_cache.invalidate('geofence', geofence_id)
+        try:
+            index_geofence(geofence)
+        except GeofenceError:
+            geofence_index.remove(geofence_id)
         return jsonify({"message": "Geofence updated successfully"}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in update_geofence: {str(e)}")
@@ -81,25 +96,32 @@ def delete_geofence(geofence_id):
 
         db.session.delete(geofence)
         db.session.commit()
+        entity_cache.invalidate('geofence', geofence_id)
+        geofence_index.remove(geofence_id)
         return jsonify({"message": "Geofence deleted successfully"}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in delete_geofence: {str(e)}")
         db.session.rollback()
         return jsonify({"error": "An error occurred while deleting the geofence"}), 500
 
+def _load_geofence(geofence_id):
+    geofence = Geofence.query.get(geofence_id)
+    if not geofence:
+        return None
+    return row_etag(geofence, geofence.created_at), {
+        "id": geofence.id,
+        "name": geofence.name,
+        "coordinates": json.loads(geofence.coordinates),
+        "created_at": geofence.created_at.isoformat()
+    }
+
 @bp.route('/<int:geofence_id>', methods=['GET'])
 def get_geofence(geofence_id):
     try:
-        geofence = Geofence.query.get(geofence_id)
-        if not geofence:
+        response = cached_entity_response('geofence', geofence_id, lambda: _load_geofence(geofence_id))
+        if response is None:
             return jsonify({"error": "Geofence not found"}), 404
-
-        return jsonify({
-            "id": geofence.id,
-            "name": geofence.name,
-            "coordinates": json.loads(geofence.coordinates),
-            "created_at": geofence.created_at.isoformat()
-        }), 200
+        return response
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_geofence: {str(e)}")
         return jsonify({"error": "An error occurred while fetching the geofence"}), 500
@@ -116,4 +138,102 @@ def list_geofences():
         } for g in geofences]), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in list_geofences: {str(e)}")
-        return jsonify({"error": "An error occurred while fetching geofences"}), 500
\ No newline at end of file
+        return jsonify({"error": "An error occurred while fetching geofences"}), 500
+
+def _parse_point(point):
+    # Hand-rolled instead of a schema: batches carry up to 100k points.
+    if not isinstance(point, dict):
+        return None, "Expected a JSON object"
+    lat, lon = point.get('lat'), point.get('lon')
+    if isinstance(lat, bool) or not isinstance(lat, (int, float)) or not -90 <= lat <= 90:
+        return None, "lat must be a number between -90 and 90"
+    if isinstance(lon, bool) or not isinstance(lon, (int, float)) or not -180 <= lon <= 180:
+        return None, "lon must be a number between -180 and 180"
+    return (lat, lon), None
+
+@bp.route('/contains', methods=['GET'])
+def geofences_containing_point():
+    """
+    Geofences containing a point
+    ---
+    parameters:
+      - name: lat
+        in: query
+        type: number
+        required: true
+      - name: lon
+        in: query
+        type: number
+        required: true
+    responses:
+      200:
+        description: Matching geofences, ordered by id
+      400:
+        description: Bad request
+    """
+    try:
+        schema = ContainsSchema()
+        args = schema.load(request.args)
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+
+    try:
+        index = ensure_geofence_index()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in geofences_containing_point: {str(e)}")
+        return jsonify({"error": "An error occurred while loading geofences"}), 500
+
+    return jsonify({"data": [
+        {"id": polygon.id, "name": polygon.name} for polygon in index.containing(args['lat'], args['lon'])
+    ]}), 200
+
+@bp.route('/contains', methods=['POST'])
+def geofences_containing_points():
+    """
+    Geofences containing each point of a batch
+    ---
+    parameters:
+      - name: points
+        in: body
+        required: true
+        type: array
+        items:
+          type: object
+          properties:
+            lat:
+              type: number
+            lon:
+              type: number
+    responses:
+      200:
+        description: One list of geofence ids per input point, in input order
+      400:
+        description: Bad request
+      413:
+        description: Too many points
+    """
+    payload = request.get_json(silent=True)
+    points = payload.get('points') if isinstance(payload, dict) else payload
+    if not isinstance(points, list):
+        return jsonify({"error": "Invalid input", "details": "Expected a list of points"}), 400
+    if len(points) > MAX_POINTS_PER_REQUEST:
+        return jsonify({"error": f"At most {MAX_POINTS_PER_REQUEST} points per request"}), 413
+
+    parsed, errors = [], []
+    for index, point in enumerate(points):
+        value, error = _parse_point(point)
+        if error:
+            errors.append({"index": index, "details": error})
+        else:
+            parsed.append(value)
+    if errors:
+        return jsonify({"error": "Invalid input", "details": errors}), 400
+
+    try:
+        geofences = ensure_geofence_index()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in geofences_containing_points: {str(e)}")
+        return jsonify({"error": "An error occurred while loading geofences"}), 500
+
+    return jsonify({"results": [[polygon.id for polygon in hits]
+                                for hits in geofences.containing_many(parsed)]}), 200
@@ -1,16 +1,34 @@
 from flask import Blueprint, jsonify, request
+from extensions import db
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+import gzip
+import logging
+from gbfs import FeedError, ingest_feed
 
 bp = Blueprint('integration', __name__, url_prefix='/integration')
 
+logging.basicConfig(level=logging.ERROR)
+logger = logging.getLogger(__name__)
+
 @bp.route('/gbfs', methods=['POST'])
 def ingest_gbfs_data():
     """
-    Ingest real-time bike location data from GBFS
+    Ingest a partner GBFS feed and apply the changes to vehicles or stations
     ---
     parameters:
+      - name: source
+        in: query
+        required: true
+        type: string
+      - name: feed
+        in: query
+        required: true
+        type: string
+        enum: [free_bike_status, vehicle_status, station_status]
       - name: gbfs_data
         in: body
         required: true
+        description: The feed document exactly as published (optionally gzip-encoded)
         schema:
           type: object
     responses:
@@ -18,17 +36,32 @@ def ingest_gbfs_data():
         description: GBFS data ingested successfully
       400:
         description: Bad request
+      409:
+        description: Another ingest of the same source wrote the same vehicles first; retry
+      500:
+        description: Internal server error
     """
-    try:
-        data = request.get_json()
-        if not data or not isinstance(data, dict) or 'gbfs_data' not in data:
-            return jsonify({'error': 'Invalid or missing GBFS data'}), 400
+    source = request.args.get('source', '').strip()
+    feed = request.args.get('feed', '')
+    if not source or len(source) > 32:
+        return jsonify({'error': 'Invalid or missing source'}), 400
 
-        # In a real implementation, we would process and store the GBFS data
-        # For this sandbox, we'll just acknowledge receipt
-        return jsonify({'message': 'GBFS data received and processed'})
-    except Exception as e:
-        return jsonify({'error': 'An error occurred while processing the request', 'details': str(e)}), 500
+    stream = request.stream
+    if request.headers.get('Content-Encoding') == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream)
+    try:
+        stats = ingest_feed(source, feed, stream)
+        return jsonify({'message': 'GBFS data received and processed', 'source': source, 'feed': feed, **stats})
+    except (FeedError, OSError) as e:
+        db.session.rollback()
+        return jsonify({'error': 'Invalid or missing GBFS data', 'details': str(e)}), 400
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'A concurrent ingest of this source changed the same vehicles; retry'}), 409
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in ingest_gbfs_data: {str(e)}")
+        db.session.rollback()
+        return jsonify({'error': 'An error occurred while processing the request'}), 500
 
 @bp.route('/crm', methods=['POST'])
 def connect_repair_ticket():
@@ -1,16 +1,28 @@
-from flask import Blueprint, jsonify, request
-from models import Invoice, User
+from flask import Blueprint, current_app, jsonify, request, url_for
+from models import Invoice, PaymentIntent, User, UserBillingSummary
 from extensions import db
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 import logging
-from marshmallow import Schema, fields, ValidationError
+import uuid
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError
 from datetime import datetime
+from timestamps import naive_utc
+from billing import close_billing_period, rebuild_billing_summaries, record_invoice
+from payment_worker import ACTIVE_STATUSES, payment_workers
+from pagination import (CursorError, keyset_page, ndjson_response, paginated_response, parse_page_args,
+                        wants_stream)
+from entity_cache import cached_entity_response, entity_cache, row_etag
 
 bp = Blueprint('payment', __name__, url_prefix='/api/v1')
 
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
+INVOICE_ORDER = (Invoice.created_at, Invoice.id)
+BILLING_HISTORY_ORDER = (Invoice.created_at, Invoice.id)  # descending
+BILLING_HISTORY_COLUMNS = (Invoice.id, Invoice.amount, Invoice.description, Invoice.status, Invoice.created_at)
+
 class InvoiceSchema(Schema):
     user_id = fields.Integer(required=True)
     amount = fields.Float(required=True)
@@ -19,7 +31,30 @@ class InvoiceSchema(Schema):
 class PaymentSchema(Schema):
     invoice_id = fields.Integer(required=True)
     amount = fields.Float(required=True)
-    payment_method = fields.String(required=True)
+    payment_method = fields.String(required=True, validate=validate.Length(min=1, max=50))
+
+class BillingCloseSchema(Schema):
+    period_start = fields.DateTime(required=True)
+    period_end = fields.DateTime(required=True)
+
+    @validates_schema
+    def validate_period(self, data, **kwargs):
+        start, end = naive_utc(data['period_start']), naive_utc(data['period_end'])
+        if start >= end:
+            raise ValidationError("period_start must be before period_end")
+        if end > datetime.utcnow():
+            # Trips still running could end inside the period after it is closed.
+            raise ValidationError("period_end must not be in the future")
+
+def serialize_invoice(invoice):
+    return {
+        "id": invoice.id,
+        "user_id": invoice.user_id,
+        "amount": invoice.amount,
+        "description": invoice.description,
+        "status": invoice.status,
+        "created_at": invoice.created_at.isoformat()
+    }
 
 @bp.route('/invoices', methods=['POST'])
 def create_invoice():
@@ -42,6 +77,7 @@ def create_invoice():
             created_at=datetime.utcnow()
         )
         db.session.add(new_invoice)
+        record_invoice(new_invoice)
         db.session.commit()
         return jsonify({"message": "Invoice created successfully", "invoice_id": new_invoice.id}), 201
     except SQLAlchemyError as e:
@@ -49,21 +85,19 @@ def create_invoice():
         db.session.rollback()
         return jsonify({"error": "An error occurred while creating the invoice"}), 500
 
+def _load_invoice(invoice_id):
+    invoice = Invoice.query.get(invoice_id)
+    if not invoice:
+        return None
+    return row_etag(invoice, invoice.created_at), serialize_invoice(invoice)
+
 @bp.route('/invoices/<int:invoice_id>', methods=['GET'])
 def get_invoice(invoice_id):
     try:
-        invoice = Invoice.query.get(invoice_id)
-        if not invoice:
+        response = cached_entity_response('invoice', invoice_id, lambda: _load_invoice(invoice_id))
+        if response is None:
             return jsonify({"error": "Invoice not found"}), 404
-
-        return jsonify({
-            "id": invoice.id,
-            "user_id": invoice.user_id,
-            "amount": invoice.amount,
-            "description": invoice.description,
-            "status": invoice.status,
-            "created_at": invoice.created_at.isoformat()
-        }), 200
+        return response
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_invoice: {str(e)}")
         return jsonify({"error": "An error occurred while fetching the invoice"}), 500
@@ -71,28 +105,99 @@ def get_invoice(invoice_id):
 @bp.route('/invoices', methods=['GET'])
 def list_invoices():
     try:
-        invoices = Invoice.query.all()
-        return jsonify([{
-            "id": invoice.id,
-            "user_id": invoice.user_id,
-            "amount": invoice.amount,
-            "description": invoice.description,
-            "status": invoice.status,
-            "created_at": invoice.created_at.isoformat()
-        } for invoice in invoices]), 200
+        return paginated_response(Invoice.query, INVOICE_ORDER, serialize_invoice)
+    except CursorError as err:
+        return jsonify({"error": "Invalid pagination parameters", "details": str(err)}), 400
     except SQLAlchemyError as e:
         logger.error(f"Database error in list_invoices: {str(e)}")
         return jsonify({"error": "An error occurred while fetching invoices"}), 500
 
+def serialize_payment_intent(intent):
+    return {
+        "id": intent.id,
+        "invoice_id": intent.invoice_id,
+        "amount": intent.amount,
+        "payment_method": intent.payment_method,
+        "status": intent.status,
+        "attempts": intent.attempts,
+        "gateway_reference": intent.gateway_reference,
+        "last_error": intent.last_error,
+        "created_at": intent.created_at.isoformat(),
+        "completed_at": intent.completed_at.isoformat() if intent.completed_at else None,
+        "status_url": url_for('payment.get_payment', intent_id=intent.id)
+    }
+
+def _intent_response(intent, status_code):
+    response = jsonify(serialize_payment_intent(intent))
+    response.status_code = status_code
+    response.headers['Location'] = url_for('payment.get_payment', intent_id=intent.id)
+    return response
+
+def _replay(intent, data):
+    # Same key, same request: answer as the first time. Same key, different request: refuse.
+    if (intent.invoice_id, intent.amount, intent.payment_method) != \
+            (data['invoice_id'], data['amount'], data['payment_method']):
+        return jsonify({"error": "Idempotency-Key was already used for a different payment"}), 422
+    return _intent_response(intent, 202 if intent.status in ACTIVE_STATUSES else 200)
+
+def _in_flight(invoice_id):
+    return PaymentIntent.query.filter(PaymentIntent.invoice_id == invoice_id,
+                                      PaymentIntent.status.in_(ACTIVE_STATUSES)).first()
+
+def _in_progress(intent):
+    return jsonify({"error": "A payment for this invoice is already in progress",
+                    "status_url": url_for('payment.get_payment', intent_id=intent.id)}), 409
+
 @bp.route('/payments', methods=['POST'])
 def process_payment():
+    """
+    Accept a payment for an invoice; the gateway is charged in the background
+    ---
+    parameters:
+      - name: Idempotency-Key
+        in: header
+        type: string
+        description: Retrying with the same key returns the original payment instead of charging again
+      - name: invoice_id
+        in: body
+        required: true
+        type: integer
+      - name: amount
+        in: body
+        required: true
+        type: number
+      - name: payment_method
+        in: body
+        required: true
+        type: string
+    responses:
+      202:
+        description: Payment accepted; poll the Location / status_url for the outcome
+      200:
+        description: Replay of a finished payment with the same Idempotency-Key
+      400:
+        description: Bad request
+      404:
+        description: Invoice not found
+      409:
+        description: A payment for this invoice is already in progress
+      422:
+        description: Idempotency-Key reused for a different payment
+    """
     try:
         schema = PaymentSchema()
         data = schema.load(request.json)
     except ValidationError as err:
         return jsonify({"error": "Invalid input", "details": err.messages}), 400
+    key = request.headers.get('Idempotency-Key') or uuid.uuid4().hex
+    if len(key) > 255:
+        return jsonify({"error": "Idempotency-Key must be at most 255 characters"}), 400
 
     try:
+        existing = PaymentIntent.query.filter_by(idempotency_key=key).first()
+        if existing:
+            return _replay(existing, data)
+
         invoice = Invoice.query.get(data['invoice_id'])
         if not invoice:
             return jsonify({"error": "Invoice not found"}), 404
@@ -103,36 +208,202 @@ def process_payment():
         if data['amount'] != invoice.amount:
             return jsonify({"error": "Payment amount does not match invoice amount"}), 400
 
-        # In a real-world scenario, you would integrate with a payment gateway here
-        # For this example, we'll just mark the invoice as paid
-        invoice.status = 'Paid'
-        db.session.commit()
+        in_flight = _in_flight(invoice.id)
+        if in_flight:
+            return _in_progress(in_flight)
 
-        return jsonify({"message": "Payment processed successfully"}), 200
+        intent = PaymentIntent(
+            invoice_id=invoice.id,
+            amount=data['amount'],
+            payment_method=data['payment_method'],
+            idempotency_key=key,
+            status='pending',
+            created_at=datetime.utcnow()
+        )
+        db.session.add(intent)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent request won the insert, with the same key or for the same invoice.
+            db.session.rollback()
+            existing = PaymentIntent.query.filter_by(idempotency_key=key).first()
+            if existing:
+                return _replay(existing, data)
+            in_flight = _in_flight(data['invoice_id'])
+            if in_flight:
+                return _in_progress(in_flight)
+            raise
+
+        payment_workers.start(current_app._get_current_object())
+        payment_workers.submit(intent.id)
+        return _intent_response(intent, 202)
     except SQLAlchemyError as e:
         logger.error(f"Database error in process_payment: {str(e)}")
         db.session.rollback()
         return jsonify({"error": "An error occurred while processing the payment"}), 500
 
+@bp.route('/payments/<int:intent_id>', methods=['GET'])
+def get_payment(intent_id):
+    """
+    Status of a payment
+    ---
+    responses:
+      200:
+        description: The payment intent; status is pending, processing, succeeded or failed
+      404:
+        description: Payment not found
+    """
+    try:
+        intent = db.session.get(PaymentIntent, intent_id)
+        if not intent:
+            return jsonify({"error": "Payment not found"}), 404
+        return jsonify(serialize_payment_intent(intent)), 200
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in get_payment: {str(e)}")
+        return jsonify({"error": "An error occurred while fetching the payment"}), 500
+
+@bp.route('/payments/metrics', methods=['GET'])
+def payment_metrics():
+    return jsonify(payment_workers.metrics()), 200
+
+def serialize_billing_row(row):
+    return {
+        "id": row.id,
+        "amount": row.amount,
+        "description": row.description,
+        "status": row.status,
+        "created_at": row.created_at.isoformat()
+    }
+
+def serialize_billing_summary(user_id, summary):
+    billed = summary.billed if summary else 0.0
+    paid = summary.paid if summary else 0.0
+    return {
+        "user_id": user_id,
+        "invoices": summary.invoices if summary else 0,
+        "billed": round(billed, 2),
+        "paid": round(paid, 2),
+        "outstanding": round(billed - paid, 2)
+    }
+
 @bp.route('/billing/history', methods=['GET'])
 def get_billing_history():
+    """
+    A rider's invoices, newest first, with their running totals
+    ---
+    parameters:
+      - name: user_id
+        in: query
+        required: true
+        type: integer
+      - name: limit
+        in: query
+        type: integer
+        description: Page size (default 100, max 1000)
+      - name: after
+        in: query
+        type: string
+        description: next_cursor from the previous page
+      - name: format
+        in: query
+        type: string
+        description: ndjson to stream every invoice instead of paging
+    responses:
+      200:
+        description: One page of invoices, next_cursor, and the rider's summary totals
+      400:
+        description: Bad request
+      404:
+        description: User not found
+    """
     try:
         user_id = request.args.get('user_id', type=int)
         if not user_id:
             return jsonify({"error": "User ID is required"}), 400
 
-        user = User.query.get(user_id)
-        if not user:
+        if not db.session.query(User.id).filter(User.id == user_id).first():
             return jsonify({"error": "User not found"}), 404
 
-        invoices = Invoice.query.filter_by(user_id=user_id).order_by(Invoice.created_at.desc()).all()
-        return jsonify([{
-            "id": invoice.id,
-            "amount": invoice.amount,
-            "description": invoice.description,
-            "status": invoice.status,
-            "created_at": invoice.created_at.isoformat()
-        } for invoice in invoices]), 200
+        # Column tuples straight off ix_invoice_user_created_id, no ORM objects.
+        query = db.session.query(*BILLING_HISTORY_COLUMNS).filter(Invoice.user_id == user_id)
+        limit, after = parse_page_args()
+        if wants_stream():
+            return ndjson_response(query, BILLING_HISTORY_ORDER, serialize_billing_row, after, descending=True)
+        rows, next_cursor = keyset_page(query, BILLING_HISTORY_ORDER, limit, after, descending=True)
+        return jsonify({
+            "data": [serialize_billing_row(row) for row in rows],
+            "next_cursor": next_cursor,
+            "summary": serialize_billing_summary(user_id, db.session.get(UserBillingSummary, user_id))
+        }), 200
+    except CursorError as err:
+        return jsonify({"error": "Invalid pagination parameters", "details": str(err)}), 400
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_billing_history: {str(e)}")
-        return jsonify({"error": "An error occurred while fetching billing history"}), 500
\ No newline at end of file
+        return jsonify({"error": "An error occurred while fetching billing history"}), 500
+
+@bp.route('/billing/summaries/rebuild', methods=['POST'])
+def rebuild_summaries():
+    """
+    Recompute every rider's billing summary from their invoices
+    ---
+    responses:
+      200:
+        description: Summaries rebuilt
+    """
+    try:
+        rows = rebuild_billing_summaries()
+        db.session.commit()
+        return jsonify({"message": "Billing summaries rebuilt successfully", "rows_written": rows}), 200
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in rebuild_summaries: {str(e)}")
+        db.session.rollback()
+        return jsonify({"error": "An error occurred while rebuilding billing summaries"}), 500
+
+@bp.route('/billing/close', methods=['POST'])
+def close_period():
+    """
+    Invoice every priced trip that ended in a period, one invoice per rider
+    ---
+    parameters:
+      - name: period_start
+        in: body
+        required: true
+        type: string
+        format: date-time
+      - name: period_end
+        in: body
+        required: true
+        type: string
+        format: date-time
+        description: Exclusive; must not be in the future
+    responses:
+      201:
+        description: Billing run with the number of invoices written, trips billed and the total amount
+      400:
+        description: Bad request
+      500:
+        description: Internal server error
+    """
+    try:
+        schema = BillingCloseSchema()
+        data = schema.load(request.json)
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+
+    try:
+        run = close_billing_period(naive_utc(data['period_start']), naive_utc(data['period_end']))
+        amount = db.session.query(func.coalesce(func.sum(Invoice.amount), 0)).filter(
+            Invoice.billing_run_id == run.id).scalar()
+        db.session.commit()
+        return jsonify({
+            "billing_run_id": run.id,
+            "period_start": run.period_start.isoformat(),
+            "period_end": run.period_end.isoformat(),
+            "invoices": run.invoices,
+            "trips": run.trips,
+            "amount": round(amount, 2)
+        }), 201
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in close_period: {str(e)}")
+        db.session.rollback()
+        return jsonify({"error": "An error occurred while closing the billing period"}), 500
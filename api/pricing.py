@@ -1,23 +1,66 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 from models import PricingRule
 from extensions import db
 from sqlalchemy.exc import SQLAlchemyError
 import logging
-from marshmallow import Schema, fields, ValidationError
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError
 import json
+from datetime import datetime
+from demand_model import demand_model
+from pricing_engine import RULE_TYPES, NoBasePrice, PricingRuleError, check_conditions, pricing_engine
 
 bp = Blueprint('pricing', __name__, url_prefix='/api/v1/pricing')
 
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
+MAX_QUOTES_PER_REQUEST = 1000
+
 class BasePriceSchema(Schema):
-    base_price = fields.Float(required=True)
+    base_price = fields.Float(required=True, validate=validate.Range(min=0))
+    per_minute = fields.Float(validate=validate.Range(min=0))
+    minimum_fare = fields.Float(validate=validate.Range(min=0))
 
 class SurgePricingSchema(Schema):
-    multiplier = fields.Float(required=True)
+    multiplier = fields.Float(required=True, validate=validate.Range(min=0))
     conditions = fields.Dict(required=True)
 
+class PricingRuleSchema(Schema):
+    name = fields.String(required=True, validate=validate.Length(min=1, max=80))
+    rule_type = fields.String(required=True, validate=validate.OneOf(RULE_TYPES))
+    price_modifier = fields.Float(required=True, validate=validate.Range(min=0))
+    conditions = fields.Dict(load_default=dict)
+
+class QuoteSchema(Schema):
+    start_time = fields.DateTime()  # Defaults to now
+    duration_minutes = fields.Float(load_default=0.0, validate=validate.Range(min=0, max=24 * 60))
+    latitude = fields.Float(validate=validate.Range(min=-90, max=90))
+    longitude = fields.Float(validate=validate.Range(min=-180, max=180))
+
+    @validates_schema
+    def validate_position(self, data, **kwargs):
+        if ('latitude' in data) != ('longitude' in data):
+            raise ValidationError("latitude and longitude go together")
+
+class BatchQuoteSchema(Schema):
+    quotes = fields.List(fields.Nested(QuoteSchema), required=True,
+                         validate=validate.Length(min=1, max=MAX_QUOTES_PER_REQUEST))
+
+# Quote endpoints are latency-sensitive; building a schema per request costs more than the quote itself.
+_quote_schema = QuoteSchema()
+_batch_quote_schema = BatchQuoteSchema()
+
+def _quote(config, data):
+    return pricing_engine.quote(config, data.get('start_time') or datetime.utcnow(), data['duration_minutes'],
+                                data.get('latitude'), data.get('longitude'))
+
+def _stored_conditions(rule):
+    try:
+        conditions = json.loads(rule.conditions) if rule.conditions else {}
+    except ValueError:
+        return {}
+    return conditions if isinstance(conditions, dict) else {}
+
 @bp.route('/base', methods=['POST'])
 def set_base_price():
     try:
@@ -26,19 +69,25 @@ def set_base_price():
     except ValidationError as err:
         return jsonify({"error": "Invalid input", "details": err.messages}), 400
 
+    conditions = {key: data[key] for key in ('per_minute', 'minimum_fare') if key in data}
     try:
-        base_price_rule = PricingRule.query.filter_by(rule_type='base').first()
+        # The newest base rule is the one quotes charge with; its other conditions stay as they are.
+        base_price_rule = PricingRule.query.filter_by(rule_type='base').order_by(PricingRule.id.desc()).first()
         if base_price_rule:
+            conditions = dict(_stored_conditions(base_price_rule), **conditions)
             base_price_rule.price_modifier = data['base_price']
+            base_price_rule.conditions = json.dumps(conditions) if conditions else None
         else:
             base_price_rule = PricingRule(
                 name='Base Price',
                 rule_type='base',
-                price_modifier=data['base_price']
+                price_modifier=data['base_price'],
+                conditions=json.dumps(conditions) if conditions else None
             )
             db.session.add(base_price_rule)
 
         db.session.commit()
+        pricing_engine.invalidate()
         return jsonify({"message": "Base price set successfully"}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in set_base_price: {str(e)}")
@@ -52,6 +101,10 @@ def set_surge_pricing():
         data = schema.load(request.json)
     except ValidationError as err:
         return jsonify({"error": "Invalid input", "details": err.messages}), 400
+    try:
+        check_conditions('surge', data['conditions'])
+    except PricingRuleError as err:
+        return jsonify({"error": "Invalid conditions", "details": str(err)}), 400
 
     try:
         surge_rule = PricingRule.query.filter_by(rule_type='surge').first()
@@ -68,6 +121,7 @@ def set_surge_pricing():
             db.session.add(surge_rule)
 
         db.session.commit()
+        pricing_engine.invalidate()
         return jsonify({"message": "Surge pricing rules set successfully"}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in set_surge_pricing: {str(e)}")
@@ -88,4 +142,157 @@ def get_pricing_rules():
         } for rule in rules]), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_pricing_rules: {str(e)}")
-        return jsonify({"error": "An error occurred while fetching pricing rules"}), 500
\ No newline at end of file
+        return jsonify({"error": "An error occurred while fetching pricing rules"}), 500
+
+@bp.route('/rules', methods=['POST'])
+def create_pricing_rule():
+    """
+    Add a pricing rule
+    ---
+    parameters:
+      - name: name
+        in: body
+        required: true
+        type: string
+      - name: rule_type
+        in: body
+        required: true
+        type: string
+        enum: [base, surge, time-based]
+      - name: price_modifier
+        in: body
+        required: true
+        type: number
+        description: Base fare for base rules, a multiplier otherwise
+      - name: conditions
+        in: body
+        type: object
+        description: >
+          Optional days (0 = Monday) and hours (local), zones as [lat, lon] points,
+          min_demand in trip starts per hour; per_minute and minimum_fare on base rules
+    responses:
+      201:
+        description: Rule created and live on the next quote
+      400:
+        description: Bad request
+    """
+    try:
+        schema = PricingRuleSchema()
+        data = schema.load(request.json)
+        check_conditions(data['rule_type'], data['conditions'])
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+    except PricingRuleError as err:
+        return jsonify({"error": "Invalid conditions", "details": str(err)}), 400
+
+    try:
+        rule = PricingRule(
+            name=data['name'],
+            rule_type=data['rule_type'],
+            price_modifier=data['price_modifier'],
+            conditions=json.dumps(data['conditions']) if data['conditions'] else None
+        )
+        db.session.add(rule)
+        db.session.commit()
+        pricing_engine.invalidate()
+        return jsonify({"message": "Pricing rule created successfully", "rule_id": rule.id}), 201
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in create_pricing_rule: {str(e)}")
+        db.session.rollback()
+        return jsonify({"error": "An error occurred while creating the pricing rule"}), 500
+
+@bp.route('/rules/<int:rule_id>', methods=['DELETE'])
+def delete_pricing_rule(rule_id):
+    try:
+        rule = PricingRule.query.get(rule_id)
+        if not rule:
+            return jsonify({"error": "Pricing rule not found"}), 404
+
+        db.session.delete(rule)
+        db.session.commit()
+        pricing_engine.invalidate()
+        return jsonify({"message": "Pricing rule deleted successfully"}), 200
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in delete_pricing_rule: {str(e)}")
+        db.session.rollback()
+        return jsonify({"error": "An error occurred while deleting the pricing rule"}), 500
+
+@bp.route('/quote', methods=['POST'])
+def quote_fare():
+    """
+    Quote a fare from the active pricing rules
+    ---
+    parameters:
+      - name: start_time
+        in: body
+        type: string
+        format: date-time
+        description: Defaults to now
+      - name: duration_minutes
+        in: body
+        type: number
+      - name: latitude
+        in: body
+        type: number
+      - name: longitude
+        in: body
+        type: number
+    responses:
+      200:
+        description: Fare with its base, multipliers and the ids of the rules applied
+      400:
+        description: Bad request
+      409:
+        description: No base price applies
+    """
+    try:
+        data = _quote_schema.load(request.json)
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+
+    app = current_app._get_current_object()
+    try:
+        demand_model.start(app)
+        return jsonify(_quote(app.config, data)), 200
+    except NoBasePrice as err:
+        return jsonify({"error": str(err)}), 409
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in quote_fare: {str(e)}")
+        return jsonify({"error": "An error occurred while loading pricing rules"}), 500
+
+@bp.route('/quote/batch', methods=['POST'])
+def quote_fares():
+    """
+    Quote many fares in one request
+    ---
+    parameters:
+      - name: quotes
+        in: body
+        required: true
+        type: array
+        items:
+          type: object
+    responses:
+      200:
+        description: One quote per input, in input order; an error entry where no base price applies
+      400:
+        description: Bad request
+    """
+    try:
+        data = _batch_quote_schema.load(request.json)
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+
+    app = current_app._get_current_object()
+    results = []
+    try:
+        demand_model.start(app)
+        for item in data['quotes']:
+            try:
+                results.append(_quote(app.config, item))
+            except NoBasePrice as err:
+                results.append({"error": str(err)})
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in quote_fares: {str(e)}")
+        return jsonify({"error": "An error occurred while loading pricing rules"}), 500
+    return jsonify({"quotes": results}), 200
@@ -1,11 +1,15 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 from models import Vehicle
 from extensions import db
 from sqlalchemy.exc import SQLAlchemyError
-import random
+from entity_cache import entity_cache
+from rebalancer import current_rebalancing_plan
+from demand_model import demand_model
 
 bp = Blueprint('rebalancing', __name__, url_prefix='/rebalancing')
 
+SUGGESTION_CHUNK_SIZE = 500
+
 @bp.route('/vehicles', methods=['GET'])
 def get_vehicles():
     """
@@ -65,6 +69,7 @@ def schedule_rebalancing_task():
         vehicle.location = data['new_location']
 
         db.session.commit()
+        entity_cache.invalidate('vehicle', vehicle.id)
 
         return jsonify({'message': 'Rebalancing task scheduled successfully'}), 201
     except SQLAlchemyError as e:
@@ -74,7 +79,7 @@ def schedule_rebalancing_task():
 @bp.route('/optimization/suggestions', methods=['POST'])
 def generate_optimization_suggestions():
     """
-    Generate AI-based optimization suggestions for vehicle placement
+    Suggest vehicle moves that match supply to forecast demand in a time range
     ---
     parameters:
       - name: time_range
@@ -82,9 +87,14 @@ def generate_optimization_suggestions():
         required: true
         type: string
         enum: [morning, afternoon, evening, night]
+      - name: limit
+        in: body
+        required: false
+        type: integer
+        description: Return only the highest-ranked moves
     responses:
       200:
-        description: Optimization suggestions for vehicle placement
+        description: Moves ranked by estimated extra trips per day in the time range, with a plan summary
       400:
         description: Bad request
       500:
@@ -94,28 +104,44 @@ def generate_optimization_suggestions():
         data = request.json
         if 'time_range' not in data or data['time_range'] not in ['morning', 'afternoon', 'evening', 'night']:
             return jsonify({'error': 'Invalid or missing time_range'}), 400
+        limit = data.get('limit')
+        if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit < 1):
+            return jsonify({'error': 'limit must be a positive integer'}), 400
 
         time_range = data['time_range']
 
-        vehicles = Vehicle.query.all()
+        app = current_app._get_current_object()
+        demand_model.start(app)
+        snapshot = demand_model.snapshot(app.config)
+        zones, summary, moves = current_rebalancing_plan(app.config, snapshot.forecast(time_range))
+        moves = moves[:limit] if limit else moves
+        details = {}
+        moved_ids = [move[2] for move in moves]
+        for offset in range(0, len(moved_ids), SUGGESTION_CHUNK_SIZE):
+            chunk = moved_ids[offset:offset + SUGGESTION_CHUNK_SIZE]
+            for vehicle_id, name, location in (db.session.query(Vehicle.id, Vehicle.name, Vehicle.location)
+                                               .filter(Vehicle.id.in_(chunk))):
+                details[vehicle_id] = (name, location)
 
-        # Simulating AI-based optimization suggestions
         suggestions = []
-        locations = ['Downtown', 'Suburb', 'Business District', 'Residential Area']
-        for vehicle in vehicles:
-            optimal_location = random.choice(locations)
-            if optimal_location != vehicle.location:
-                suggestions.append({
-                    'vehicle_id': vehicle.id,
-                    'vehicle_name': vehicle.name,
-                    'current_location': vehicle.location,
-                    'optimal_location': optimal_location,
-                    'action': 'Move'
-                })
+        for benefit, distance, vehicle_id, _, source, sink in moves:
+            name, location = details.get(vehicle_id, (None, None))
+            suggestions.append({
+                'vehicle_id': vehicle_id,
+                'vehicle_name': name,
+                'current_location': location,
+                'current_zone': zones.label(source),
+                'optimal_location': zones.label(sink),
+                'distance_m': round(distance, 1),
+                'estimated_benefit': benefit,
+                'action': 'Move'
+            })
 
         return jsonify({
             'time_range': time_range,
-            'total_vehicles': len(vehicles),
+            'total_vehicles': summary['vehicles'],
+            'forecast_built_at': snapshot.built_at.isoformat(),
+            'summary': summary,
             'optimization_suggestions': suggestions
         })
     except SQLAlchemyError as e:
@@ -1,10 +1,16 @@
-from flask import Blueprint, jsonify, request
-from models import Report, Vehicle, Trip
+from flask import Blueprint, current_app, jsonify, request, url_for
+from models import Fleet, FleetTripRollup, Report, Vehicle, VehicleTripRollup
 from extensions import db
+from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
 import logging
-from marshmallow import Schema, fields, ValidationError
+from marshmallow import Schema, fields, validate, validates, validates_schema, ValidationError
 from datetime import datetime, timedelta
+from timestamps import naive_utc
+import json
+from rollups import GRAINS, next_bucket, rebuild_trip_rollups, truncate, window_filter
+from report_jobs import (DEFAULT_CACHE_TTL_SECONDS, PENDING_STATUSES, REPORT_TYPES, canonical_params, content_json,
+                         encode_content, params_digest, report_jobs)
 
 bp = Blueprint('reporting', __name__, url_prefix='/api/v1')
 
@@ -12,36 +18,133 @@ logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
 class ReportSchema(Schema):
-    title = fields.String(required=True)
-    content = fields.Dict(required=True)
+    title = fields.String(required=True, validate=validate.Length(max=100))
+    content = fields.Dict()  # A finished report to store as-is
+    type = fields.String(validate=validate.OneOf(REPORT_TYPES))  # Or a report to generate in the background
+    params = fields.Dict(load_default=dict)
+
+    @validates_schema
+    def validate_source(self, data, **kwargs):
+        if ('content' in data) == ('type' in data):
+            raise ValidationError("Provide either content or a report type")
+
+WINDOW_UNITS = {'h': ('hours', 1), 'd': ('days', 24), 'w': ('days', 24 * 7)}
+MAX_WINDOW_HOURS = 366 * 24
+
+class UsageQuerySchema(Schema):
+    window = fields.String(load_default='30d', validate=validate.Regexp(r'^[1-9]\d*[hdw]$'))
+    fleet = fields.Integer()
+    vehicle_id = fields.Integer()
+
+    @validates('window')
+    def validate_window(self, value, **kwargs):
+        if _window_hours(value) > MAX_WINDOW_HOURS:
+            raise ValidationError(f"Window may not exceed {MAX_WINDOW_HOURS // 24} days")
+
+class FleetDashboardSchema(Schema):
+    window = fields.String(load_default='30d', validate=validate.Regexp(r'^[1-9]\d*[hdw]$'))
+    grain = fields.String(load_default='day', validate=validate.OneOf(GRAINS))
+
+    @validates('window')
+    def validate_window(self, value, **kwargs):
+        if _window_hours(value) > MAX_WINDOW_HOURS:
+            raise ValidationError(f"Window may not exceed {MAX_WINDOW_HOURS // 24} days")
+
+class RollupRebuildSchema(Schema):
+    start = fields.DateTime(required=True)
+    end = fields.DateTime(required=True)
+
+    @validates_schema
+    def validate_range(self, data, **kwargs):
+        if 'start' in data and 'end' in data and naive_utc(data['start']) >= naive_utc(data['end']):
+            raise ValidationError("start must be before end")
+
+def _window_hours(window):
+    return int(window[:-1]) * WINDOW_UNITS[window[-1]][1]
+
+def _window_label(window):
+    unit = WINDOW_UNITS[window[-1]][0]
+    count = _window_hours(window) // (1 if unit == 'hours' else 24)
+    return f"{count} {unit}"
+
+def _window_start(window):
+    # Rollups are hourly at the finest, so windows start on an hour boundary.
+    return truncate(datetime.utcnow() - timedelta(hours=_window_hours(window)), 'hour')
+
+def _window_end():
+    # Open-ended: includes the current, still-filling hour.
+    return next_bucket(truncate(datetime.utcnow(), 'hour'), 'hour')
 
 @bp.route('/analytics/usage', methods=['GET'])
 def get_usage_analytics():
+    """
+    Trip usage over a trailing window, read from the trip rollups
+    ---
+    parameters:
+      - name: window
+        in: query
+        type: string
+        description: Trailing window such as 24h, 30d or 2w (default 30d), rounded out to the hour
+      - name: fleet
+        in: query
+        type: integer
+      - name: vehicle_id
+        in: query
+        type: integer
+    responses:
+      200:
+        description: Totals plus per-vehicle usage
+      400:
+        description: Bad request
+    """
     try:
-        # Get usage data for the last 30 days
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        trips = Trip.query.filter(Trip.start_time >= thirty_days_ago).all()
-        vehicles = Vehicle.query.all()
+        schema = UsageQuerySchema()
+        args = schema.load(request.args)
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+
+    try:
+        rollup = VehicleTripRollup
+        per_vehicle = (
+            db.session.query(
+                rollup.vehicle_id,
+                func.sum(rollup.trips),
+                func.sum(rollup.ride_seconds),
+                func.sum(rollup.revenue),
+            )
+            .filter(window_filter(rollup, _window_start(args['window']), _window_end()))
+            .group_by(rollup.vehicle_id)
+        )
+        vehicles = db.session.query(Vehicle.id)
+        if 'fleet' in args:
+            fleet_vehicles = db.select(Vehicle.id).where(Vehicle.fleet_id == args['fleet'])
+            per_vehicle = per_vehicle.filter(rollup.vehicle_id.in_(fleet_vehicles))
+            vehicles = vehicles.filter(Vehicle.fleet_id == args['fleet'])
+        if 'vehicle_id' in args:
+            per_vehicle = per_vehicle.filter(rollup.vehicle_id == args['vehicle_id'])
+            vehicles = vehicles.filter(Vehicle.id == args['vehicle_id'])
 
-        total_trips = len(trips)
-        total_distance = sum((trip.end_time - trip.start_time).total_seconds() / 3600 for trip in trips if trip.end_time)  # Assuming 1 hour = 1 distance unit
-        avg_trip_duration = sum((trip.end_time - trip.start_time).total_seconds() for trip in trips if trip.end_time) / total_trips if total_trips > 0 else 0
+        counts = {vehicle_id: (trips, round(seconds, 3), revenue)
+                  for vehicle_id, trips, seconds, revenue in per_vehicle}
+        total_trips = sum(c[0] for c in counts.values())
+        total_seconds = sum(c[1] for c in counts.values())
 
         vehicle_usage = {}
-        for vehicle in vehicles:
-            vehicle_trips = [trip for trip in trips if trip.vehicle_id == vehicle.id]
-            vehicle_usage[vehicle.id] = {
-                'total_trips': len(vehicle_trips),
-                'total_distance': sum((trip.end_time - trip.start_time).total_seconds() / 3600 for trip in vehicle_trips if trip.end_time),
-                'utilization_rate': len(vehicle_trips) / total_trips if total_trips > 0 else 0
+        for (vehicle_id,) in vehicles:
+            trips, seconds, _ = counts.get(vehicle_id, (0, 0, 0))
+            vehicle_usage[vehicle_id] = {
+                'total_trips': trips,
+                'total_distance': seconds / 3600,  # Assuming 1 hour = 1 distance unit
+                'utilization_rate': trips / total_trips if total_trips > 0 else 0
             }
 
         usage_data = {
             'total_trips': total_trips,
-            'total_distance': total_distance,
-            'avg_trip_duration': avg_trip_duration,
+            'total_distance': total_seconds / 3600,
+            'avg_trip_duration': total_seconds / total_trips if total_trips > 0 else 0,
+            'total_revenue': round(sum(c[2] for c in counts.values()), 2),
             'vehicle_usage': vehicle_usage,
-            'period': '30 days'
+            'period': _window_label(args['window'])
         }
 
         return jsonify(usage_data), 200
@@ -49,41 +152,236 @@ def get_usage_analytics():
         logger.error(f"Database error in get_usage_analytics: {str(e)}")
         return jsonify({'error': 'An error occurred while fetching usage analytics'}), 500
 
+@bp.route('/analytics/fleets/<int:fleet_id>', methods=['GET'])
+def get_fleet_dashboard(fleet_id):
+    """
+    Trips, ride time and revenue for one fleet as an hourly, daily or monthly series
+    ---
+    parameters:
+      - name: fleet_id
+        in: path
+        type: integer
+        required: true
+      - name: window
+        in: query
+        type: string
+        description: Trailing window such as 24h, 30d or 2w (default 30d)
+      - name: grain
+        in: query
+        type: string
+        enum: [hour, day, month]
+    responses:
+      200:
+        description: Totals and one entry per bucket with trips
+      404:
+        description: Fleet not found
+    """
+    try:
+        schema = FleetDashboardSchema()
+        args = schema.load(request.args)
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+
+    try:
+        if not Fleet.query.get(fleet_id):
+            return jsonify({"error": "Fleet not found"}), 404
+
+        grain = args['grain']
+        since = truncate(_window_start(args['window']), grain)
+        rows = (FleetTripRollup.query
+                .filter(FleetTripRollup.grain == grain,
+                        FleetTripRollup.fleet_id == fleet_id,
+                        FleetTripRollup.bucket_start >= since)
+                .order_by(FleetTripRollup.bucket_start)
+                .all())
+        series = [{
+            'bucket_start': row.bucket_start.isoformat(),
+            'trips': row.trips,
+            'ride_seconds': round(row.ride_seconds, 3),
+            'revenue': round(row.revenue, 2)
+        } for row in rows]
+        return jsonify({
+            'fleet_id': fleet_id,
+            'grain': grain,
+            'period': _window_label(args['window']),
+            'totals': {
+                'trips': sum(r.trips for r in rows),
+                'ride_seconds': round(sum(r.ride_seconds for r in rows), 3),
+                'revenue': round(sum(r.revenue for r in rows), 2)
+            },
+            'series': series
+        }), 200
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in get_fleet_dashboard: {str(e)}")
+        return jsonify({'error': 'An error occurred while fetching the fleet dashboard'}), 500
+
+@bp.route('/analytics/rollups/rebuild', methods=['POST'])
+def rebuild_rollups():
+    """
+    Recompute trip rollups from raw trips for a range of start times
+    ---
+    parameters:
+      - name: range
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            start:
+              type: string
+              format: date-time
+            end:
+              type: string
+              format: date-time
+    responses:
+      200:
+        description: Range rebuilt (widened to whole months)
+      400:
+        description: Bad request
+    """
+    try:
+        schema = RollupRebuildSchema()
+        data = schema.load(request.json)
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+
+    try:
+        rows = rebuild_trip_rollups(naive_utc(data['start']), naive_utc(data['end']))
+        db.session.commit()
+        return jsonify({"message": "Rollups rebuilt successfully", "rows_written": rows}), 200
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in rebuild_rollups: {str(e)}")
+        db.session.rollback()
+        return jsonify({"error": "An error occurred while rebuilding rollups"}), 500
+
+def _job_status(report):
+    return {
+        "report_id": report.id,
+        "status": report.status,
+        "progress": report.progress,
+        "error": report.error,
+        "status_url": url_for('.get_report_status', report_id=report.id),
+        "created_at": report.created_at.isoformat(),
+        "completed_at": report.completed_at.isoformat() if report.completed_at else None
+    }
+
 @bp.route('/reports', methods=['POST'])
 def generate_report():
+    """
+    Store a finished report, or queue one for background generation
+    ---
+    parameters:
+      - name: report
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            title:
+              type: string
+            content:
+              type: object
+            type:
+              type: string
+              enum: [usage, fleet_activity]
+            params:
+              type: object
+    responses:
+      200:
+        description: An identical report finished within the cache TTL
+      201:
+        description: Report stored
+      202:
+        description: Report queued; poll status_url
+      400:
+        description: Bad request
+    """
     try:
         schema = ReportSchema()
         data = schema.load(request.json)
+        if 'type' in data:
+            params_schema, _ = REPORT_TYPES[data['type']]
+            params = params_schema().load(data['params'])
     except ValidationError as err:
         return jsonify({"error": "Invalid input", "details": err.messages}), 400
 
     try:
+        if 'content' in data:
+            text, packed = encode_content(data['content'])
+            new_report = Report(
+                title=data['title'],
+                content=text,
+                content_gzip=packed,
+                created_at=datetime.utcnow(),
+                completed_at=datetime.utcnow()
+            )
+            db.session.add(new_report)
+            db.session.commit()
+            return jsonify({"message": "Report generated successfully", "report_id": new_report.id}), 201
+
+        canonical = canonical_params(params)
+        digest = params_digest(data['type'], canonical)
+        ttl = current_app.config.get('REPORT_CACHE_TTL', DEFAULT_CACHE_TTL_SECONDS)
+        cached = (Report.query
+                  .filter(Report.params_hash == digest,
+                          Report.status.in_(PENDING_STATUSES + ('completed',)),
+                          Report.created_at >= datetime.utcnow() - timedelta(seconds=ttl))
+                  .order_by(Report.id.desc())
+                  .first())
+        if cached:
+            return jsonify(dict(_job_status(cached), message="Identical report reused", cached=True)), \
+                200 if cached.status == 'completed' else 202
+
         new_report = Report(
             title=data['title'],
-            content=str(data['content']),  # Convert dict to string for storage
+            report_type=data['type'],
+            params=canonical,
+            params_hash=digest,
+            status='queued',
+            progress=0,
             created_at=datetime.utcnow()
         )
         db.session.add(new_report)
         db.session.commit()
-        return jsonify({"message": "Report generated successfully", "report_id": new_report.id}), 201
+        report_jobs.start(current_app._get_current_object())
+        report_jobs.submit(new_report.id)
+        db.session.refresh(new_report)
+        response = jsonify(dict(_job_status(new_report), message="Report queued", cached=False))
+        response.headers['Location'] = url_for('.get_report_status', report_id=new_report.id)
+        return response, 202
     except SQLAlchemyError as e:
         logger.error(f"Database error in generate_report: {str(e)}")
         db.session.rollback()
         return jsonify({"error": "An error occurred while generating the report"}), 500
 
+@bp.route('/reports/<int:report_id>/status', methods=['GET'])
+def get_report_status(report_id):
+    try:
+        report = Report.query.get(report_id)
+        if not report:
+            return jsonify({"error": "Report not found"}), 404
+        return jsonify(_job_status(report)), 200
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in get_report_status: {str(e)}")
+        return jsonify({"error": "An error occurred while fetching the report status"}), 500
+
 @bp.route('/reports/<int:report_id>', methods=['GET'])
 def get_report(report_id):
     try:
         report = Report.query.get(report_id)
         if not report:
             return jsonify({"error": "Report not found"}), 404
+        if report.status != 'completed':
+            return jsonify(_job_status(report)), 202 if report.status in PENDING_STATUSES else 200
 
-        return jsonify({
+        # The stored JSON is spliced into the envelope instead of being parsed and re-encoded.
+        envelope = json.dumps({
             "id": report.id,
             "title": report.title,
-            "content": eval(report.content),  # Convert string back to dict
             "created_at": report.created_at.isoformat()
-        }), 200
+        }, separators=(',', ':'))
+        body = f'{envelope[:-1]},"content":{content_json(report) or "null"}}}'
+        return current_app.response_class(body, mimetype='application/json'), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_report: {str(e)}")
         return jsonify({"error": "An error occurred while fetching the report"}), 500
@@ -95,6 +393,7 @@ def list_reports():
         return jsonify([{
             "id": report.id,
             "title": report.title,
+            "status": report.status,
             "created_at": report.created_at.isoformat()
         } for report in reports]), 200
     except SQLAlchemyError as e:
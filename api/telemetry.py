@@ -0,0 +1,97 @@
+from flask import Blueprint, current_app, jsonify, request
+import logging
+import time
+from telemetry_buffer import telemetry_buffer
+
+bp = Blueprint('telemetry', __name__, url_prefix='/api/v1/telemetry')
+
+logging.basicConfig(level=logging.ERROR)
+logger = logging.getLogger(__name__)
+
+MAX_PINGS_PER_REQUEST = 10000
+# A stored position is only replaced by a newer ping, so one from the far
+# future would pin a vehicle in place; allow this much device clock skew.
+MAX_CLOCK_SKEW_S = 300
+
+def _parse_ping(ping, now):
+    # Hand-rolled instead of a marshmallow schema: this runs for every ping
+    # at tens of thousands per second.
+    vehicle_id = ping.get('vehicle_id')
+    lat = ping.get('latitude')
+    lon = ping.get('longitude')
+    if type(vehicle_id) is not int or vehicle_id < 1:
+        return None, "vehicle_id must be a positive integer"
+    if not isinstance(lat, (int, float)) or not -90 <= lat <= 90:
+        return None, "latitude must be a number between -90 and 90"
+    if not isinstance(lon, (int, float)) or not -180 <= lon <= 180:
+        return None, "longitude must be a number between -180 and 180"
+    status = ping.get('status')
+    if status is not None and not isinstance(status, str):
+        return None, "status must be a string"
+    ts = ping.get('timestamp', now)
+    if not isinstance(ts, (int, float)):
+        return None, "timestamp must be epoch seconds"
+    if ts > now + MAX_CLOCK_SKEW_S:
+        return None, "timestamp is in the future"
+    return (vehicle_id, float(lat), float(lon), status, ts), None
+
+@bp.route('', methods=['POST'])
+def ingest_telemetry():
+    """
+    Buffer a batch of vehicle position pings
+    ---
+    parameters:
+      - name: pings
+        in: body
+        required: true
+        type: array
+        items:
+          type: object
+          properties:
+            vehicle_id:
+              type: integer
+            latitude:
+              type: number
+            longitude:
+              type: number
+            status:
+              type: string
+            timestamp:
+              type: number
+    responses:
+      202:
+        description: Pings accepted for the next flush
+      400:
+        description: Bad request
+      503:
+        description: Buffer full, retry later
+    """
+    payload = request.get_json(silent=True)
+    pings = payload.get('pings') if isinstance(payload, dict) else payload
+    if not isinstance(pings, list):
+        return jsonify({"error": "Invalid input", "details": "Expected a list of pings"}), 400
+    if len(pings) > MAX_PINGS_PER_REQUEST:
+        return jsonify({"error": f"At most {MAX_PINGS_PER_REQUEST} pings per request"}), 413
+
+    now = time.time()
+    parsed, errors = [], []
+    for index, ping in enumerate(pings):
+        if not isinstance(ping, dict):
+            errors.append({"index": index, "details": "Expected a JSON object"})
+            continue
+        value, error = _parse_ping(ping, now)
+        if error:
+            errors.append({"index": index, "details": error})
+        else:
+            parsed.append(value)
+
+    telemetry_buffer.start(current_app._get_current_object())
+    dropped = telemetry_buffer.add(parsed)
+    body = {"accepted": len(parsed) - dropped, "dropped": dropped, "errors": errors}
+    if parsed and dropped == len(parsed):
+        return jsonify(body), 503, {'Retry-After': '1'}
+    return jsonify(body), 202
+
+@bp.route('/metrics', methods=['GET'])
+def telemetry_metrics():
+    return jsonify(telemetry_buffer.metrics()), 200
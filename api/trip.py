@@ -1,24 +1,51 @@
-from flask import Blueprint, jsonify, request
-from models import Trip, Vehicle
+from flask import Blueprint, current_app, jsonify, request
+from models import Trip, User, Vehicle
 from extensions import db
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 from marshmallow import Schema, fields, ValidationError
 from datetime import datetime
+from pagination import CursorError, paginated_response
+from entity_cache import cached_entity_response, entity_cache, row_etag
+from gbfs_snapshot import publish_vehicle
+from rollups import record_trip_end, record_trip_start
+from spatial_index import index_vehicle
+from billing import DEFAULT_INVOICING, invoice_trip, price_trip
+from demand_model import demand_model
 
 bp = Blueprint('trip', __name__, url_prefix='/api/v1/trips')
 
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
+TRIP_ORDER = (Trip.start_time, Trip.id)
+
 class TripSchema(Schema):
     vehicle_id = fields.Integer(required=True)
+    user_id = fields.Integer()
     start_location = fields.String(required=True)
     end_location = fields.String(required=False)
 
 class EndTripSchema(Schema):
     end_location = fields.String(required=True)
 
+def serialize_trip(trip):
+    return {
+        "id": trip.id,
+        "vehicle_id": trip.vehicle_id,
+        "user_id": trip.user_id,
+        "start_location": trip.start_location,
+        "end_location": trip.end_location,
+        "start_time": trip.start_time.isoformat(),
+        "end_time": trip.end_time.isoformat() if trip.end_time else None,
+        "fare": trip.fare
+    }
+
+def _vehicle_availability_changed(vehicle):
+    entity_cache.invalidate('vehicle', vehicle.id)
+    index_vehicle(vehicle)
+    publish_vehicle(vehicle)
+
 @bp.route('', methods=['POST'])
 def start_trip():
     try:
@@ -31,14 +58,22 @@ def start_trip():
         vehicle = Vehicle.query.get(data['vehicle_id'])
         if not vehicle:
             return jsonify({"error": "Vehicle not found"}), 404
+        if data.get('user_id') is not None and not User.query.get(data['user_id']):
+            return jsonify({"error": "User not found"}), 404
 
         new_trip = Trip(
             vehicle_id=data['vehicle_id'],
+            user_id=data.get('user_id'),
             start_location=data['start_location'],
+            start_latitude=vehicle.latitude,
+            start_longitude=vehicle.longitude,
             start_time=datetime.utcnow()
         )
+        vehicle.status = 'in_use'
         db.session.add(new_trip)
+        record_trip_start(new_trip, vehicle.fleet_id)
         db.session.commit()
+        _vehicle_availability_changed(vehicle)
         return jsonify({"message": "Trip started successfully", "trip_id": new_trip.id}), 201
     except SQLAlchemyError as e:
         logger.error(f"Database error in start_trip: {str(e)}")
@@ -63,28 +98,42 @@ def end_trip(trip_id):
 
         trip.end_location = data['end_location']
         trip.end_time = datetime.utcnow()
+        vehicle = Vehicle.query.get(trip.vehicle_id)
+        if vehicle and vehicle.status == 'in_use':
+            vehicle.status = 'available'
+        # Fare, invoice and rollups commit together with the trip's end.
+        app = current_app._get_current_object()
+        demand_model.start(app)
+        price_trip(trip, app.config)
+        invoice = None
+        if trip.fare is not None and trip.user_id is not None and \
+                app.config.get('TRIP_INVOICING', DEFAULT_INVOICING) == 'per_trip':
+            invoice = invoice_trip(trip)
+        record_trip_end(trip, vehicle.fleet_id if vehicle else None)
         db.session.commit()
-        return jsonify({"message": "Trip ended successfully"}), 200
+        entity_cache.invalidate('trip', trip_id)
+        if vehicle:
+            _vehicle_availability_changed(vehicle)
+        return jsonify({"message": "Trip ended successfully", "fare": trip.fare,
+                        "invoice_id": invoice.id if invoice else None}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in end_trip: {str(e)}")
         db.session.rollback()
         return jsonify({"error": "An error occurred while ending the trip"}), 500
 
+def _load_trip(trip_id):
+    trip = Trip.query.get(trip_id)
+    if not trip:
+        return None
+    return row_etag(trip, trip.start_time), serialize_trip(trip)
+
 @bp.route('/<int:trip_id>', methods=['GET'])
 def get_trip(trip_id):
     try:
-        trip = Trip.query.get(trip_id)
-        if not trip:
+        response = cached_entity_response('trip', trip_id, lambda: _load_trip(trip_id))
+        if response is None:
             return jsonify({"error": "Trip not found"}), 404
-
-        return jsonify({
-            "id": trip.id,
-            "vehicle_id": trip.vehicle_id,
-            "start_location": trip.start_location,
-            "end_location": trip.end_location,
-            "start_time": trip.start_time.isoformat(),
-            "end_time": trip.end_time.isoformat() if trip.end_time else None
-        }), 200
+        return response
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_trip: {str(e)}")
         return jsonify({"error": "An error occurred while fetching the trip"}), 500
@@ -92,15 +141,9 @@ def get_trip(trip_id):
 @bp.route('', methods=['GET'])
 def list_trips():
     try:
-        trips = Trip.query.all()
-        return jsonify([{
-            "id": trip.id,
-            "vehicle_id": trip.vehicle_id,
-            "start_location": trip.start_location,
-            "end_location": trip.end_location,
-            "start_time": trip.start_time.isoformat(),
-            "end_time": trip.end_time.isoformat() if trip.end_time else None
-        } for trip in trips]), 200
+        return paginated_response(Trip.query, TRIP_ORDER, serialize_trip)
+    except CursorError as err:
+        return jsonify({"error": "Invalid pagination parameters", "details": str(err)}), 400
     except SQLAlchemyError as e:
         logger.error(f"Database error in list_trips: {str(e)}")
         return jsonify({"error": "An error occurred while fetching trips"}), 500
\ No newline at end of file
@@ -3,10 +3,13 @@ from models import User
 from extensions import db
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
+from auth_tokens import token_auth
+from permissions import require_permission
 
 bp = Blueprint('user', __name__, url_prefix='/user')
 
 @bp.route('/access', methods=['POST'])
+@require_permission('roles:manage')
 def manage_access():
     """
     Grant or revoke access based on roles
@@ -30,6 +33,10 @@ def manage_access():
         description: Access updated
       400:
         description: Bad request
+      401:
+        description: Missing, invalid or expired token
+      403:
+        description: Caller lacks roles:manage
       404:
         description: User not found
       500:
@@ -53,6 +60,7 @@ def manage_access():
             user.role = 'user'
 
         db.session.commit()
+        token_auth.invalidate_user(user.id)
         return jsonify({'message': f"Access {data['action']}ed for {user.username}"})
     except SQLAlchemyError as e:
         db.session.rollback()
@@ -1,19 +1,59 @@
 from flask import Blueprint, jsonify, request
-from models import Vehicle
+from models import Fleet, Vehicle
 from extensions import db
+from sqlalchemy import insert, update
 from sqlalchemy.exc import SQLAlchemyError
 import logging
-from marshmallow import Schema, fields, ValidationError
+import json
+from marshmallow import Schema, fields, validate, validates_schema, ValidationError
+from pagination import CursorError, paginated_response
+from entity_cache import cached_entity_response, entity_cache, row_etag
+from gbfs_snapshot import gbfs_snapshot, publish_vehicle
+from spatial_index import ensure_vehicle_index, index_vehicle, index_vehicle_values, vehicle_index
 
 bp = Blueprint('vehicle', __name__, url_prefix='/api/v1/vehicles')
 
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
+VEHICLE_ORDER = (Vehicle.created_at, Vehicle.id)
+MAX_BULK_ITEMS = 10000
+BULK_CHUNK_SIZE = 500  # Keeps IN lists and multi-row VALUES under driver parameter limits
+REQUIRED_VEHICLE_FIELDS = ('name', 'status', 'location')
+
 class VehicleSchema(Schema):
+    serial_number = fields.String(validate=validate.Length(min=1, max=64))
     name = fields.String(required=True)
     status = fields.String(required=True)
     location = fields.String(required=True)
+    latitude = fields.Float(allow_none=True, validate=validate.Range(min=-90, max=90))
+    longitude = fields.Float(allow_none=True, validate=validate.Range(min=-180, max=180))
+    fleet_id = fields.Integer(allow_none=True)
+
+    @validates_schema
+    def validate_coordinates(self, data, **kwargs):
+        if ('latitude' in data) != ('longitude' in data):
+            raise ValidationError("latitude and longitude must be given together")
+
+class NearbySchema(Schema):
+    lat = fields.Float(required=True, validate=validate.Range(min=-90, max=90))
+    lon = fields.Float(required=True, validate=validate.Range(min=-180, max=180))
+    radius = fields.Float(validate=validate.Range(min=0, max=50000))  # meters
+    limit = fields.Integer(load_default=10, validate=validate.Range(min=1, max=1000))
+    status = fields.String()
+
+def serialize_vehicle(vehicle):
+    return {
+        "id": vehicle.id,
+        "serial_number": vehicle.serial_number,
+        "name": vehicle.name,
+        "status": vehicle.status,
+        "location": vehicle.location,
+        "latitude": vehicle.latitude,
+        "longitude": vehicle.longitude,
+        "fleet_id": vehicle.fleet_id,
+        "created_at": vehicle.created_at.isoformat()
+    }
 
 @bp.route('', methods=['POST'])
 def create_vehicle():
@@ -24,29 +64,33 @@ def create_vehicle():
         return jsonify({"error": "Invalid input", "details": err.messages}), 400
 
     try:
+        if data.get('fleet_id') is not None and not Fleet.query.get(data['fleet_id']):
+            return jsonify({"error": "Fleet not found"}), 400
+
         new_vehicle = Vehicle(**data)
         db.session.add(new_vehicle)
         db.session.commit()
+        index_vehicle(new_vehicle)
+        publish_vehicle(new_vehicle)
         return jsonify({"message": "Vehicle created successfully", "vehicle_id": new_vehicle.id}), 201
     except SQLAlchemyError as e:
         logger.error(f"Database error in create_vehicle: {str(e)}")
         db.session.rollback()
         return jsonify({"error": "An error occurred while creating the vehicle"}), 500
 
+def _load_vehicle(vehicle_id):
+    vehicle = Vehicle.query.get(vehicle_id)
+    if not vehicle:
+        return None
+    return row_etag(vehicle, vehicle.created_at), serialize_vehicle(vehicle)
+
 @bp.route('/<int:vehicle_id>', methods=['GET'])
 def get_vehicle(vehicle_id):
     try:
-        vehicle = Vehicle.query.get(vehicle_id)
-        if not vehicle:
+        response = cached_entity_response('vehicle', vehicle_id, lambda: _load_vehicle(vehicle_id))
+        if response is None:
             return jsonify({"error": "Vehicle not found"}), 404
-
-        return jsonify({
-            "id": vehicle.id,
-            "name": vehicle.name,
-            "status": vehicle.status,
-            "location": vehicle.location,
-            "created_at": vehicle.created_at.isoformat()
-        }), 200
+        return response
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_vehicle: {str(e)}")
         return jsonify({"error": "An error occurred while fetching the vehicle"}), 500
@@ -63,11 +107,16 @@ def update_vehicle(vehicle_id):
         vehicle = Vehicle.query.get(vehicle_id)
         if not vehicle:
             return jsonify({"error": "Vehicle not found"}), 404
+        if data.get('fleet_id') is not None and not Fleet.query.get(data['fleet_id']):
+            return jsonify({"error": "Fleet not found"}), 400
 
         for key, value in data.items():
             setattr(vehicle, key, value)
 
         db.session.commit()
+        entity_cache.invalidate('vehicle', vehicle_id)
+        index_vehicle(vehicle)
+        publish_vehicle(vehicle)
         return jsonify({"message": "Vehicle updated successfully"}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in update_vehicle: {str(e)}")
@@ -83,6 +132,9 @@ def delete_vehicle(vehicle_id):
 
         db.session.delete(vehicle)
         db.session.commit()
+        entity_cache.invalidate('vehicle', vehicle_id)
+        vehicle_index.remove(vehicle_id)
+        gbfs_snapshot.remove(vehicle_id)
         return jsonify({"message": "Vehicle deleted successfully"}), 200
     except SQLAlchemyError as e:
         logger.error(f"Database error in delete_vehicle: {str(e)}")
@@ -92,14 +144,153 @@ def delete_vehicle(vehicle_id):
 @bp.route('', methods=['GET'])
 def list_vehicles():
     try:
-        vehicles = Vehicle.query.all()
-        return jsonify([{
-            "id": v.id,
-            "name": v.name,
-            "status": v.status,
-            "location": v.location,
-            "created_at": v.created_at.isoformat()
-        } for v in vehicles]), 200
+        return paginated_response(Vehicle.query, VEHICLE_ORDER, serialize_vehicle)
+    except CursorError as err:
+        return jsonify({"error": "Invalid pagination parameters", "details": str(err)}), 400
     except SQLAlchemyError as e:
         logger.error(f"Database error in list_vehicles: {str(e)}")
-        return jsonify({"error": "An error occurred while fetching vehicles"}), 500
\ No newline at end of file
+        return jsonify({"error": "An error occurred while fetching vehicles"}), 500
+
+@bp.route('/nearby', methods=['GET'])
+def nearby_vehicles():
+    try:
+        schema = NearbySchema()
+        args = schema.load(request.args)
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+
+    try:
+        index = ensure_vehicle_index()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in nearby_vehicles: {str(e)}")
+        return jsonify({"error": "An error occurred while fetching nearby vehicles"}), 500
+
+    if 'radius' in args:
+        hits = index.within(args['lat'], args['lon'], args['radius'], status=args.get('status'), limit=args['limit'])
+    else:
+        hits = index.nearest(args['lat'], args['lon'], args['limit'], status=args.get('status'))
+    return jsonify({"data": [{
+        "id": vehicle_id,
+        "latitude": lat,
+        "longitude": lon,
+        "status": status,
+        "distance_m": round(distance, 1)
+    } for distance, vehicle_id, lat, lon, status in hits]}), 200
+
+def _parse_bulk_body():
+    """Return ``(items, errors)`` from a JSON array or an NDJSON body."""
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items, errors = [], []
+        for line in request.get_data(as_text=True).splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                errors.append({"index": len(items), "details": f"Invalid JSON: {e.msg}"})
+                items.append(None)
+        return items, errors
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('vehicles')
+    if not isinstance(payload, list):
+        raise ValidationError("Expected a JSON array of vehicles or an NDJSON body")
+    return payload, []
+
+def _chunks(items, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+@bp.route('/bulk', methods=['POST'])
+def bulk_upsert_vehicles():
+    try:
+        items, errors = _parse_bulk_body()
+    except ValidationError as err:
+        return jsonify({"error": "Invalid input", "details": err.messages}), 400
+    if len(items) > MAX_BULK_ITEMS:
+        return jsonify({"error": f"At most {MAX_BULK_ITEMS} vehicles per request"}), 413
+
+    schema = VehicleSchema(partial=True)
+    valid = []
+    seen_serials = set()
+    for index, item in enumerate(items):
+        if item is None:
+            continue
+        if not isinstance(item, dict):
+            errors.append({"index": index, "details": "Expected a JSON object"})
+            continue
+        try:
+            data = schema.load(item)
+        except ValidationError as err:
+            errors.append({"index": index, "details": err.messages})
+            continue
+        serial = data.get('serial_number')
+        if serial is not None:
+            if serial in seen_serials:
+                errors.append({"index": index, "details": {"serial_number": ["Duplicate serial_number in request."]}})
+                continue
+            seen_serials.add(serial)
+        valid.append((index, data))
+
+    try:
+        existing = {}
+        for serials in _chunks(list(seen_serials)):
+            existing.update(db.session.query(Vehicle.serial_number, Vehicle.id)
+                            .filter(Vehicle.serial_number.in_(serials)))
+        fleet_ids = list({data['fleet_id'] for _, data in valid if data.get('fleet_id') is not None})
+        known_fleets = set()
+        for ids in _chunks(fleet_ids):
+            known_fleets.update(db.session.scalars(db.select(Fleet.id).where(Fleet.id.in_(ids))))
+
+        inserts, insert_indexes, updates = [], [], []
+        for index, data in valid:
+            if data.get('fleet_id') is not None and data['fleet_id'] not in known_fleets:
+                errors.append({"index": index, "details": {"fleet_id": ["Fleet not found."]}})
+                continue
+            vehicle_id = existing.get(data.get('serial_number'))
+            if vehicle_id is not None:
+                updates.append(dict(data, id=vehicle_id))
+                continue
+            missing = [f for f in REQUIRED_VEHICLE_FIELDS if f not in data]
+            if missing:
+                errors.append({"index": index, "details": {f: ["Missing data for required field."] for f in missing}})
+                continue
+            inserts.append(data)
+            insert_indexes.append(index)
+
+        created_ids = []
+        for chunk in _chunks(inserts):
+            result = db.session.execute(
+                insert(Vehicle).returning(Vehicle.id, sort_by_parameter_order=True), chunk)
+            created_ids.extend(result.scalars())
+        for chunk in _chunks(updates):
+            db.session.execute(update(Vehicle), chunk)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in bulk_upsert_vehicles: {str(e)}")
+        db.session.rollback()
+        return jsonify({"error": "An error occurred while saving vehicles"}), 500
+
+    entity_cache.invalidate('vehicle', *(u['id'] for u in updates))
+    for vehicle_id, data in zip(created_ids, inserts):
+        index_vehicle_values(vehicle_id, data.get('latitude'), data.get('longitude'), data['status'])
+        gbfs_snapshot.upsert(vehicle_id, data.get('latitude'), data.get('longitude'), data['status'])
+    if updates and (vehicle_index.loaded or gbfs_snapshot.loaded):
+        # Partial updates may not carry every indexed field, so re-read them.
+        try:
+            for ids in _chunks([u['id'] for u in updates]):
+                for vehicle in db.session.query(Vehicle.id, Vehicle.latitude, Vehicle.longitude,
+                                                Vehicle.status, Vehicle.source).filter(Vehicle.id.in_(ids)):
+                    index_vehicle(vehicle)
+                    publish_vehicle(vehicle)
+        except SQLAlchemyError as e:
+            logger.error(f"Database error re-indexing vehicles: {str(e)}")
+            vehicle_index.clear()
+            gbfs_snapshot.clear()
+
+    errors.sort(key=lambda e: e['index'])
+    return jsonify({
+        "created": [{"index": i, "vehicle_id": v} for i, v in zip(insert_indexes, created_ids)],
+        "updated": len(updates),
+        "errors": errors
+    }), 200
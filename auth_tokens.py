@@ -0,0 +1,129 @@
+import functools
+import logging
+from collections import namedtuple
+
+from flask import current_app, g, jsonify, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import select
+
+from entity_cache import EntityCache
+from extensions import db
+from models import Role, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_TTL_S = 3600
+# Also the longest a role change or deleted user takes to reach other workers.
+DEFAULT_PRINCIPAL_TTL_S = 15
+DEFAULT_PRINCIPAL_CACHE_SIZE = 10000
+TOKEN_SALT = 'access-token'
+# The default main.py used to ship; anyone can read it, so it signs nothing.
+PLACEHOLDER_SECRET_KEY = 'your-secret-key'
+
+Principal = namedtuple('Principal', ['id', 'username', 'email', 'role_id', 'role'])
+
+class TokenSecretMissing(RuntimeError):
+    """SECRET_KEY is unset or the public placeholder, so tokens can be neither issued nor trusted."""
+
+def secret_key_configured(config):
+    secret = config.get('SECRET_KEY')
+    return bool(secret) and secret != PLACEHOLDER_SECRET_KEY
+
+class TokenAuth:
+    """Signed, expiring access tokens and the cached principal lookup behind them.
+
+    A token carries only the user id and is checked against SECRET_KEY in
+    memory. User and role records stay cached for PRINCIPAL_CACHE_TTL_S,
+    so a request with a warm token costs no queries. The endpoints that
+    change users or roles invalidate their entries only in the process
+    that handled them: elsewhere a revoked role or deleted user keeps
+    working for up to PRINCIPAL_CACHE_TTL_S in each server worker.
+    """
+
+    def __init__(self):
+        self.cache = EntityCache(max_entries=DEFAULT_PRINCIPAL_CACHE_SIZE, ttl=DEFAULT_PRINCIPAL_TTL_S)
+        self._serializers = {}
+
+    def _serializer(self, config):
+        if not secret_key_configured(config):
+            raise TokenSecretMissing("SECRET_KEY is not set to a private value")
+        secret = config['SECRET_KEY']
+        serializer = self._serializers.get(secret)
+        if serializer is None:
+            serializer = self._serializers[secret] = URLSafeTimedSerializer(secret, salt=TOKEN_SALT)
+        return serializer
+
+    def issue(self, user, config):
+        """Return ``(token, expires_in_seconds)`` for ``user``; raises ``TokenSecretMissing`` without a key."""
+        return self._serializer(config).dumps(user.id), config.get('ACCESS_TOKEN_TTL_S', DEFAULT_TOKEN_TTL_S)
+
+    def verify(self, token, config):
+        """User id ``token`` was issued for, or ``None`` if it is forged, malformed or expired.
+
+        Without a private SECRET_KEY no token is trusted.
+        """
+        try:
+            user_id = self._serializer(config).loads(
+                token, max_age=config.get('ACCESS_TOKEN_TTL_S', DEFAULT_TOKEN_TTL_S))
+        except BadSignature:
+            return None
+        except TokenSecretMissing:
+            logger.error("Rejecting access token: SECRET_KEY is not set to a private value")
+            return None
+        return user_id if isinstance(user_id, int) else None
+
+    def principal(self, user_id, config):
+        """The cached ``Principal`` for ``user_id``, or ``None`` if the user no longer exists."""
+        ttl = config.get('PRINCIPAL_CACHE_TTL_S')
+        user = self.cache.get(('user', user_id))
+        if user is None:
+            row = db.session.execute(
+                select(User.id, User.username, User.email, User.role_id).where(User.id == user_id)).first()
+            if row is None:
+                return None
+            user = tuple(row)
+            self.cache.set(('user', user_id), user, ttl)
+        role_id = user[3]
+        role = None
+        if role_id is not None:
+            cached = self.cache.get(('role', role_id))
+            if cached is None:
+                cached = (db.session.execute(select(Role.name).where(Role.id == role_id)).scalar(),)
+                self.cache.set(('role', role_id), cached, ttl)
+            role = cached[0]
+        return Principal(*user, role)
+
+    def authenticate(self):
+        """``before_app_request`` hook: set ``g.principal`` from a Bearer token, or to ``None``."""
+        g.principal = None
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return
+        user_id = self.verify(token, current_app.config)
+        if user_id is not None:
+            g.principal = self.principal(user_id, current_app.config)
+
+    def invalidate_user(self, *user_ids):
+        self.cache.invalidate('user', *user_ids)
+
+    def invalidate_role(self, *role_ids):
+        self.cache.invalidate('role', *role_ids)
+
+token_auth = TokenAuth()
+
+def current_principal():
+    """The authenticated ``Principal`` of this request, or ``None``."""
+    if 'principal' not in g:
+        token_auth.authenticate()
+    return g.principal
+
+def login_required(view):
+    """Reject requests without a valid access token with 401."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_principal() is None:
+            response = jsonify({"error": "A valid access token is required"})
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response, 401
+        return view(*args, **kwargs)
+    return wrapper
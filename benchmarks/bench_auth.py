@@ -0,0 +1,88 @@
+"""Per-request cost of access-token authentication.
+
+Times a trivial endpoint three ways through the Flask test client: without
+authentication, behind ``login_required`` with the principal cache warm,
+and with the cache emptied before every request (one user and one role
+lookup each time). Also counts the SQL statements each authenticated
+request runs and times token verification on its own.
+Usage: python benchmarks/bench_auth.py [requests] [users]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+from sqlalchemy import event, insert
+from extensions import db
+from models import Role, User
+from auth_tokens import current_principal, login_required, token_auth
+from api import auth
+
+ROLES = 5
+
+def _time(client, path, tokens, requests, before=None):
+    timings = []
+    for n in range(requests):
+        if before:
+            before()
+        headers = {'Authorization': f"Bearer {tokens[n % len(tokens)]}"} if tokens else {}
+        start = time.perf_counter()
+        response = client.get(path, headers=headers)
+        timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.get_json()
+    timings.sort()
+    return statistics.median(timings) * 1e6, timings[int(len(timings) * 0.99)] * 1e6
+
+def main(requests=20000, users=1000):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app.config['SECRET_KEY'] = 'bench-secret'
+        db.init_app(app)
+        app.register_blueprint(auth.bp)
+
+        @app.route('/open')
+        def open_endpoint():
+            return jsonify({"ok": True})
+
+        @app.route('/private')
+        @login_required
+        def private_endpoint():
+            return jsonify({"ok": True, "user": current_principal().id})
+
+        with app.app_context():
+            db.create_all()
+            db.session.execute(insert(Role), [{"name": f"role{i}"} for i in range(ROLES)])
+            db.session.execute(insert(User), [
+                {"username": f"u{i}", "email": f"u{i}@example.com", "role_id": i % ROLES + 1} for i in range(users)])
+            db.session.commit()
+            tokens = [token_auth.issue(user, app.config)[0] for user in User.query.all()]
+            statements = [0]
+            event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.__setitem__(0, statements[0] + 1))
+
+        client = app.test_client()
+        _time(client, '/private', tokens, len(tokens))  # warm every user into the cache
+        rows = []
+        for label, path, request_tokens, before in (
+                ("no auth", '/open', None, None),
+                ("token, warm cache", '/private', tokens, None),
+                ("token, cold cache", '/private', tokens, token_auth.cache.clear)):
+            statements[0] = 0
+            p50, p99 = _time(client, path, request_tokens, requests, before)
+            rows.append((label, p50, p99, statements[0] / requests))
+        for label, p50, p99, per_request in rows:
+            print(f"{label:18s} p50 {p50:7.1f} us  p99 {p99:7.1f} us  {per_request:.2f} SQL statements/request")
+        print(f"auth overhead with a warm cache: {rows[1][1] - rows[0][1]:.1f} us per request (p50)")
+
+        start = time.perf_counter()
+        for n in range(requests):
+            token_auth.verify(tokens[n % len(tokens)], app.config)
+        print(f"token verification alone: {(time.perf_counter() - start) / requests * 1e6:.1f} us")
+        assert rows[1][3] == 0
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
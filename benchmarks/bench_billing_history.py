@@ -0,0 +1,127 @@
+"""Billing history for one rider among millions of invoices.
+
+Seeds a file-backed SQLite database with invoices for many riders, a few
+of them heavy commuters with thousands of invoices each, and builds the
+per-rider summaries. Then it times GET /api/v1/billing/history, a
+keyset page read through the (user_id, created_at, id) index plus one
+summary row, against the old approach: load every invoice through the
+ORM and sum it on the fly. It also checks that walking every page
+returns each invoice exactly once.
+Usage: python benchmarks/bench_billing_history.py [invoice_count] [rider_count]
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import func, insert, text
+from extensions import db
+from models import Invoice, User
+from billing import rebuild_billing_summaries
+from api import payment
+
+SEED_CHUNK = 100000
+HEAVY_RIDERS = 10
+HEAVY_SHARE = 0.005  # of all invoices, split between the heavy riders
+SAMPLES = 300
+PAGE_SIZE = 50
+BUDGET_P99_MS = 50
+
+def _seed(invoice_count, rider_count, rng):
+    db.session.execute(insert(User), [
+        {"username": f"rider{i}", "email": f"rider{i}@example.com"} for i in range(rider_count)])
+    start = datetime(2024, 1, 1)
+    heavy = int(invoice_count * HEAVY_SHARE)
+    for offset in range(0, invoice_count, SEED_CHUNK):
+        rows = []
+        for n in range(offset, min(offset + SEED_CHUNK, invoice_count)):
+            user_id = n % HEAVY_RIDERS + 1 if n < heavy else rng.randint(HEAVY_RIDERS + 1, rider_count)
+            rows.append({"user_id": user_id, "amount": round(rng.uniform(1, 30), 2), "description": "Trip",
+                         "status": "Paid" if rng.random() < 0.9 else "Pending",
+                         "created_at": start + timedelta(seconds=rng.uniform(0, 365 * 86400))})
+        db.session.execute(insert(Invoice), rows)
+    db.session.commit()
+
+def _percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.99)] * 1000
+
+def _old_history(user_id):
+    invoices = Invoice.query.filter_by(user_id=user_id).order_by(Invoice.created_at.desc()).all()
+    rows = [{"id": i.id, "amount": i.amount, "description": i.description, "status": i.status,
+             "created_at": i.created_at.isoformat()} for i in invoices]
+    total = db.session.query(func.sum(Invoice.amount)).filter(Invoice.user_id == user_id).scalar()
+    db.session.rollback()
+    return rows, total
+
+def main(invoice_count=10000000, rider_count=200000):
+    rng = random.Random(19)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        app.register_blueprint(payment.bp)
+        client = app.test_client()
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            _seed(invoice_count, rider_count, rng)
+            rebuild_billing_summaries()
+            db.session.commit()
+            print(f"seeded {invoice_count} invoices for {rider_count} riders and built summaries "
+                  f"in {time.perf_counter() - start:.0f}s")
+            plan = db.session.execute(text(
+                "EXPLAIN QUERY PLAN SELECT id, amount, description, status, created_at FROM invoice "
+                "WHERE user_id = 1 ORDER BY created_at DESC, id DESC LIMIT 51")).all()
+            print("plan:", "; ".join(row[-1] for row in plan))
+
+        riders = [rng.randint(1, rider_count) for _ in range(SAMPLES)]
+        heavy = list(range(1, HEAVY_RIDERS + 1)) * (SAMPLES // HEAVY_RIDERS)
+        for label, sample in (("typical riders", riders), ("heavy riders", heavy)):
+            timings = []
+            for user_id in sample:
+                start = time.perf_counter()
+                response = client.get(f'/api/v1/billing/history?user_id={user_id}&limit={PAGE_SIZE}')
+                timings.append(time.perf_counter() - start)
+                assert response.status_code == 200
+            p50, p99 = _percentiles(timings)
+            print(f"{label:15s} first page: p50 {p50:6.2f} ms  p99 {p99:6.2f} ms")
+            if label == "heavy riders":
+                page_p99 = p99
+
+        with app.app_context():
+            timings = []
+            for user_id in heavy[:HEAVY_RIDERS * 3]:
+                start = time.perf_counter()
+                rows, total = _old_history(user_id)
+                timings.append(time.perf_counter() - start)
+            p50, p99 = _percentiles(timings)
+            print(f"heavy riders, whole history through the ORM + SUM: p50 {p50:6.1f} ms  p99 {p99:6.1f} ms "
+                  f"({len(rows)} invoices)")
+
+            summary = client.get(f'/api/v1/billing/history?user_id=1&limit=1').get_json()['summary']
+            assert summary['invoices'] == len(_old_history(1)[0])
+            seen, after, pages = [], '', 0
+            start = time.perf_counter()
+            while True:
+                body = client.get(f'/api/v1/billing/history?user_id=1&limit={PAGE_SIZE}&after={after}').get_json()
+                seen.extend(row['id'] for row in body['data'])
+                pages += 1
+                if not body['next_cursor']:
+                    break
+                after = body['next_cursor']
+            print(f"walked {pages} pages ({len(seen)} invoices) for rider 1 in {time.perf_counter() - start:.2f}s")
+            assert len(seen) == len(set(seen)) == summary['invoices']
+
+    if page_p99 > BUDGET_P99_MS:
+        print(f"FAIL: first page p99 over {BUDGET_P99_MS} ms")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,62 @@
+"""Vehicles/sec through POST /vehicles one at a time versus POST /vehicles/bulk.
+
+Runs against a throwaway SQLite file so every commit pays for a real fsync.
+Usage: python benchmarks/bench_bulk_vehicles.py [vehicle_count]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from extensions import db
+from api import vehicle
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    app.register_blueprint(vehicle.bp)
+    with app.app_context():
+        db.create_all()
+    return app
+
+def payload(prefix, count):
+    return [{
+        "serial_number": f"{prefix}-{i}",
+        "name": f"Scooter {i}",
+        "status": "available",
+        "location": "Warehouse",
+        "latitude": 37.70 + (i % 1000) * 1e-4,
+        "longitude": -122.45 + (i // 1000) * 1e-4,
+    } for i in range(count)]
+
+def main(count=5000):
+    with tempfile.TemporaryDirectory() as tmp:
+        client = make_app(os.path.join(tmp, 'bench.db')).test_client()
+
+        single_count = min(count, 1000)
+        start = time.perf_counter()
+        for item in payload('single', single_count):
+            assert client.post('/api/v1/vehicles', json=item).status_code == 201
+        single = single_count / (time.perf_counter() - start)
+
+        items = payload('bulk', count)
+        start = time.perf_counter()
+        response = client.post('/api/v1/vehicles/bulk', json=items)
+        bulk = count / (time.perf_counter() - start)
+        assert response.status_code == 200 and not response.json['errors']
+
+        start = time.perf_counter()
+        response = client.post('/api/v1/vehicles/bulk', json=items)
+        upsert = count / (time.perf_counter() - start)
+        assert response.json['updated'] == count
+
+    print(f"single-item POST ({single_count}): {single:10.0f} vehicles/s")
+    print(f"bulk insert ({count}):      {bulk:10.0f} vehicles/s  ({bulk / single:.0f}x)")
+    print(f"bulk upsert ({count}):      {upsert:10.0f} vehicles/s  ({upsert / single:.0f}x)")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
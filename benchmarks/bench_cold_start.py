@@ -0,0 +1,72 @@
+"""Cold start of a fresh worker process, lazy against eager blueprints.
+
+Launches new interpreter processes that build the app with
+``main.create_app`` and serve two requests through the test client: a
+route that needs no blueprint module (/api/config) and a first hit on
+GET /api/v1/vehicles, which lazily imports api.vehicle. Every time is
+measured from just before the process is spawned, so it includes
+interpreter start-up, as an autoscaled worker would see it.
+Usage: python benchmarks/bench_cold_start.py [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def child(spawned_at):
+    sys.path.insert(0, ROOT)
+    from main import create_app
+    app = create_app()
+    ready = time.time()
+    api_modules = sum(1 for name in sys.modules if name.startswith('api.'))
+    client = app.test_client()
+    assert client.get('/api/config').status_code == 200
+    first = time.time()
+    assert client.get('/api/v1/vehicles').status_code == 200
+    vehicles = time.time()
+    print(json.dumps({'ready': ready - spawned_at, 'first_response': first - spawned_at,
+                      'first_vehicles': vehicles - spawned_at, 'api_modules': api_modules,
+                      'modules': len(sys.modules)}))
+
+def _run(lazy, database_url, workdir):
+    env = dict(os.environ, LAZY_BLUEPRINTS='1' if lazy else '0', DATABASE_URL=database_url, SECRET_KEY='bench-secret')
+    spawned_at = time.time()
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', repr(spawned_at)],
+                         env=env, cwd=workdir, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main(runs=7):
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        sys.path.insert(0, ROOT)
+        from flask import Flask
+        from extensions import db
+        import models  # noqa: F401 - registers the tables
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+
+        results = {}
+        for _ in range(runs):
+            for lazy in (False, True):  # interleaved so drift hits both alike
+                results.setdefault(lazy, []).append(_run(lazy, database_url, tmp))
+        for lazy in (False, True):
+            rows = results[lazy]
+            median = {key: statistics.median(row[key] for row in rows) for key in rows[0]}
+            print(f"{'lazy' if lazy else 'eager':5s}  ready {median['ready'] * 1000:6.0f} ms  "
+                  f"first response {median['first_response'] * 1000:6.0f} ms  "
+                  f"first /vehicles {median['first_vehicles'] * 1000:6.0f} ms  "
+                  f"({median['api_modules']:.0f} api modules, {median['modules']:.0f} modules loaded at ready)")
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(float(sys.argv[2]))
+    else:
+        main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,42 @@
+"""Per-operation latency of the in-memory DataStore as it grows.
+
+Usage: python benchmarks/bench_data_store.py [max_records]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_store import DataStore
+
+STATUSES = ['available', 'in_use', 'maintenance']
+
+def per_op_us(fn, ids):
+    start = time.perf_counter()
+    for id in ids:
+        fn(id)
+    return (time.perf_counter() - start) / len(ids) * 1e6
+
+def main(max_records=1000000, ops=10000):
+    rng = random.Random(7)
+    print(f"{'records':>10} {'get_vehicle':>12} {'update_veh':>12} {'get_trip':>12} {'delete_veh':>12}  (us/op)")
+    size = 1000
+    while size <= max_records:
+        store = DataStore()
+        for i in range(size):
+            store.add_vehicle({"name": f"v{i}", "status": rng.choice(STATUSES)})
+            store.add_trip({"vehicle_id": i + 1, "start_location": "A"})
+        ids = [rng.randint(1, size) for _ in range(ops)]
+        get_v = per_op_us(store.get_vehicle, ids)
+        upd_v = per_op_us(lambda id: store.update_vehicle(id, {"status": rng.choice(STATUSES)}), ids)
+        get_t = per_op_us(store.get_trip, ids)
+        del_v = per_op_us(store.delete_vehicle, ids)
+        # A delete must never let a later insert reuse an id.
+        assert store.add_vehicle({"name": "new", "status": "available"})['id'] == size + 1
+        print(f"{size:>10} {get_v:>12.2f} {upd_v:>12.2f} {get_t:>12.2f} {del_v:>12.2f}")
+        size *= 10
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,84 @@
+"""Demand forecast refresh cost against per-call reads.
+
+Seeds a file-backed SQLite database with four weeks of located trip starts,
+times a full ``demand_model`` refresh (stream, bincount, per-range
+forecasts), then times the reads rebalancing and pricing make: a forecast
+per time range and an hourly rate at a point. For comparison it also times
+the per-call scan the rebalancer used to do, fetching every trip start in
+the window.
+Usage: python benchmarks/bench_demand_model.py [trip_count]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import insert
+from extensions import db
+from models import Trip, Vehicle
+from demand_model import TIME_RANGES, demand_model
+
+SEED_CHUNK = 50000
+VEHICLES = 5000
+LOOKUPS = 100000
+
+def _seed(trip_count, rng):
+    db.session.execute(insert(Vehicle), [
+        {"name": f"v{i}", "status": "available", "location": "SF"} for i in range(VEHICLES)])
+    hotspots = [(37.70 + rng.uniform(0, 0.3), -122.50 + rng.uniform(0, 0.3)) for _ in range(40)]
+    since = datetime.utcnow() - timedelta(days=27)
+    for offset in range(0, trip_count, SEED_CHUNK):
+        rows = []
+        for _ in range(offset, min(offset + SEED_CHUNK, trip_count)):
+            lat, lon = rng.choice(hotspots)
+            rows.append({"vehicle_id": rng.randint(1, VEHICLES),
+                         "start_time": since + timedelta(seconds=rng.uniform(0, 27 * 86400)),
+                         "start_latitude": rng.gauss(lat, 0.02), "start_longitude": rng.gauss(lon, 0.02)})
+        db.session.execute(insert(Trip), rows)
+    db.session.commit()
+
+def _scan_trip_starts(since):
+    # What every suggestion request used to do before the model existed.
+    return (db.session.query(Trip.start_latitude, Trip.start_longitude)
+            .filter(Trip.start_time >= since, Trip.start_latitude.isnot(None)).all())
+
+def main(trip_count=1000000):
+    rng = random.Random(15)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            _seed(trip_count, rng)
+            print(f"seeded {trip_count} trips in {time.perf_counter() - start:.0f}s")
+
+            start = time.perf_counter()
+            snapshot = demand_model.refresh(app.config)
+            print(f"refresh: {snapshot.trips} trips into {len(snapshot)} zones in {time.perf_counter() - start:.2f}s")
+
+            start = time.perf_counter()
+            for _ in range(LOOKUPS // len(TIME_RANGES)):
+                for time_range in TIME_RANGES:
+                    demand_model.forecast(time_range)
+            print(f"forecast lookup: {(time.perf_counter() - start) / LOOKUPS * 1e6:.2f} us")
+
+            points = [(rng.uniform(37.70, 38.00), rng.uniform(-122.50, -122.20)) for _ in range(LOOKUPS)]
+            now = datetime.utcnow()
+            start = time.perf_counter()
+            for lat, lon in points:
+                snapshot.hourly_rate(lat, lon, now)
+            print(f"hourly_rate lookup: {(time.perf_counter() - start) / LOOKUPS * 1e6:.2f} us")
+
+            start = time.perf_counter()
+            rows = _scan_trip_starts(now - timedelta(days=28))
+            print(f"per-call history scan: {len(rows)} rows in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
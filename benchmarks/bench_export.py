@@ -0,0 +1,87 @@
+"""Throughput and memory of the streaming trip export.
+
+Seeds a file-backed SQLite database with trips, then streams the whole
+table through /api/v1/exports/trips as CSV, NDJSON and gzipped CSV while
+sampling the process's resident set size. Peak RSS should stay flat as the
+row count grows, since only one cursor batch is in memory at a time.
+Usage: python benchmarks/bench_export.py [trip_count]
+"""
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import insert
+from extensions import db
+from models import Trip, Vehicle
+from api import export
+
+SEED_CHUNK = 50000
+VEHICLES = 5000
+
+def _rss_mb():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        # No procfs: fall back to the lifetime peak.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _seed(trip_count, rng):
+    db.session.execute(insert(Vehicle), [
+        {"name": f"v{i}", "status": "available", "location": "SF"} for i in range(VEHICLES)])
+    start_of_year = datetime.utcnow() - timedelta(days=365)
+    for offset in range(0, trip_count, SEED_CHUNK):
+        rows = []
+        for i in range(offset, min(offset + SEED_CHUNK, trip_count)):
+            start = start_of_year + timedelta(seconds=i * 365 * 86400 // trip_count)
+            rows.append({"vehicle_id": rng.randint(1, VEHICLES), "start_time": start,
+                         "end_time": start + timedelta(seconds=rng.randint(60, 3600)),
+                         "start_location": "37.7749,-122.4194", "end_location": "37.7849,-122.4094",
+                         "fare": round(rng.uniform(1, 20), 2)})
+        db.session.execute(insert(Trip), rows)
+    db.session.commit()
+
+def _export(client, path, headers=None):
+    baseline = peak = _rss_mb()
+    size = chunks = 0
+    start = time.perf_counter()
+    response = client.get(path, headers=headers or {}, buffered=False)
+    assert response.status_code == 200, response.status_code
+    for chunk in response.response:
+        size += len(chunk)
+        chunks += 1
+        if chunks % 20 == 0:
+            peak = max(peak, _rss_mb())
+    response.close()
+    return time.perf_counter() - start, size, baseline, max(peak, _rss_mb())
+
+def main(trip_count=2000000):
+    rng = random.Random(13)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        app.register_blueprint(export.bp)
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            _seed(trip_count, rng)
+            print(f"seeded {trip_count} trips in {time.perf_counter() - start:.0f}s")
+
+        client = app.test_client()
+        for label, path, headers in [("csv", "/api/v1/exports/trips", None),
+                                     ("ndjson", "/api/v1/exports/trips?format=ndjson", None),
+                                     ("csv+gzip", "/api/v1/exports/trips", {"Accept-Encoding": "gzip"})]:
+            elapsed, size, baseline, peak = _export(client, path, headers)
+            print(f"{label:9s} {trip_count / elapsed:10,.0f} rows/s  {size / 2 ** 20:8.1f} MB  "
+                  f"rss {baseline:6.1f} -> {peak:6.1f} MB")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,78 @@
+"""GBFS publisher polling throughput and snapshot rebuild cost.
+
+Loads the snapshot from a file-backed SQLite database, then measures
+conditional and full polls of /gbfs/free_bike_status.json and the cost of
+re-serializing the feed after a change.
+Usage: python benchmarks/bench_gbfs_publish.py [vehicle_count] [poll_count]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import insert
+from extensions import db
+from models import Vehicle
+from api import gbfs_publisher
+import gbfs_snapshot as snapshot_module
+from gbfs_snapshot import ensure_gbfs_snapshot, gbfs_snapshot
+
+def _poll(client, count, headers):
+    start = time.perf_counter()
+    for _ in range(count):
+        response = client.get('/gbfs/free_bike_status.json', headers=headers)
+        assert response.status_code in (200, 304)
+    return time.perf_counter() - start, response
+
+def main(vehicle_count=50000, poll_count=2000):
+    rng = random.Random(5)
+    statuses = ['available'] * 8 + ['in_use', 'reserved', 'maintenance']
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        app.register_blueprint(gbfs_publisher.bp)
+        with app.app_context():
+            db.create_all()
+            db.session.execute(insert(Vehicle), [
+                {"name": f"v{i}", "status": rng.choice(statuses), "location": "SF",
+                 "latitude": rng.uniform(37.70, 37.81), "longitude": rng.uniform(-122.51, -122.37)}
+                for i in range(vehicle_count)])
+            db.session.commit()
+            start = time.perf_counter()
+            ensure_gbfs_snapshot()
+            load = time.perf_counter() - start
+
+        client = app.test_client()
+        start = time.perf_counter()
+        first = client.get('/gbfs/free_bike_status.json', headers={'Accept-Encoding': 'gzip'})
+        build = time.perf_counter() - start
+        etag = first.headers['ETag']
+
+        full, _ = _poll(client, poll_count, {'Accept-Encoding': 'gzip'})
+        conditional, _ = _poll(client, poll_count, {'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+
+        # Rebuild cost after one vehicle moves; bypass the rebuild throttle.
+        snapshot_module.MIN_REBUILD_INTERVAL = 0
+        rebuilds = 20
+        start = time.perf_counter()
+        for i in range(rebuilds):
+            gbfs_snapshot.upsert(1, 37.75 + i * 1e-5, -122.42, 'available')
+            gbfs_snapshot.document('free_bike_status')
+        rebuild = (time.perf_counter() - start) / rebuilds
+
+    published = len(gbfs_snapshot._fragments['free_bike_status'])
+    print(f"snapshot load: {vehicle_count} vehicles in {load * 1000:.0f} ms")
+    print(f"first build + response: {build * 1000:.1f} ms, {published} published, "
+          f"{len(first.data) / 1024:.0f} KiB gzipped")
+    print(f"full polls (gzip): {poll_count / full:,.0f} req/s")
+    print(f"conditional polls (304): {poll_count / conditional:,.0f} req/s")
+    print(f"rebuild after a change: {rebuild * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,64 @@
+"""Batch point-in-polygon lookups against the compiled geofence index.
+
+Builds irregular polygons scattered over San Francisco, then times
+containment for a batch of random points through the index and through a
+brute-force scan over every compiled polygon.
+Usage: python benchmarks/bench_geofence.py [polygon_count] [point_count] [vertices]
+"""
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geofence_index import GeofenceIndex, compile_geofence
+
+LAT_RANGE = (37.70, 37.81)
+LON_RANGE = (-122.51, -122.37)
+
+def _polygon(rng, vertices):
+    lat, lon = rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)
+    radius = rng.uniform(0.0005, 0.003)
+    ring = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = radius * rng.uniform(0.6, 1.0)
+        ring.append([lon + r * math.cos(angle), lat + r * math.sin(angle)])
+    return ring
+
+def main(polygon_count=2000, point_count=10000, vertices=24):
+    rng = random.Random(9)
+    start = time.perf_counter()
+    polygons = [compile_geofence(i, f"zone-{i}", _polygon(rng, vertices)) for i in range(1, polygon_count + 1)]
+    compile_time = time.perf_counter() - start
+
+    index = GeofenceIndex()
+    start = time.perf_counter()
+    for polygon in polygons:
+        index.upsert(polygon)
+    build = time.perf_counter() - start
+
+    points = [(rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)) for _ in range(point_count)]
+    runs = 5
+    start = time.perf_counter()
+    for _ in range(runs):
+        indexed = index.containing_many(points)
+    batch = (time.perf_counter() - start) / runs
+
+    sample = points[:max(1, point_count // 20)]
+    start = time.perf_counter()
+    brute = [[p for p in polygons if p.contains(lon, lat)] for lat, lon in sample]
+    scan = (time.perf_counter() - start) * point_count / len(sample)
+    assert [[p.id for p in hits] for hits in brute] == [[p.id for p in hits] for hits in indexed[:len(sample)]]
+
+    hits = sum(1 for h in indexed if h)
+    print(f"compile: {polygon_count} polygons x {vertices} vertices in {compile_time * 1000:.0f} ms, "
+          f"index build {build * 1000:.0f} ms")
+    print(f"indexed batch: {point_count} points in {batch * 1000:.1f} ms ({hits} inside a zone)")
+    print(f"brute-force scan (extrapolated): {scan * 1000:.0f} ms, speedup {scan / batch:.0f}x")
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:4]]
+    main(*args)
@@ -0,0 +1,103 @@
+"""Login throughput and collateral latency at different hash pool sizes.
+
+Client threads post /api/v1/auth/login as fast as they can for a fixed
+time while a probe thread hits a trivial endpoint in the same process.
+Reports accepted logins/s, logins shed with 503, and the probe's p99 for
+inline hashing (PASSWORD_HASH_WORKERS = 0, the old behaviour) and for
+each pool size. Pool sizes beyond the machine's core count cannot add
+throughput; the point there is that shedding keeps the probe fast.
+Usage: python benchmarks/bench_login.py [seconds] [client_threads] [iterations]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+from extensions import db
+from models import User
+from password_hasher import password_hasher
+from api import auth
+
+USERS = 50
+POOL_SIZES = (0, 1, 2, 4)
+
+def _run(app, seconds, threads):
+    stop = threading.Event()
+    counts = {'ok': 0, 'shed': 0}
+    probes = []
+    lock = threading.Lock()
+
+    def login_client(n):
+        client = app.test_client()
+        while not stop.is_set():
+            response = client.post('/api/v1/auth/login', json={"username": f"u{n % USERS}", "password": "pw"})
+            with lock:
+                counts['ok' if response.status_code == 200 else 'shed'] += 1
+            if response.status_code == 503:
+                stop.wait(float(response.headers['Retry-After']))
+
+    def probe():
+        client = app.test_client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            client.get('/ping')
+            probes.append(time.perf_counter() - start)
+            time.sleep(0.005)
+
+    workers = [threading.Thread(target=login_client, args=(n,)) for n in range(threads)]
+    workers.append(threading.Thread(target=probe))
+    for worker in workers:
+        worker.start()
+    time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    probes.sort()
+    return counts['ok'] / seconds, counts['shed'], probes[int(len(probes) * 0.99)] * 1000
+
+def main(seconds=10, threads=16, iterations=100000):
+    method = f"pbkdf2:sha256:{iterations}"
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app.config['SECRET_KEY'] = 'bench-secret'
+        app.config['PASSWORD_HASH_METHOD'] = method
+        db.init_app(app)
+        app.register_blueprint(auth.bp)
+
+        @app.route('/ping')
+        def ping():
+            return jsonify({"ok": True})
+
+        with app.app_context():
+            db.create_all()
+            password_hash = generate_password_hash("pw", method=method)
+            db.session.execute(insert(User), [
+                {"username": f"u{i}", "email": f"u{i}@example.com", "password_hash": password_hash}
+                for i in range(USERS)])
+            db.session.commit()
+
+        print(f"{os.cpu_count()} CPUs, {method}, {threads} login threads, {seconds}s per run")
+        for workers in POOL_SIZES:
+            app.config['PASSWORD_HASH_WORKERS'] = workers
+            # Start the pool outside the timed run. Workers are spawned on demand, so
+            # hash concurrently to bring up all of them.
+            warm_up = [threading.Thread(target=password_hasher.hash, args=("warm-up", app.config))
+                       for _ in range(max(workers, 1))]
+            for thread in warm_up:
+                thread.start()
+            for thread in warm_up:
+                thread.join()
+            logins, shed, probe_p99 = _run(app, seconds, threads)
+            label = "inline" if workers == 0 else f"pool of {workers}"
+            print(f"{label:10s} {logins:7.1f} logins/s  {shed:6d} shed (503)  other requests p99 {probe_p99:8.1f} ms")
+            password_hasher.shutdown()
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
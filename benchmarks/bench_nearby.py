@@ -0,0 +1,47 @@
+"""Compare the vehicle grid index against a full scan.
+
+Usage: python benchmarks/bench_nearby.py [vehicle_count]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spatial_index import GridIndex
+
+# Roughly the San Francisco service area.
+LAT_RANGE = (37.70, 37.81)
+LON_RANGE = (-122.51, -122.37)
+STATUSES = ['available', 'in_use', 'maintenance']
+
+def timed(fn, queries):
+    start = time.perf_counter()
+    for q in queries:
+        fn(*q)
+    return (time.perf_counter() - start) / len(queries) * 1000
+
+def main(count=100000, query_count=1000):
+    rng = random.Random(42)
+    index = GridIndex()
+    for vehicle_id in range(1, count + 1):
+        index.upsert(vehicle_id, rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE), rng.choice(STATUSES))
+    queries = [(rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)) for _ in range(query_count)]
+
+    # Sanity check: the index must agree with the brute-force answer.
+    for lat, lon in queries[:20]:
+        assert [h[1] for h in index.nearest(lat, lon, 10)] == [h[1] for h in index.scan(lat, lon, k=10)]
+        assert [h[1] for h in index.within(lat, lon, 300)] == [h[1] for h in index.scan(lat, lon, radius_m=300)]
+
+    scan_queries = queries[:max(1, query_count // 50)]
+    print(f"{count} vehicles, {query_count} queries")
+    print(f"  knn k=10              grid {timed(lambda a, b: index.nearest(a, b, 10), queries):8.3f} ms"
+          f"   scan {timed(lambda a, b: index.scan(a, b, k=10), scan_queries):8.3f} ms")
+    print(f"  knn k=10 available    grid {timed(lambda a, b: index.nearest(a, b, 10, 'available'), queries):8.3f} ms"
+          f"   scan {timed(lambda a, b: index.scan(a, b, k=10, status='available'), scan_queries):8.3f} ms")
+    print(f"  radius 250m limit 50  grid {timed(lambda a, b: index.within(a, b, 250, limit=50), queries):8.3f} ms"
+          f"   scan {timed(lambda a, b: index.scan(a, b, radius_m=250, k=50), scan_queries):8.3f} ms")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,104 @@
+"""Payment acceptance throughput against gateway latency.
+
+Runs the stub gateway at several latencies and posts payments for fresh
+invoices from concurrent client threads, measuring how fast
+POST /api/v1/payments accepts them (202) and how long the worker pool takes
+to settle them all. Acceptance should not slow down as the gateway does;
+only the settle time should. A final run with PAYMENT_WORKERS = 0 charges
+inline in the request, as the endpoint used to, for comparison.
+Usage: python benchmarks/bench_payments.py [payment_count] [client_threads]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import func, insert
+from extensions import db
+from models import Invoice, PaymentIntent, User
+from payment_gateway import StubGatewayServer
+from payment_worker import TERMINAL_STATUSES, payment_workers
+from api import payment
+
+WORKERS = 16
+LATENCIES_MS = (0, 200, 1000)
+SETTLE_TIMEOUT_S = 300
+
+def _invoices(count):
+    first = db.session.query(func.coalesce(func.max(Invoice.id), 0)).scalar() + 1
+    db.session.execute(insert(Invoice), [
+        {"user_id": 1, "amount": 9.5, "description": "bench", "status": "Pending"} for _ in range(count)])
+    db.session.commit()
+    return list(range(first, first + count))
+
+def _post_all(app, invoice_ids, threads):
+    latencies = []
+    lock = threading.Lock()
+
+    def client_thread(ids):
+        client = app.test_client()
+        mine = []
+        for invoice_id in ids:
+            start = time.perf_counter()
+            response = client.post('/api/v1/payments', headers={"Idempotency-Key": f"bench-{invoice_id}"},
+                                   json={"invoice_id": invoice_id, "amount": 9.5, "payment_method": "card"})
+            mine.append(time.perf_counter() - start)
+            assert response.status_code in (200, 202), response.get_json()
+        with lock:
+            latencies.extend(mine)
+
+    workers = [threading.Thread(target=client_thread, args=(invoice_ids[i::threads],)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    latencies.sort()
+    return time.perf_counter() - start, latencies
+
+def _settle(app, invoice_ids, started):
+    with app.app_context():
+        while time.perf_counter() - started < SETTLE_TIMEOUT_S:
+            done = (db.session.query(func.count(PaymentIntent.id))
+                    .filter(PaymentIntent.invoice_id.in_(invoice_ids), PaymentIntent.status.in_(TERMINAL_STATUSES))
+                    .scalar())
+            db.session.commit()
+            if done == len(invoice_ids):
+                return time.perf_counter() - started
+            time.sleep(0.05)
+    return float('nan')
+
+def _scenario(app, label, latency_ms, workers, count, threads):
+    stub = StubGatewayServer(latency_s=latency_ms / 1000).start()
+    app.config.update(PAYMENT_GATEWAY_URL=stub.url, PAYMENT_WORKERS=workers, PAYMENT_GATEWAY_POOL_SIZE=workers or threads,
+                      PAYMENT_POLL_INTERVAL_S=0.1)
+    with app.app_context():
+        invoice_ids = _invoices(count)
+    started = time.perf_counter()
+    elapsed, latencies = _post_all(app, invoice_ids, threads)
+    settled = _settle(app, invoice_ids, started)
+    payment_workers.shutdown()
+    stub.shutdown()
+    print(f"{label:22s} accept {count / elapsed:8.0f} req/s  p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.1f} ms"
+          f"  all settled in {settled:6.2f}s  ({len(stub.charges)} charges, {stub.requests} gateway calls)")
+
+def main(count=500, threads=8):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        app.register_blueprint(payment.bp)
+        with app.app_context():
+            db.create_all()
+            db.session.execute(insert(User), [{"username": "payer", "email": "payer@example.com"}])
+            db.session.commit()
+        for latency_ms in LATENCIES_MS:
+            _scenario(app, f"{WORKERS} workers, {latency_ms:4d} ms", latency_ms, WORKERS, count, threads)
+        _scenario(app, f"inline, {LATENCIES_MS[1]:4d} ms", LATENCIES_MS[1], 0, threads * 10, threads)
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
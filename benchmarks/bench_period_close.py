@@ -0,0 +1,81 @@
+"""Period close over a month of small rides.
+
+Seeds a file-backed SQLite database with priced, unbilled trips spread
+over a month and many riders, then times ``close_billing_period`` for the
+whole month: one INSERT ... SELECT for the per-rider invoices and one
+UPDATE linking every trip to its invoice. Checks that the invoices add up
+to the fares they bill.
+Usage: python benchmarks/bench_period_close.py [trip_count] [rider_count]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import func, insert
+from extensions import db
+from models import Invoice, Trip, User, Vehicle
+from billing import close_billing_period
+
+SEED_CHUNK = 50000
+VEHICLES = 5000
+BUDGET_SECONDS = 120
+
+def _seed(trip_count, rider_count, period_start, rng):
+    db.session.execute(insert(User), [
+        {"username": f"rider{i}", "email": f"rider{i}@example.com"} for i in range(rider_count)])
+    db.session.execute(insert(Vehicle), [
+        {"name": f"v{i}", "status": "available", "location": "SF"} for i in range(VEHICLES)])
+    for offset in range(0, trip_count, SEED_CHUNK):
+        rows = []
+        for _ in range(offset, min(offset + SEED_CHUNK, trip_count)):
+            start = period_start + timedelta(seconds=rng.uniform(0, 30 * 86400 - 3600))
+            rows.append({"vehicle_id": rng.randint(1, VEHICLES), "user_id": rng.randint(1, rider_count),
+                         "start_time": start, "end_time": start + timedelta(seconds=rng.randint(60, 1800)),
+                         "fare": round(rng.uniform(1, 8), 2)})
+        db.session.execute(insert(Trip), rows)
+    db.session.commit()
+
+def main(trip_count=1000000, rider_count=50000):
+    rng = random.Random(17)
+    period_start = datetime(2024, 8, 1)
+    period_end = period_start + timedelta(days=30)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            _seed(trip_count, rider_count, period_start, rng)
+            print(f"seeded {trip_count} trips for {rider_count} riders in {time.perf_counter() - start:.0f}s")
+
+            start = time.perf_counter()
+            run = close_billing_period(period_start, period_end)
+            db.session.commit()
+            elapsed = time.perf_counter() - start
+            print(f"close: {run.invoices} invoices for {run.trips} trips in {elapsed:.1f}s "
+                  f"({run.trips / elapsed:,.0f} trips/s)")
+
+            billed = db.session.query(func.sum(Invoice.amount)).filter(Invoice.billing_run_id == run.id).scalar()
+            fares = db.session.query(func.sum(Trip.fare)).filter(Trip.invoice_id.isnot(None)).scalar()
+            unbilled = db.session.query(func.count(Trip.id)).filter(Trip.invoice_id.is_(None)).scalar()
+            print(f"invoiced {billed:,.2f} for {fares:,.2f} of fares, {unbilled} trips left unbilled")
+            assert run.trips == trip_count and unbilled == 0 and abs(billed - fares) < 0.01 * run.invoices
+
+            start = time.perf_counter()
+            again = close_billing_period(period_start, period_end)
+            db.session.commit()
+            print(f"second close: {again.invoices} invoices in {time.perf_counter() - start:.2f}s")
+
+    if elapsed > BUDGET_SECONDS:
+        print(f"FAIL: over the {BUDGET_SECONDS}s budget")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,108 @@
+"""Permission-check overhead on every route of every blueprint.
+
+Registers every blueprint in ``api`` and, for each of its routes, swaps
+the view for a no-op so only routing, the token hook and the check are
+timed. Each route is called with a valid token twice: once bare and once
+wrapped in ``require_permission``. Reports the median added cost per
+blueprint and the SQL statements the checked calls ran, which should be
+none once the role table is compiled.
+Usage: python benchmarks/bench_permissions.py [calls_per_route]
+"""
+import importlib
+import os
+import pkgutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+from sqlalchemy import event, insert
+from werkzeug.routing import FloatConverter, IntegerConverter
+from extensions import db
+from models import Role, RolePermission, User
+from auth_tokens import token_auth
+from permissions import PERMISSIONS, permission_table, require_permission
+import api
+
+def _noop(*args, **kwargs):
+    return jsonify({"ok": True})
+
+def _url(rule):
+    values = {}
+    for name in rule.arguments:
+        converter = rule._converters.get(name)
+        values[name] = 1 if isinstance(converter, (IntegerConverter, FloatConverter)) else 'x'
+    return rule.build(values, append_unknown=False)[1]
+
+def _time(client, method, url, headers, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        client.open(url, method=method, headers=headers)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def main(calls=300):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        app.config['SECRET_KEY'] = 'bench-secret'
+        db.init_app(app)
+        for module in pkgutil.iter_modules(api.__path__):
+            app.register_blueprint(importlib.import_module(f'api.{module.name}').bp)
+
+        with app.app_context():
+            db.create_all()
+            db.session.execute(insert(Role), [{"name": "operator"}])
+            db.session.execute(insert(RolePermission), [{"role_id": 1, "permission": name} for name in PERMISSIONS])
+            db.session.execute(insert(User), [{"username": "op", "email": "op@example.com", "role_id": 1}])
+            db.session.commit()
+            headers = {'Authorization': f"Bearer {token_auth.issue(db.session.get(User, 1), app.config)[0]}"}
+            statements = [0]
+            event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.__setitem__(0, statements[0] + 1))
+
+        routes = {}
+        for rule in app.url_map.iter_rules():
+            if rule.endpoint == 'static' or '.' not in rule.endpoint:
+                continue
+            method = sorted(rule.methods - {'HEAD', 'OPTIONS'})[0]
+            routes.setdefault(rule.endpoint.split('.')[0], []).append((rule.endpoint, method, _url(rule)))
+
+        client = app.test_client()
+        checked_view = require_permission(*PERMISSIONS)(_noop)
+        bare_view = _noop
+        client.get('/', headers=headers)  # warm the principal cache
+        with app.app_context():
+            permission_table.compiled(app.config)
+
+        overheads = []
+        checked_statements = 0
+        print(f"{'blueprint':16s} {'routes':>6s} {'bare p50':>10s} {'checked p50':>12s} {'overhead':>10s}")
+        for blueprint, endpoints in sorted(routes.items()):
+            bare, checked = [], []
+            for endpoint, method, url in endpoints:
+                app.view_functions[endpoint] = bare_view
+                bare.append(_time(client, method, url, headers, calls))
+                app.view_functions[endpoint] = checked_view
+                statements[0] = 0
+                checked.append(_time(client, method, url, headers, calls))
+                checked_statements += statements[0]
+            added = statistics.median(c - b for b, c in zip(bare, checked)) * 1e6
+            overheads.append(added)
+            print(f"{blueprint:16s} {len(endpoints):6d} {statistics.median(bare) * 1e6:8.1f}us "
+                  f"{statistics.median(checked) * 1e6:10.1f}us {added:8.1f}us")
+        print(f"median overhead across {len(routes)} blueprints: {statistics.median(overheads):.1f} us per request, "
+              f"{checked_statements} SQL statements in checked calls")
+
+        with app.test_request_context():
+            start = time.perf_counter()
+            for _ in range(100000):
+                permission_table.allows(1, 1, app.config)
+            print(f"permission_table.allows alone: {(time.perf_counter() - start) * 10:.3f} us")
+        assert checked_statements == 0
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,130 @@
+"""Fare quote latency with hundreds of active pricing rules.
+
+Seeds a mix of base, time-based and surge rules (zone-scoped, hour-scoped
+and demand-conditioned) plus four weeks of trip starts for the demand
+model, then measures per-quote latency percentiles for the compiled engine
+on its own, for POST /api/v1/pricing/quote through the Flask test client,
+and per quote inside POST /api/v1/pricing/quote/batch. A no-op JSON
+route gives the test client's own overhead for comparison.
+Usage: python benchmarks/bench_pricing_quote.py [rule_count] [quote_count]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+from sqlalchemy import insert
+from extensions import db
+from models import PricingRule, Trip, Vehicle
+from demand_model import demand_model
+from pricing_engine import pricing_engine
+from api import pricing
+
+TRIPS = 200000
+BATCH_SIZE = 1000
+P99_BUDGET_MS = 1.0
+AREA = (37.70, -122.50, 0.3)  # south-west corner and size in degrees
+
+def _point(rng):
+    return [round(AREA[0] + rng.uniform(0, AREA[2]), 5), round(AREA[1] + rng.uniform(0, AREA[2]), 5)]
+
+def _hours(rng):
+    start = rng.randint(0, 23)
+    return sorted({(start + i) % 24 for i in range(rng.randint(1, 4))})
+
+def _seed(rule_count, rng):
+    rules = [{"name": "Base Price", "rule_type": "base", "price_modifier": 1.0,
+              "conditions": json.dumps({"per_minute": 0.3, "minimum_fare": 2.0})}]
+    for i in range(1, rule_count):
+        kind = i % 4
+        if kind == 0:
+            rule_type, conditions = 'time-based', {"days": rng.sample(range(7), rng.randint(1, 5)), "hours": _hours(rng)}
+        elif kind == 1:
+            rule_type, conditions = 'surge', {"zones": [_point(rng) for _ in range(rng.randint(1, 20))]}
+        elif kind == 2:
+            rule_type, conditions = 'surge', {"zones": [_point(rng) for _ in range(5)], "hours": _hours(rng),
+                                              "min_demand": rng.uniform(0.01, 0.5)}
+        else:
+            rule_type, conditions = 'time-based', {"hours": _hours(rng), "zones": [_point(rng) for _ in range(10)]}
+        rules.append({"name": f"rule {i}", "rule_type": rule_type, "price_modifier": round(rng.uniform(0.8, 2.0), 2),
+                      "conditions": json.dumps(conditions)})
+    db.session.execute(insert(PricingRule), rules)
+    db.session.execute(insert(Vehicle), [{"name": "v1", "status": "available", "location": "SF"}])
+    since = datetime.utcnow() - timedelta(days=27)
+    hotspots = [_point(rng) for _ in range(40)]
+    trips = []
+    for _ in range(TRIPS):
+        lat, lon = rng.choice(hotspots)
+        trips.append({"vehicle_id": 1, "start_time": since + timedelta(seconds=rng.uniform(0, 27 * 86400)),
+                      "start_latitude": rng.gauss(lat, 0.01), "start_longitude": rng.gauss(lon, 0.01)})
+    db.session.execute(insert(Trip), trips)
+    db.session.commit()
+
+def _requests(rng, count):
+    start = datetime(2024, 9, 9)
+    return [{"start_time": (start + timedelta(minutes=rng.randint(0, 7 * 1440))).isoformat(),
+             "duration_minutes": rng.randint(1, 60), "latitude": lat, "longitude": lon}
+            for lat, lon in (_point(rng) for _ in range(count))]
+
+def _report(label, samples):
+    samples.sort()
+    p50, p99 = samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.99)] * 1000
+    print(f"{label:18s} p50 {p50:7.3f} ms  p99 {p99:7.3f} ms  max {samples[-1] * 1000:7.3f} ms")
+    return p99
+
+def main(rule_count=500, quote_count=20000):
+    rng = random.Random(16)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        app.register_blueprint(pricing.bp)
+        app.add_url_rule('/noop', 'noop', lambda: jsonify({}), methods=['POST'])
+        with app.app_context():
+            db.create_all()
+            _seed(rule_count, rng)
+            compiled = pricing_engine.compiled(app.config)
+            print(f"compiled {compiled.rule_count} rules in {pricing_engine.stats['last_compile_ms']:.1f} ms")
+
+            requests = _requests(rng, quote_count)
+            parsed = [(datetime.fromisoformat(r["start_time"]), r["duration_minutes"], r["latitude"], r["longitude"])
+                      for r in requests]
+            demand_model.refresh(app.config)
+            samples = []
+            for moment, minutes, lat, lon in parsed:
+                start = time.perf_counter()
+                pricing_engine.quote(app.config, moment, minutes, lat, lon)
+                samples.append(time.perf_counter() - start)
+            engine_p99 = _report("engine", samples)
+
+        client = app.test_client()
+        for path, label in (('/noop', "POST no-op"), ('/api/v1/pricing/quote', "POST /quote")):
+            samples = []
+            for body in requests[:quote_count // 4]:
+                start = time.perf_counter()
+                response = client.post(path, json=body)
+                samples.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.get_json()
+            _report(label, samples)
+
+        samples = []
+        for offset in range(0, quote_count, BATCH_SIZE):
+            batch = requests[offset:offset + BATCH_SIZE]
+            start = time.perf_counter()
+            response = client.post('/api/v1/pricing/quote/batch', json={"quotes": batch})
+            samples.append((time.perf_counter() - start) / len(batch))
+            assert response.status_code == 200
+        _report("batch, per quote", samples)
+
+    if engine_p99 > P99_BUDGET_MS:
+        print(f"FAIL: engine p99 over {P99_BUDGET_MS} ms")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,102 @@
+"""Rebalancing plan for a large fleet over a city-sized zone grid.
+
+Scatters available vehicles around a few depots and four weeks of trip
+starts around different hotspots over a 32 x 32 grid of 1 km zones, then
+times ``plan_rebalancing`` end to end against the morning forecast. The zone-level transport problem is then
+solved again on its own and compared with a greedy cheapest-pair-first
+assignment of the same surplus and deficit.
+Usage: python benchmarks/bench_rebalancing.py [vehicle_count] [trip_start_count]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from demand_model import DemandSnapshot, demand_histogram, hours_of_week, window_exposure
+from rebalancer import (DEFAULT_MAX_MOVE_M, DEFAULT_ZONE_SIZE_DEG, Zones, plan_rebalancing, solve_transport,
+                        transport_problem, zone_keys, zone_targets)
+
+ORIGIN = (37.60, -122.55)
+GRID_DEG = 0.32  # 32 x 32 zones of 0.01 degrees
+BUDGET_SECONDS = 5.0
+
+def _clustered(rng, count, centres, spread):
+    picks = rng.integers(0, len(centres), count)
+    lats = centres[picks, 0] + rng.normal(0, spread, count)
+    lons = centres[picks, 1] + rng.normal(0, spread, count)
+    return (np.clip(lats, ORIGIN[0], ORIGIN[0] + GRID_DEG - 1e-9),
+            np.clip(lons, ORIGIN[1], ORIGIN[1] + GRID_DEG - 1e-9))
+
+def _greedy(supply, capacity, cost, max_move_m):
+    # Cheapest zone pair first, the usual hand-rolled heuristic.
+    supply, capacity = supply.copy(), capacity.copy()
+    moved = total = 0
+    for flat in np.argsort(cost, axis=None):
+        i, j = divmod(int(flat), cost.shape[1])
+        if cost[i, j] > max_move_m:
+            break
+        units = min(supply[i], capacity[j])
+        if units:
+            supply[i] -= units
+            capacity[j] -= units
+            moved += units
+            total += units * cost[i, j]
+    return moved, total
+
+def main(vehicle_count=50000, trip_start_count=500000):
+    rng = np.random.default_rng(14)
+    depots = np.column_stack([ORIGIN[0] + rng.uniform(0, GRID_DEG, 12), ORIGIN[1] + rng.uniform(0, GRID_DEG, 12)])
+    hotspots = np.column_stack([ORIGIN[0] + rng.uniform(0, GRID_DEG, 40), ORIGIN[1] + rng.uniform(0, GRID_DEG, 40)])
+    # Most vehicles sit near where riders left them, the rest around depots.
+    ridden = vehicle_count * 3 // 5
+    lats, lons = (np.concatenate(pair) for pair in zip(_clustered(rng, ridden, hotspots, 0.03),
+                                                       _clustered(rng, vehicle_count - ridden, depots, 0.03)))
+    demand_lats, demand_lons = _clustered(rng, trip_start_count, hotspots, 0.02)
+    until = datetime(2024, 9, 30)
+    since = until - timedelta(days=28)
+    epoch_seconds = (since - datetime(1970, 1, 1)).total_seconds() + rng.uniform(0, 28 * 86400, trip_start_count)
+    demand_keys = zone_keys(demand_lats, demand_lons, DEFAULT_ZONE_SIZE_DEG)
+    snapshot = DemandSnapshot(DEFAULT_ZONE_SIZE_DEG, *demand_histogram(demand_keys, hours_of_week(epoch_seconds)),
+                              window_exposure(since, until))
+    forecast = snapshot.forecast('morning')
+    vehicle_ids = np.arange(1, vehicle_count + 1)
+
+    start = time.perf_counter()
+    zones, summary, moves = plan_rebalancing(vehicle_ids, lats, lons, forecast.keys, forecast.rates)
+    elapsed = time.perf_counter() - start
+    print(f"{summary['vehicles']} vehicles, {summary['zones']} zones, "
+          f"{summary['forecast_trip_starts_per_day']:.0f} morning trip starts/day, surplus {summary['surplus']}, "
+          f"deficit {summary['deficit']}")
+    print(f"plan: {summary['moves']} moves, {summary['total_distance_m'] / 1000:.0f} km by vehicle, "
+          f"+{summary['estimated_trips_gained_per_day']} trips/day in {elapsed:.2f}s")
+
+    # The zone-level problem on its own: the transport solver against a
+    # greedy cheapest-pair-first fill. Both maximise the distance saved
+    # relative to max_move_m per move, which rewards moving more vehicles
+    # over shorter hops.
+    vehicle_keys = zone_keys(lats, lons, DEFAULT_ZONE_SIZE_DEG)
+    zones = Zones(DEFAULT_ZONE_SIZE_DEG, np.union1d(vehicle_keys, forecast.keys))
+    supply = np.bincount(np.searchsorted(zones.keys, vehicle_keys), minlength=len(zones))
+    demand = np.zeros(len(zones))
+    demand[np.searchsorted(zones.keys, forecast.keys)] = forecast.rates
+    _, _, surplus, deficit, cost = transport_problem(zones, supply, zone_targets(demand, vehicle_count))
+    start = time.perf_counter()
+    flows = solve_transport(surplus, deficit, cost, DEFAULT_MAX_MOVE_M)
+    solve_seconds = time.perf_counter() - start
+    moved = sum(units for _, _, units in flows)
+    total = sum(units * cost[s, d] for s, d, units in flows)
+    greedy_moved, greedy_total = _greedy(surplus, deficit, cost, DEFAULT_MAX_MOVE_M)
+    print(f"{len(surplus)} x {len(deficit)} zone problem, solved in {solve_seconds:.2f}s")
+    for label, moved, total in [("sinkhorn", moved, total), ("greedy", greedy_moved, greedy_total)]:
+        print(f"{label:8s} {moved:6d} moves  {total / 1000:8.0f} km  "
+              f"saving {(moved * DEFAULT_MAX_MOVE_M - total) / 1000:8.0f} km")
+    if elapsed > BUDGET_SECONDS:
+        print(f"FAIL: over the {BUDGET_SECONDS:.0f}s budget")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,93 @@
+"""Cost of the per-request metrics: request hooks and SQL cursor listeners.
+
+Builds two identical apps on a temp-file SQLite database, one with
+``request_metrics`` installed, and times the same routes through the
+test client in alternating rounds: a route with no SQL and one that
+runs three statements. Also times the recording path alone, without
+Flask, and how long a /metrics scrape takes once many endpoints have
+been seen.
+Usage: python benchmarks/bench_request_metrics.py [calls] [rounds]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+from sqlalchemy import select
+from extensions import db
+from models import Vehicle
+from request_metrics import LATENCY_BUCKETS_S, STATEMENT_BUCKETS, Histogram, RequestMetrics, request_metrics
+
+def _app(database_url, instrumented):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    db.init_app(app)
+    if instrumented:
+        request_metrics.init_app(app)
+
+    @app.route('/ping')
+    def ping():
+        return jsonify({"ok": True})
+
+    @app.route('/vehicles/<int:vehicle_id>')
+    def vehicle(vehicle_id):
+        for _ in range(3):
+            db.session.execute(select(Vehicle.id).where(Vehicle.id == vehicle_id)).first()
+        return jsonify({"ok": True})
+    return app
+
+def _time(client, url, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        client.get(url)
+    return (time.perf_counter() - start) / calls
+
+def main(calls=2000, rounds=7):
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        bare, instrumented = _app(database_url, False), _app(database_url, True)
+        with bare.app_context():
+            db.create_all()
+        clients = {False: bare.test_client(), True: instrumented.test_client()}
+
+        for url in ('/ping', '/vehicles/1'):
+            timings = {False: [], True: []}
+            for _ in range(rounds):
+                for on in (False, True):  # interleaved so drift hits both alike
+                    timings[on].append(_time(clients[on], url, calls))
+            off, on = statistics.median(timings[False]) * 1e6, statistics.median(timings[True]) * 1e6
+            print(f"{url:12s} bare {off:7.1f} us  instrumented {on:7.1f} us  overhead {on - off:5.1f} us")
+
+        # The recording path on its own: the three request hooks and three statements.
+        metrics = RequestMetrics()
+        response = bare.response_class()
+        with instrumented.test_request_context('/vehicles/1'):
+            start = time.perf_counter()
+            for _ in range(100000):
+                metrics._before_request()
+                for _ in range(3):
+                    metrics._before_cursor_execute(None, None, None, None, None, False)
+                    metrics._after_cursor_execute(None, None, None, None, None, False)
+                metrics._after_request(response)
+                metrics._teardown_request(None)
+            print(f"recording alone: {(time.perf_counter() - start) * 10:.2f} us per request with 3 statements")
+
+        shard = metrics._shard()
+        for i in range(200):
+            key = (f'blueprint.endpoint_{i}', 'GET')
+            for table, bounds in ((shard.latency, LATENCY_BUCKETS_S), (shard.statements, STATEMENT_BUCKETS),
+                                  (shard.db_time, LATENCY_BUCKETS_S)):
+                table[key] = Histogram(bounds)
+                table[key].observe(0.01)
+            shard.responses[key + (200,)] = 1
+        start = time.perf_counter()
+        text = metrics.render()
+        print(f"scrape of {len(text.splitlines())} lines for 201 endpoints: "
+              f"{(time.perf_counter() - start) * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
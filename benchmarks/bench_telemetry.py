@@ -0,0 +1,69 @@
+"""Telemetry ingest rate and flush cost.
+
+Posts batches of pings through POST /api/v1/telemetry and reports sustained
+pings/sec, then times the coalesced bulk UPDATE into a file-backed SQLite
+database.
+Usage: python benchmarks/bench_telemetry.py [vehicle_count] [ping_count]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import insert
+from extensions import db
+from models import Vehicle
+from api import telemetry
+from telemetry_buffer import telemetry_buffer
+
+BATCH_SIZE = 1000
+
+def main(vehicle_count=50000, ping_count=500000):
+    rng = random.Random(3)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        # Flush manually below so the ingest and write phases are timed separately.
+        app.config['TELEMETRY_FLUSH_INTERVAL_MS'] = 3600 * 1000
+        db.init_app(app)
+        app.register_blueprint(telemetry.bp)
+        with app.app_context():
+            db.create_all()
+            db.session.execute(insert(Vehicle), [
+                {"name": f"v{i}", "status": "available", "location": "SF"} for i in range(vehicle_count)])
+            db.session.commit()
+
+        client = app.test_client()
+        # Batches a second apart, ending now; pings from the future are refused.
+        first = time.time() - ping_count // BATCH_SIZE
+        batches = [[{
+            "vehicle_id": rng.randint(1, vehicle_count),
+            "latitude": rng.uniform(37.70, 37.81),
+            "longitude": rng.uniform(-122.51, -122.37),
+            "timestamp": first + b,
+        } for _ in range(BATCH_SIZE)] for b in range(ping_count // BATCH_SIZE)]
+
+        start = time.perf_counter()
+        for batch in batches:
+            assert client.post('/api/v1/telemetry', json=batch).status_code == 202
+        ingest = time.perf_counter() - start
+
+        metrics = client.get('/api/v1/telemetry/metrics').json
+        with app.app_context():
+            start = time.perf_counter()
+            written = telemetry_buffer.flush()
+            flush = time.perf_counter() - start
+
+    print(f"ingest: {ping_count} pings in {ingest:.2f}s = {ping_count / ingest:,.0f} pings/s "
+          f"(batches of {BATCH_SIZE}, single thread)")
+    print(f"buffer depth before flush: {metrics['buffer_depth']} "
+          f"(coalesced {metrics['coalesced']}, dropped {metrics['dropped']})")
+    print(f"flush: {written} rows in {flush * 1000:.0f} ms = {written / flush:,.0f} rows/s")
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
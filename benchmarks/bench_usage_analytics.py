@@ -0,0 +1,94 @@
+"""Response time of the usage and fleet analytics endpoints on a large trip table.
+
+Seeds a file-backed SQLite database with vehicles spread over a few fleets
+and a year of trips, builds the trip rollups from them, then times the
+default 30 day window, fleet-filtered, single-vehicle and full-year
+requests.
+Usage: python benchmarks/bench_usage_analytics.py [vehicle_count] [trip_count]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import insert
+from extensions import db
+from models import Fleet, FleetTripRollup, Trip, Vehicle, VehicleTripRollup
+from api import reporting
+from rollups import rebuild_trip_rollups
+
+SEED_CHUNK = 50000
+FLEETS = 20
+BUDGET_SECONDS = 1.0
+
+def _seed(vehicle_count, trip_count, rng):
+    db.session.execute(insert(Fleet), [{"name": f"fleet-{i}"} for i in range(FLEETS)])
+    db.session.execute(insert(Vehicle), [
+        {"name": f"v{i}", "status": "available", "location": "SF", "fleet_id": i % FLEETS + 1}
+        for i in range(vehicle_count)])
+    now = datetime.utcnow()
+    for offset in range(0, trip_count, SEED_CHUNK):
+        rows = []
+        for _ in range(min(SEED_CHUNK, trip_count - offset)):
+            start = now - timedelta(seconds=rng.randint(0, 365 * 86400))
+            rows.append({"vehicle_id": rng.randint(1, vehicle_count), "start_time": start,
+                         "end_time": start + timedelta(seconds=rng.randint(60, 3600))})
+        db.session.execute(insert(Trip), rows)
+    db.session.commit()
+
+def _time(client, path, runs=3):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get(path)
+        elapsed = time.perf_counter() - start
+        assert response.status_code == 200, response.data
+        best = elapsed if best is None else min(best, elapsed)
+    return best, response.json
+
+def main(vehicle_count=10000, trip_count=5000000):
+    rng = random.Random(10)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        db.init_app(app)
+        app.register_blueprint(reporting.bp)
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            _seed(vehicle_count, trip_count, rng)
+            print(f"seeded {vehicle_count} vehicles and {trip_count} trips in {time.perf_counter() - start:.0f}s")
+            start = time.perf_counter()
+            rebuild_trip_rollups(datetime.utcnow() - timedelta(days=366), datetime.utcnow())
+            db.session.commit()
+            print(f"rollup rebuild: {VehicleTripRollup.query.count()} vehicle rows, "
+                  f"{FleetTripRollup.query.count()} fleet rows in {time.perf_counter() - start:.1f}s")
+
+        client = app.test_client()
+        failed = False
+        for label, path in [("30d, all vehicles", "/api/v1/analytics/usage"),
+                            ("30d, one fleet", "/api/v1/analytics/usage?fleet=1"),
+                            ("30d, one vehicle", "/api/v1/analytics/usage?vehicle_id=1"),
+                            ("24h, all vehicles", "/api/v1/analytics/usage?window=24h"),
+                            ("1y, all vehicles", "/api/v1/analytics/usage?window=365d")]:
+            elapsed, body = _time(client, path)
+            failed |= elapsed > BUDGET_SECONDS
+            print(f"{label}: {elapsed * 1000:.0f} ms ({body['total_trips']} trips, "
+                  f"{len(body['vehicle_usage'])} vehicles)")
+        for label, path in [("fleet dashboard, 1y daily", "/api/v1/analytics/fleets/1?window=365d"),
+                            ("fleet dashboard, 7d hourly", "/api/v1/analytics/fleets/1?window=7d&grain=hour")]:
+            elapsed, body = _time(client, path)
+            failed |= elapsed > BUDGET_SECONDS
+            print(f"{label}: {elapsed * 1000:.1f} ms ({len(body['series'])} rows, {body['totals']['trips']} trips)")
+    if failed:
+        print(f"FAIL: a request exceeded {BUDGET_SECONDS:.0f}s")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
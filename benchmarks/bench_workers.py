@@ -0,0 +1,122 @@
+"""Throughput of the gunicorn entry point as server workers are added.
+
+Starts ``gunicorn -c gunicorn.conf.py wsgi:app`` against a temp-file
+SQLite database of vehicles with 1, 2, 4, ... workers, and drives GET
+/api/v1/vehicles from client processes, each issuing one request at a
+time, for a fixed time per run. Reports requests per second, latency,
+and the speed-up over one worker. Workers are processes, so the speed-up
+is bounded by the cores shared by the server and the clients; the core
+count is printed with the results.
+Needs gunicorn installed.
+Usage: python benchmarks/bench_workers.py [max_workers] [seconds] [clients] [vehicles]
+"""
+import http.client
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PATH = '/api/v1/vehicles?limit=20'
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _wait_ready(port, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {server.returncode}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', PATH)
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not become ready")
+
+def _client(args):
+    port, seconds = args
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            # Sync workers close every connection, so each request dials afresh.
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            connection.request('GET', PATH)
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            if response.status != 200:
+                errors += 1
+                continue
+        except OSError:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    return latencies, errors
+
+def _run(workers, seconds, clients, database_url, workdir):
+    port = _free_port()
+    env = dict(os.environ, DATABASE_URL=database_url, SECRET_KEY='bench-secret', PORT=str(port),
+               WEB_CONCURRENCY=str(workers), GUNICORN_THREADS='1', PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                               '--bind', f'127.0.0.1:{port}', 'wsgi:app'],
+                              env=env, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_ready(port, server)
+        # Warm every worker, so the lazily imported blueprint is not timed.
+        _client((port, 1.0))
+        with multiprocessing.Pool(clients) as pool:
+            started = time.perf_counter()
+            results = pool.map(_client, [(port, seconds)] * clients)
+            elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(30)
+    latencies = sorted(latency for latency_list, _ in results for latency in latency_list)
+    return {'rps': len(latencies) / elapsed, 'errors': sum(errors for _, errors in results),
+            'p50': statistics.median(latencies) * 1000,
+            'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000}
+
+def main(max_workers=4, seconds=10, clients=16, vehicles=5000):
+    with tempfile.TemporaryDirectory() as tmp:
+        database_url = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        from flask import Flask
+        from sqlalchemy import insert
+        from extensions import db
+        from models import Vehicle
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+        db.init_app(app)
+        with app.app_context():
+            db.create_all()
+            db.session.execute(insert(Vehicle), [
+                {"name": f"Scooter {i}", "status": "available", "location": "depot",
+                 "latitude": 52.5 + i * 1e-5, "longitude": 13.4 + i * 1e-5}
+                for i in range(vehicles)])
+            db.session.commit()
+
+        print(f"{os.cpu_count()} cores, {clients} clients, {seconds}s per run, GET {PATH}")
+        print(f"{'workers':>7s} {'req/s':>9s} {'p50':>9s} {'p99':>9s} {'errors':>7s} {'speed-up':>9s}")
+        baseline = None
+        workers = 1
+        while workers <= max_workers:
+            result = _run(workers, seconds, clients, database_url, tmp)
+            baseline = baseline or result['rps']
+            print(f"{workers:7d} {result['rps']:9.1f} {result['p50']:7.1f}ms {result['p99']:7.1f}ms "
+                  f"{result['errors']:7d} {result['rps'] / baseline:8.2f}x")
+            workers *= 2
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,114 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import Numeric, case, cast, delete, func, insert, literal, select, update
+
+from extensions import db
+from models import BillingRun, Invoice, Trip, UserBillingSummary
+from pricing_engine import NoBasePrice, pricing_engine
+from rollups import increment, increment_from_select
+
+logger = logging.getLogger(__name__)
+
+# TRIP_INVOICING: 'per_trip' bills each fare as the trip ends; 'period' leaves
+# priced trips for close_billing_period to bill in bulk.
+INVOICING_MODES = ('per_trip', 'period')
+DEFAULT_INVOICING = 'per_trip'
+INVOICE_STATUS = 'Pending'
+PAID_STATUS = 'Paid'
+_CLOSE_LOCK_KEY = 7_101_017  # Postgres advisory lock serialising period closes
+
+def price_trip(trip, config):
+    """Set ``trip.fare`` from the active pricing rules; left unset when no base price applies."""
+    minutes = (trip.end_time - trip.start_time).total_seconds() / 60
+    try:
+        quote = pricing_engine.quote(config, trip.start_time, minutes, trip.start_latitude, trip.start_longitude)
+    except NoBasePrice:
+        logger.error(f"Trip {trip.id} ended unpriced: no base price applies")
+        return None
+    trip.fare = quote['fare']
+    return trip.fare
+
+def invoice_trip(trip):
+    """Bill ``trip.fare`` to the rider on an invoice of its own, in the caller's transaction."""
+    invoice = Invoice(user_id=trip.user_id, amount=trip.fare, description=f"Trip {trip.id}",
+                      status=INVOICE_STATUS, created_at=trip.end_time)
+    db.session.add(invoice)
+    db.session.flush()
+    trip.invoice_id = invoice.id
+    record_invoice(invoice)
+    return invoice
+
+def record_invoice(invoice):
+    """Count a new invoice in its rider's ``UserBillingSummary``; call inside the invoice's transaction."""
+    increment(UserBillingSummary, {'user_id': invoice.user_id}, {'invoices': 1, 'billed': invoice.amount})
+
+def mark_invoice_paid(invoice_id):
+    """Set the invoice Paid and add it to its rider's paid total; False if it already was Paid."""
+    changed = db.session.execute(
+        update(Invoice).where(Invoice.id == invoice_id, Invoice.status.is_distinct_from(PAID_STATUS))
+        .values(status=PAID_STATUS)
+    ).rowcount
+    if not changed:
+        return False
+    user_id, amount = db.session.execute(
+        select(Invoice.user_id, Invoice.amount).where(Invoice.id == invoice_id)).one()
+    increment(UserBillingSummary, {'user_id': user_id}, {'paid': amount})
+    return True
+
+def rebuild_billing_summaries():
+    """Recompute every rider's ``UserBillingSummary`` from their invoices; returns rows written.
+
+    For backfills and repairs. Runs in the caller's transaction.
+    """
+    db.session.execute(delete(UserBillingSummary))
+    paid = case((Invoice.status == PAID_STATUS, Invoice.amount), else_=0)
+    totals = (select(Invoice.user_id, func.count(Invoice.id), func.sum(Invoice.amount), func.sum(paid))
+              .group_by(Invoice.user_id))
+    return db.session.execute(
+        insert(UserBillingSummary).from_select(['user_id', 'invoices', 'billed', 'paid'], totals)
+    ).rowcount
+
+def close_billing_period(period_start, period_end):
+    """Invoice every priced, unbilled trip that ended in ``[period_start, period_end)``, one invoice per rider.
+
+    Three statements whatever the trip count: an INSERT ... SELECT summing
+    fares per rider, an upsert adding the new invoices to the riders'
+    summaries, then an UPDATE pointing each trip at its rider's new
+    invoice. Runs in the caller's transaction; returns the ``BillingRun``.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        # Two overlapping closes would both sum the same trips before either
+        # links them. SQLite already serialises writers from the first INSERT.
+        db.session.execute(select(func.pg_advisory_xact_lock(_CLOSE_LOCK_KEY)))
+    now = datetime.utcnow()
+    run = BillingRun(period_start=period_start, period_end=period_end, created_at=now)
+    db.session.add(run)
+    db.session.flush()
+
+    unbilled = (Trip.end_time >= period_start, Trip.end_time < period_end, Trip.invoice_id.is_(None),
+                Trip.fare.isnot(None), Trip.user_id.isnot(None))
+    description = f"Trips ended {period_start:%Y-%m-%d %H:%M} to {period_end:%Y-%m-%d %H:%M} UTC"
+    totals = (select(Trip.user_id, func.round(cast(func.sum(Trip.fare), Numeric), 2), literal(description),
+                     literal(INVOICE_STATUS), literal(now), literal(run.id))
+              .where(*unbilled)
+              .group_by(Trip.user_id))
+    run.invoices = db.session.execute(
+        insert(Invoice).from_select(['user_id', 'amount', 'description', 'status', 'created_at', 'billing_run_id'],
+                                    totals)
+    ).rowcount
+    increment_from_select(UserBillingSummary, ['user_id'], ['invoices', 'billed'],
+                          select(Invoice.user_id, literal(1), Invoice.amount)
+                          .where(Invoice.billing_run_id == run.id))
+
+    trips = Trip.__table__
+    rider_invoice = (select(Invoice.id)
+                     .where(Invoice.billing_run_id == run.id, Invoice.user_id == trips.c.user_id)
+                     .scalar_subquery())
+    run.trips = db.session.execute(
+        update(trips)
+        .where(*unbilled)
+        .values(invoice_id=rider_invoice)
+    ).rowcount
+    run.completed_at = datetime.utcnow()
+    return run
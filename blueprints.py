@@ -0,0 +1,118 @@
+import ast
+import importlib
+import logging
+import os
+import pkgutil
+import threading
+
+import api
+
+logger = logging.getLogger(__name__)
+
+BLUEPRINT_PACKAGE = 'api'
+
+class BlueprintSpec:
+    """One ``api`` module's blueprint as read from its source: name, url_prefix and routes."""
+
+    def __init__(self, module, name, url_prefix, routes):
+        self.module = module
+        self.name = name
+        self.url_prefix = url_prefix
+        self.routes = routes  # (rule, function name, route options)
+
+    def url(self, rule):
+        # Same joining as Flask's BlueprintSetupState.add_url_rule.
+        if self.url_prefix is None:
+            return rule
+        if rule:
+            return '/'.join((self.url_prefix.rstrip('/'), rule.lstrip('/')))
+        return self.url_prefix
+
+class LazyView:
+    """Imports a view's module on first call, so the module's cost lands on its first request."""
+
+    def __init__(self, module, attr):
+        self.module = module
+        self.attr = attr
+        self.__name__ = attr
+        self.__module__ = module
+        self._view = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._view is None:
+            with self._lock:
+                if self._view is None:
+                    self._view = getattr(importlib.import_module(self.module), self.attr)
+        return self._view
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise ValueError(f"line {node.lineno}: blueprint and route arguments must be literals to load lazily")
+
+def _is_call_to(node, func):
+    target = node.func
+    if isinstance(target, ast.Attribute):
+        return target.attr == func
+    return isinstance(target, ast.Name) and target.id == func
+
+def read_blueprint(module, path):
+    """Parse ``module``'s source for its ``bp = Blueprint(...)`` and ``@bp.route(...)`` views, without importing it."""
+    with open(path, encoding='utf-8') as source:
+        tree = ast.parse(source.read(), path)
+    name = url_prefix = None
+    routes = []
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and isinstance(node.value, ast.Call)
+                and _is_call_to(node.value, 'Blueprint')
+                and any(isinstance(t, ast.Name) and t.id == 'bp' for t in node.targets)):
+            name = _literal(node.value.args[0])
+            url_prefix = next((_literal(k.value) for k in node.value.keywords if k.arg == 'url_prefix'), None)
+        elif isinstance(node, ast.FunctionDef):
+            for decorator in node.decorator_list:
+                if (isinstance(decorator, ast.Call) and isinstance(decorator.func, ast.Attribute)
+                        and decorator.func.attr == 'route' and isinstance(decorator.func.value, ast.Name)
+                        and decorator.func.value.id == 'bp'):
+                    options = {k.arg: _literal(k.value) for k in decorator.keywords}
+                    routes.append((_literal(decorator.args[0]), node.name, options))
+    if name is None:
+        return None
+    return BlueprintSpec(module, name, url_prefix, routes)
+
+def discover(package=api):
+    """``BlueprintSpec`` for every module of ``package`` that defines a blueprint."""
+    specs = []
+    for info in sorted(pkgutil.iter_modules(package.__path__), key=lambda info: info.name):
+        module = f'{package.__name__}.{info.name}'
+        spec = read_blueprint(module, os.path.join(info.module_finder.path, f'{info.name}.py'))
+        if spec is not None:
+            specs.append(spec)
+    return specs
+
+def register_blueprints(app, lazy=True):
+    """Register every blueprint in ``api`` on ``app``.
+
+    Lazily, each route is added to the app under its blueprint endpoint name
+    (so ``url_for`` is unchanged) with a ``LazyView`` in place of the view,
+    and a module is imported only when one of its routes is first hit.
+    Hooks a blueprint installs on the app, like ``before_app_request``,
+    are not applied in this mode; views must not depend on them.
+    """
+    specs = discover()
+    for spec in specs:
+        if not lazy:
+            app.register_blueprint(importlib.import_module(spec.module).bp)
+            continue
+        views = {}
+        for rule, function, options in spec.routes:
+            options = dict(options)
+            endpoint = options.pop('endpoint', function)
+            view = views.setdefault(function, LazyView(spec.module, function))
+            app.add_url_rule(spec.url(rule), endpoint=f'{spec.name}.{endpoint}', view_func=view, **options)
+    logger.info(f"Registered {len(specs)} blueprints ({'lazy' if lazy else 'eager'})")
+    return specs
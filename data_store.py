@@ -1,16 +1,24 @@
 import json
+from collections import defaultdict
 from datetime import datetime
+from itertools import count
 
 class DataStore:
     def __init__(self, use_in_memory=True):
         self.use_in_memory = use_in_memory
         if use_in_memory:
-            self.vehicles = []
-            self.fleets = []
-            self.trips = []
-            self.users = []
-            self.maintenance_tasks = []
-            self.reports = []
+            # Records are keyed by id; ids come from per-entity sequences so they
+            # are never reused after a delete.
+            self.vehicles = {}
+            self.fleets = {}
+            self.trips = {}
+            self.users = {}
+            self.maintenance_tasks = {}
+            self.reports = {}
+            self._sequences = defaultdict(lambda: count(1))
+            # Secondary indexes: status -> vehicle ids, vehicle id -> trip ids
+            self.vehicles_by_status = defaultdict(set)
+            self.trips_by_vehicle = defaultdict(set)
         else:
             # In the future, this could be replaced with API calls to your existing system
             pass
@@ -18,9 +26,7 @@ class DataStore:
     # User Authentication & Authorization
     def register_user(self, user_data):
         if self.use_in_memory:
-            user_data['id'] = len(self.users) + 1
-            self.users.append(user_data)
-            return user_data
+            return self._insert('users', user_data)
         else:
             return self._mock_api_call('POST', '/api/v1/auth/register', user_data)
 
@@ -47,75 +53,85 @@ class DataStore:
     # Vehicle Management
     def get_vehicles(self):
         if self.use_in_memory:
-            return self.vehicles
+            return list(self.vehicles.values())
         else:
             return self._mock_api_call('GET', '/api/v1/vehicles')
 
     def add_vehicle(self, vehicle):
         if self.use_in_memory:
-            vehicle['id'] = len(self.vehicles) + 1
-            self.vehicles.append(vehicle)
+            self._insert('vehicles', vehicle)
+            self.vehicles_by_status[vehicle.get('status')].add(vehicle['id'])
             return vehicle
         else:
             return self._mock_api_call('POST', '/api/v1/vehicles', vehicle)
 
     def get_vehicle(self, id):
         if self.use_in_memory:
-            return next((v for v in self.vehicles if v['id'] == id), None)
+            return self.vehicles.get(id)
         else:
             return self._mock_api_call('GET', f'/api/v1/vehicles/{id}')
 
     def update_vehicle(self, id, vehicle_data):
         if self.use_in_memory:
-            vehicle = next((v for v in self.vehicles if v['id'] == id), None)
-            if vehicle:
-                vehicle.update(vehicle_data)
-                return vehicle
-            return None
+            vehicle = self.vehicles.get(id)
+            if vehicle is None:
+                return None
+            old_status = vehicle.get('status')
+            self._apply_update(vehicle, vehicle_data)
+            if vehicle.get('status') != old_status:
+                self._unindex(self.vehicles_by_status, old_status, id)
+                self.vehicles_by_status[vehicle.get('status')].add(id)
+            return vehicle
         else:
             return self._mock_api_call('PUT', f'/api/v1/vehicles/{id}', vehicle_data)
 
     def delete_vehicle(self, id):
         if self.use_in_memory:
-            self.vehicles = [v for v in self.vehicles if v['id'] != id]
+            vehicle = self.vehicles.pop(id, None)
+            if vehicle is not None:
+                self._unindex(self.vehicles_by_status, vehicle.get('status'), id)
             return {"message": "Vehicle deleted"}
         else:
             return self._mock_api_call('DELETE', f'/api/v1/vehicles/{id}')
 
+    def get_vehicles_by_status(self, status):
+        if self.use_in_memory:
+            return [self.vehicles[v] for v in self.vehicles_by_status.get(status, ())]
+        else:
+            return self._mock_api_call('GET', f'/api/v1/vehicles?status={status}')
+
     # Fleet Management
     def get_fleets(self):
         if self.use_in_memory:
-            return self.fleets
+            return list(self.fleets.values())
         else:
             return self._mock_api_call('GET', '/api/v1/fleets')
 
     def add_fleet(self, fleet):
         if self.use_in_memory:
-            fleet['id'] = len(self.fleets) + 1
-            self.fleets.append(fleet)
-            return fleet
+            return self._insert('fleets', fleet)
         else:
             return self._mock_api_call('POST', '/api/v1/fleets', fleet)
 
     def get_fleet(self, id):
         if self.use_in_memory:
-            return next((f for f in self.fleets if f['id'] == id), None)
+            return self.fleets.get(id)
         else:
             return self._mock_api_call('GET', f'/api/v1/fleets/{id}')
 
     def update_fleet(self, id, fleet_data):
         if self.use_in_memory:
-            fleet = next((f for f in self.fleets if f['id'] == id), None)
-            if fleet:
-                fleet.update(fleet_data)
-                return fleet
-            return None
+            fleet = self.fleets.get(id)
+            if fleet is None:
+                return None
+            self._apply_update(fleet, fleet_data)
+            return fleet
         else:
             return self._mock_api_call('PUT', f'/api/v1/fleets/{id}', fleet_data)
 
     def delete_fleet(self, id):
         if self.use_in_memory:
-            self.fleets = [f for f in self.fleets if f['id'] != id]
+            self.fleets.pop(id, None)
             return {"message": "Fleet deleted"}
         else:
             return self._mock_api_call('DELETE', f'/api/v1/fleets/{id}')
@@ -123,64 +139,86 @@ class DataStore:
     # Trip Management
     def get_trips(self):
         if self.use_in_memory:
-            return self.trips
+            return list(self.trips.values())
         else:
             return self._mock_api_call('GET', '/api/v1/trips')
 
     def add_trip(self, trip):
         if self.use_in_memory:
-            trip['id'] = len(self.trips) + 1
-            self.trips.append(trip)
+            self._insert('trips', trip)
+            self.trips_by_vehicle[trip.get('vehicle_id')].add(trip['id'])
             return trip
         else:
             return self._mock_api_call('POST', '/api/v1/trips', trip)
 
     def get_trip(self, id):
         if self.use_in_memory:
-            return next((t for t in self.trips if t['id'] == id), None)
+            return self.trips.get(id)
         else:
             return self._mock_api_call('GET', f'/api/v1/trips/{id}')
 
     def update_trip(self, id, trip_data):
         if self.use_in_memory:
-            trip = next((t for t in self.trips if t['id'] == id), None)
-            if trip:
-                trip.update(trip_data)
-                return trip
-            return None
+            trip = self.trips.get(id)
+            if trip is None:
+                return None
+            old_vehicle_id = trip.get('vehicle_id')
+            self._apply_update(trip, trip_data)
+            if trip.get('vehicle_id') != old_vehicle_id:
+                self._unindex(self.trips_by_vehicle, old_vehicle_id, id)
+                self.trips_by_vehicle[trip.get('vehicle_id')].add(id)
+            return trip
         else:
             return self._mock_api_call('PUT', f'/api/v1/trips/{id}', trip_data)
 
+    def get_trips_for_vehicle(self, vehicle_id):
+        if self.use_in_memory:
+            return [self.trips[t] for t in self.trips_by_vehicle.get(vehicle_id, ())]
+        else:
+            return self._mock_api_call('GET', f'/api/v1/trips?vehicle_id={vehicle_id}')
+
     # Maintenance
     def get_maintenance(self):
         if self.use_in_memory:
-            return self.maintenance_tasks
+            return list(self.maintenance_tasks.values())
         else:
             return self._mock_api_call('GET', '/api/v1/maintenance')
 
     def add_maintenance(self, task):
         if self.use_in_memory:
-            task['id'] = len(self.maintenance_tasks) + 1
-            self.maintenance_tasks.append(task)
-            return task
+            return self._insert('maintenance_tasks', task)
         else:
             return self._mock_api_call('POST', '/api/v1/maintenance', task)
 
     # Reporting
     def get_reports(self):
         if self.use_in_memory:
-            return self.reports
+            return list(self.reports.values())
         else:
             return self._mock_api_call('GET', '/api/v1/reports')
 
     def add_report(self, report):
         if self.use_in_memory:
-            report['id'] = len(self.reports) + 1
-            self.reports.append(report)
-            return report
+            return self._insert('reports', report)
         else:
             return self._mock_api_call('POST', '/api/v1/reports', report)
 
+    def _insert(self, collection, record):
+        record['id'] = next(self._sequences[collection])
+        getattr(self, collection)[record['id']] = record
+        return record
+
+    def _apply_update(self, record, data):
+        # The id is the dict key, so it must not change underneath it.
+        record.update((k, v) for k, v in data.items() if k != 'id')
+
+    def _unindex(self, index, key, id):
+        ids = index.get(key)
+        if ids is not None:
+            ids.discard(id)
+            if not ids:
+                del index[key]
+
     def _mock_api_call(self, method, endpoint, data=None):
         # This method simulates an API call to your existing system
         # In the future, this would be replaced with actual API calls
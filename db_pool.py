@@ -0,0 +1,155 @@
+import bisect
+import logging
+import os
+import threading
+import time
+import weakref
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+from payment_worker import DEFAULT_WORKERS as DEFAULT_PAYMENT_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Threads besides request and payment threads that hold a connection while
+# they run: the payment dispatcher, the telemetry flusher and the demand
+# refresher. Report jobs run in their own processes with their own engines.
+FIXED_BACKGROUND_THREADS = 3
+DEFAULT_POOL_TIMEOUT_S = 10
+DEFAULT_POOL_RECYCLE_S = 1800
+# Upper bounds of the checkout wait histogram, in milliseconds.
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_engines = weakref.WeakSet()
+
+def _int(environ, name, default):
+    value = environ.get(name)
+    return int(value) if value not in (None, '') else default
+
+def in_memory_database(database_uri):
+    url = make_url(database_uri)
+    return url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:')
+
+def engine_options(database_uri, config, environ=os.environ):
+    """SQLALCHEMY_ENGINE_OPTIONS for one server worker process.
+
+    Each worker has its own pool. It defaults to one connection for every
+    thread that can hold one at the same time: the request threads
+    (GUNICORN_THREADS), the PAYMENT_WORKERS threads from ``config`` and the
+    fixed background threads, and as many again as overflow. DB_POOL_SIZE
+    and DB_MAX_OVERFLOW set them outright. DB_MAX_CONNECTIONS is the budget
+    for the whole server: it is split across the WEB_CONCURRENCY workers
+    and caps each worker's size plus overflow, so adding workers cannot
+    exhaust the database.
+    """
+    if not database_uri or in_memory_database(database_uri):
+        return {}  # one shared connection; Flask-SQLAlchemy picks StaticPool
+    workers = max(_int(environ, 'WEB_CONCURRENCY', 1), 1)
+    threads = max(_int(environ, 'GUNICORN_THREADS', 1), 1)
+    payment_threads = max(config.get('PAYMENT_WORKERS', DEFAULT_PAYMENT_WORKERS), 0)
+    needed = threads + payment_threads + FIXED_BACKGROUND_THREADS
+    pool_size = _int(environ, 'DB_POOL_SIZE', needed)
+    max_overflow = _int(environ, 'DB_MAX_OVERFLOW', pool_size)
+    budget = _int(environ, 'DB_MAX_CONNECTIONS', 0)
+    if budget:
+        per_worker = max(budget // workers, 1)
+        pool_size = min(pool_size, per_worker)
+        max_overflow = max(min(max_overflow, per_worker - pool_size), 0)
+    if pool_size + max_overflow < needed:
+        logger.warning(f"Database pool of {pool_size}+{max_overflow} is below the {needed} threads that may "
+                       f"hold a connection; lower PAYMENT_WORKERS or raise DB_MAX_CONNECTIONS")
+    return {
+        'poolclass': MeteredQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': float(environ.get('DB_POOL_TIMEOUT_S') or DEFAULT_POOL_TIMEOUT_S),
+        'pool_recycle': _int(environ, 'DB_POOL_RECYCLE_S', DEFAULT_POOL_RECYCLE_S),
+        'pool_pre_ping': environ.get('DB_POOL_PRE_PING', '1') != '0',
+    }
+
+class PoolMetrics:
+    """Checkout waits and timeouts for this process's pools, with their live saturation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = weakref.WeakSet()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {'checkouts': 0, 'timeouts': 0, 'wait_ms_total': 0.0, 'wait_ms_max': 0.0,
+                          'peak_checked_out': 0}
+            self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)  # the last one is +Inf
+
+    def track(self, pool):
+        self._pools.add(pool)
+
+    def record(self, pool, wait_s, timed_out=False):
+        wait_ms = wait_s * 1000
+        with self._lock:
+            if timed_out:
+                self.stats['timeouts'] += 1
+            else:
+                self.stats['checkouts'] += 1
+            self.stats['wait_ms_total'] += wait_ms
+            self.stats['wait_ms_max'] = max(self.stats['wait_ms_max'], wait_ms)
+            self.stats['peak_checked_out'] = max(self.stats['peak_checked_out'], pool.checkedout())
+            self.wait_buckets[bisect.bisect_left(WAIT_BUCKETS_MS, wait_ms)] += 1
+
+    def metrics(self):
+        pools = list(self._pools)
+        with self._lock:
+            snapshot = dict(self.stats)
+            buckets = list(self.wait_buckets)
+        snapshot['wait_ms_total'] = round(snapshot['wait_ms_total'], 3)
+        snapshot['wait_ms_max'] = round(snapshot['wait_ms_max'], 3)
+        waits = snapshot['checkouts'] + snapshot['timeouts']
+        snapshot['wait_ms_avg'] = round(snapshot['wait_ms_total'] / waits, 3) if waits else 0.0
+        snapshot['wait_ms_buckets'] = [{'le': bound, 'count': count}
+                                       for bound, count in zip(WAIT_BUCKETS_MS + ('+Inf',), buckets)]
+        snapshot['pool_size'] = sum(pool.size() for pool in pools)
+        snapshot['capacity'] = sum(pool.capacity for pool in pools)
+        snapshot['checked_out'] = sum(pool.checkedout() for pool in pools)
+        snapshot['overflow'] = sum(max(pool.overflow(), 0) for pool in pools)
+        snapshot['saturation'] = (round(snapshot['checked_out'] / snapshot['capacity'], 3)
+                                  if snapshot['capacity'] else 0.0)
+        snapshot['pid'] = os.getpid()
+        return snapshot
+
+pool_metrics = PoolMetrics()
+
+class MeteredQueuePool(QueuePool):
+    """``QueuePool`` that records how long each checkout waited, including any pre-ping."""
+
+    def __init__(self, creator, pool_size=5, max_overflow=10, **kwargs):
+        super().__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kwargs)
+        self.capacity = pool_size + max(max_overflow, 0)
+        pool_metrics.track(self)
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeout:
+            pool_metrics.record(self, time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.record(self, time.perf_counter() - start)
+        return connection
+
+def track_engines(engines):
+    """Remember ``engines`` so a forked child replaces their pools before first use."""
+    for engine in engines:
+        _engines.add(engine)
+
+def _dispose_after_fork():
+    # The child must not touch connections it inherited; close=False leaves
+    # them to the parent and gives each engine a fresh, empty pool. Metrics
+    # start over too, with a new lock in case a parent thread held the old one.
+    pool_metrics.__init__()
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
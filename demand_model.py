@@ -0,0 +1,204 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import Integer, cast, func, select
+
+from exports import stream_rows
+from extensions import db
+from models import Trip
+from rebalancer import DEFAULT_ZONE_SIZE_DEG, zone_key, zone_keys
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOOKBACK_DAYS = 28
+DEFAULT_REFRESH_INTERVAL_S = 900
+HOURS_PER_WEEK = 168
+# Local hours of the day in each range; night wraps past midnight.
+TIME_RANGES = {
+    'morning': range(6, 12),
+    'afternoon': range(12, 17),
+    'evening': range(17, 22),
+    'night': (22, 23, 0, 1, 2, 3, 4, 5),
+}
+_EPOCH_WEEKDAY = 3  # 1970-01-01 was a Thursday; hour-of-week 0 is Monday 00:00
+
+def hours_of_week(epoch_seconds, utc_offset_hours=0):
+    """Hour of the week (Monday 00:00 = 0) for each UTC epoch timestamp."""
+    hours = np.floor_divide(np.asarray(epoch_seconds, dtype=np.int64), 3600) + utc_offset_hours
+    return (hours + _EPOCH_WEEKDAY * 24) % HOURS_PER_WEEK
+
+def window_exposure(since, until, utc_offset_hours=0):
+    """How many times each hour of the week occurs in the naive UTC window ``[since, until)``."""
+    epoch = datetime(1970, 1, 1)
+    first = int((since - epoch).total_seconds()) // 3600
+    last = -(-int((until - epoch).total_seconds()) // 3600)
+    return np.bincount(hours_of_week(np.arange(first, last) * 3600, utc_offset_hours), minlength=HOURS_PER_WEEK)
+
+def demand_histogram(keys, hours):
+    """``(zone_keys, counts)`` where ``counts[z, h]`` is the number of trip starts in zone ``z`` at hour-of-week ``h``."""
+    zones, zone_index = np.unique(keys, return_inverse=True)
+    counts = np.bincount(zone_index * HOURS_PER_WEEK + hours, minlength=len(zones) * HOURS_PER_WEEK)
+    return zones, counts.reshape(len(zones), HOURS_PER_WEEK)
+
+class Forecast:
+    """Expected trip starts per day in one time range, for every zone with history."""
+    __slots__ = ('time_range', 'zone_size', 'keys', 'rates')
+
+    def __init__(self, time_range, zone_size_deg, keys, rates):
+        self.time_range = time_range
+        self.zone_size = zone_size_deg
+        self.keys = keys
+        self.rates = rates
+
+class DemandSnapshot:
+    """Immutable per-zone, per-hour-of-week trip-start rates and the forecasts derived from them.
+
+    Built off the request path; every read is a dict lookup plus array
+    indexing, so callers never touch trip history.
+    """
+
+    def __init__(self, zone_size_deg, keys, counts, exposure, utc_offset_hours=0, trips=0, built_at=None):
+        self.zone_size = zone_size_deg
+        self.utc_offset_hours = utc_offset_hours
+        self.keys = keys
+        self.trips = trips
+        self.built_at = built_at or datetime.utcnow()
+        self._zone_index = {int(key): i for i, key in enumerate(keys)}
+        # Trip starts per hour: counts over the number of times each hour of the week was observed.
+        self.hourly = (counts / np.maximum(exposure, 1)).astype(np.float32)
+        self.forecasts = {}
+        for time_range, hours in TIME_RANGES.items():
+            columns = [day * 24 + hour for day in range(7) for hour in hours]
+            rates = self.hourly[:, columns].sum(axis=1, dtype=np.float64) / 7
+            keep = rates > 0
+            self.forecasts[time_range] = Forecast(time_range, zone_size_deg, keys[keep], rates[keep])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def forecast(self, time_range):
+        return self.forecasts[time_range]
+
+    def hourly_rate(self, lat, lon, moment):
+        """Expected trip starts per hour in the zone around ``(lat, lon)`` at the naive UTC ``moment``."""
+        zone = self._zone_index.get(zone_key(lat, lon, self.zone_size))
+        if zone is None:
+            return 0.0
+        hour = (moment.weekday() * 24 + moment.hour + self.utc_offset_hours) % HOURS_PER_WEEK
+        return float(self.hourly[zone, hour])
+
+def _epoch_seconds(column):
+    if db.engine.dialect.name == 'sqlite':
+        return cast(func.strftime('%s', column), Integer)
+    return cast(func.extract('epoch', column), Integer)
+
+def build_snapshot(zone_size_deg=DEFAULT_ZONE_SIZE_DEG, lookback_days=DEFAULT_LOOKBACK_DAYS, utc_offset_hours=0):
+    """Aggregate located trip starts over the last ``lookback_days`` into a ``DemandSnapshot``."""
+    until = datetime.utcnow()
+    since = until - timedelta(days=lookback_days)
+    stmt = (select(_epoch_seconds(Trip.start_time), Trip.start_latitude, Trip.start_longitude)
+            .where(Trip.start_time >= since, Trip.start_latitude.isnot(None), Trip.start_longitude.isnot(None)))
+    # Only one int64 per trip is kept while streaming: zone key and hour of week packed together.
+    codes = []
+    for rows in stream_rows(stmt):
+        # Column by column: np.array over Row objects goes through the sequence protocol per row.
+        epoch_seconds, lats, lons = (np.array(column, dtype=np.float64) for column in zip(*rows))
+        codes.append(zone_keys(lats, lons, zone_size_deg) * HOURS_PER_WEEK
+                     + hours_of_week(epoch_seconds, utc_offset_hours))
+    codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.int64)
+    keys, counts = demand_histogram(codes // HOURS_PER_WEEK, codes % HOURS_PER_WEEK)
+    return DemandSnapshot(zone_size_deg, keys, counts, window_exposure(since, until, utc_offset_hours),
+                          utc_offset_hours, trips=len(codes), built_at=until)
+
+class DemandModel:
+    """Holds the current ``DemandSnapshot`` and rebuilds it on a schedule.
+
+    A refresh builds a new snapshot and swaps the reference, so readers
+    never wait on it and never see a half-built one.
+    """
+
+    def __init__(self, refresh_interval_s=DEFAULT_REFRESH_INTERVAL_S):
+        self.refresh_interval = refresh_interval_s
+        self._snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._app = None
+        self.stats = {'refreshes': 0, 'refresh_errors': 0, 'last_refresh_ms': 0.0}
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    def start(self, app, warm=False):
+        """Start the background refresher for ``app`` once per process.
+
+        With ``warm`` it builds the first snapshot straight away, so the
+        first caller that needs one does not have to.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._refresh_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app
+            self.refresh_interval = app.config.get('DEMAND_REFRESH_INTERVAL_S', DEFAULT_REFRESH_INTERVAL_S)
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(warm,), name='demand-refresher', daemon=True)
+            self._thread.start()
+            atexit.register(self._stop.set)
+
+    def _run(self, warm):
+        if warm:
+            self._background_refresh(initial=True)
+        while not self._stop.wait(self.refresh_interval):
+            self._background_refresh()
+
+    def _background_refresh(self, initial=False):
+        try:
+            with self._app.app_context():
+                if not initial:
+                    self.refresh()
+                    return
+                # Under the lock, so a caller that needs the snapshot meanwhile waits for this build.
+                with self._refresh_lock:
+                    if self._snapshot is None:
+                        self.refresh()
+        except Exception as e:
+            # Keep serving the previous snapshot; the next interval retries.
+            self.stats['refresh_errors'] += 1
+            logger.error(f"Unexpected error refreshing demand forecasts: {str(e)}")
+
+    def refresh(self, config=None):
+        """Rebuild from trip history; needs an application context."""
+        config = config if config is not None else (self._app.config if self._app else {})
+        start = time.perf_counter()
+        snapshot = build_snapshot(config.get('DEMAND_ZONE_SIZE_DEG', DEFAULT_ZONE_SIZE_DEG),
+                                  config.get('DEMAND_LOOKBACK_DAYS', DEFAULT_LOOKBACK_DAYS),
+                                  config.get('DEMAND_UTC_OFFSET_HOURS', 0))
+        self._snapshot = snapshot
+        self.stats['refreshes'] += 1
+        self.stats['last_refresh_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        return snapshot
+
+    def snapshot(self, config=None):
+        """The current snapshot, built synchronously on first use in this process."""
+        current = self._snapshot
+        if current is not None:
+            return current
+        with self._refresh_lock:
+            if self._snapshot is None:
+                self.refresh(config)
+            return self._snapshot
+
+    def forecast(self, time_range, config=None):
+        return self.snapshot(config).forecast(time_range)
+
+    def clear(self):
+        self._snapshot = None
+
+demand_model = DemandModel()
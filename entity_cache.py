@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, request
+
+# Writes invalidate entries only in the worker that made them, so this is
+# also how long another worker may serve a superseded entity or a stale 304.
+DEFAULT_TTL_SECONDS = 5
+DEFAULT_MAX_ENTRIES = 10000
+
+class EntityCache:
+    """Thread-safe LRU cache with a per-entry TTL.
+
+    Keys are ``(kind, id)`` tuples and values are ``(etag, payload)``.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, kind, *ids):
+        with self._lock:
+            for entity_id in ids:
+                self._entries.pop((kind, entity_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+entity_cache = EntityCache()
+
+def row_etag(row, stamp):
+    # The creation stamp keeps the tag unique if the database reuses an id.
+    return f"{row.id}-{row.version}-{int(stamp.timestamp() * 1000000) if stamp else 0}"
+
+def cached_entity_response(kind, entity_id, load):
+    """Serve a single entity through ``entity_cache`` with ETag revalidation.
+
+    ``load`` is called only on a cache miss and returns ``(etag, payload)`` or
+    ``None`` when the entity does not exist. Returns ``None`` for a missing
+    entity so the caller can produce its own 404.
+    """
+    key = (kind, entity_id)
+    cached = entity_cache.get(key)
+    if cached is None:
+        cached = load()
+        if cached is None:
+            return None
+        entity_cache.set(key, cached, current_app.config.get('ENTITY_CACHE_TTL'))
+    etag, payload = cached
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,105 @@
+import csv
+import json
+import logging
+import zlib
+from datetime import datetime
+
+from flask import Response, stream_with_context
+from sqlalchemy import DateTime
+
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = 5000  # Rows fetched from the cursor and encoded per chunk
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+class _Chunk:
+    # Write target for csv.writer: collects one chunk of text.
+    __slots__ = ('parts',)
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def take(self):
+        text = ''.join(self.parts)
+        self.parts = []
+        return text
+
+def _isoformat(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _csv_chunks(columns, batches):
+    datetime_positions = [i for i, column in enumerate(columns) if isinstance(column.type, DateTime)]
+    out = _Chunk()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow([column.key for column in columns])
+    for rows in batches:
+        if datetime_positions:
+            converted = []
+            for row in rows:
+                row = list(row)
+                for i in datetime_positions:
+                    if row[i] is not None:
+                        row[i] = row[i].isoformat()
+                converted.append(row)
+            rows = converted
+        writer.writerows(rows)
+        yield out.take()
+    yield out.take()
+
+def _ndjson_chunks(columns, batches):
+    keys = [column.key for column in columns]
+    encode = json.JSONEncoder(separators=(',', ':'), default=_isoformat).encode
+    for rows in batches:
+        yield ''.join([encode(dict(zip(keys, row))) + '\n' for row in rows])
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        packed = compressor.compress(chunk.encode())
+        if packed:
+            yield packed
+    yield compressor.flush()
+
+def stream_rows(stmt):
+    """Yield ``stmt``'s result in lists of up to ``EXPORT_BATCH_SIZE`` rows.
+
+    The query runs on its own connection with a server-side cursor, so only
+    one batch is held in memory however many rows match.
+    """
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE).execute(stmt)
+        for rows in result.partitions():
+            yield rows
+
+def export_response(stmt, export_format, filename, gzip=False):
+    """Stream ``stmt``'s rows as a CSV or NDJSON attachment, gzip-encoded if asked.
+
+    Nothing is buffered beyond the current batch and the response has no
+    Content-Length, so it goes out with chunked transfer encoding.
+    """
+    columns = list(stmt.selected_columns)
+    encoder = _csv_chunks if export_format == 'csv' else _ndjson_chunks
+
+    def generate():
+        chunks = encoder(columns, stream_rows(stmt))
+        try:
+            yield from (_gzipped(chunks) if gzip else chunks)
+        except Exception as e:
+            # Headers are already sent; the client sees a truncated body.
+            logger.error(f"Export of {filename} aborted: {str(e)}")
+            raise
+
+    response = Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    response.headers['X-Accel-Buffering'] = 'no'  # Don't let a fronting proxy buffer the whole export
+    response.headers['Vary'] = 'Accept-Encoding'
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,341 @@
+import codecs
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, delete, exists, insert, or_, update
+
+from entity_cache import entity_cache
+from extensions import db
+from models import Alert, Maintenance, Station, Trip, Vehicle
+from spatial_index import index_vehicle_values, vehicle_index
+
+READ_CHUNK_SIZE = 64 * 1024
+WRITE_BATCH_SIZE = 1000
+MAX_REPORTED_CONFLICTS = 100
+VEHICLE_FEEDS = ('free_bike_status', 'vehicle_status')
+STATION_FEEDS = ('station_status',)
+
+_ARRAY_KEY = re.compile(r'"(bikes|vehicles|stations)"\s*:\s*\[')
+# GBFS before 3.0 sends POSIX seconds, 3.0 an RFC 3339 string; both are read as seconds.
+_META_FIELDS = {name: re.compile(rf'"{name}"\s*:\s*(\d+|"[^"]*")') for name in ('last_updated', 'ttl')}
+
+class FeedError(ValueError):
+    pass
+
+def _seconds(token):
+    if not token.startswith('"'):
+        return int(token)
+    try:
+        moment = datetime.fromisoformat(token[1:-1])
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+class FeedReader:
+    """Incremental reader for a GBFS feed document.
+
+    Only the current chunk and the item being decoded are held in memory;
+    the ``bikes``/``vehicles``/``stations`` array is yielded one object at a
+    time via ``JSONDecoder.raw_decode``. ``last_updated`` and ``ttl`` are
+    picked out of the text around the array.
+    """
+
+    def __init__(self, stream, chunk_size=READ_CHUNK_SIZE):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._eof = False
+        self.key = None
+        self.meta = {}
+        self._open_array()
+
+    def _read(self):
+        if self._eof:
+            return False
+        chunk = self._stream.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            self._buffer += self._decoder.decode(b'', final=True)
+            return False
+        self._buffer += self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        return True
+
+    def _scan_meta(self, text):
+        for name, pattern in _META_FIELDS.items():
+            match = pattern.search(text)
+            if match:
+                value = _seconds(match.group(1))
+                if value is not None:
+                    self.meta[name] = value
+
+    def _open_array(self):
+        header = ''
+        while True:
+            match = _ARRAY_KEY.search(self._buffer)
+            if match:
+                header += self._buffer[:match.start()]
+                self.key = match.group(1)
+                self._buffer = self._buffer[match.end():]
+                self._scan_meta(header)
+                return
+            # Keep a tail in case the key straddles two chunks.
+            header += self._buffer[:-64]
+            self._buffer = self._buffer[-64:]
+            if not self._read():
+                raise FeedError("Feed has no bikes, vehicles or stations array")
+
+    def items(self):
+        pos = 0
+        while True:
+            buffer = self._buffer
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == ']':
+                self._buffer = buffer[pos + 1:]
+                break
+            try:
+                if pos >= len(buffer):
+                    raise json.JSONDecodeError("Need more data", buffer, pos)
+                item, pos = self._json.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                self._buffer = buffer[pos:]
+                pos = 0
+                if not self._read():
+                    raise FeedError(f"Truncated or malformed {self.key} array")
+                continue
+            yield item
+            if pos > self._chunk_size:
+                self._buffer = buffer[pos:]
+                pos = 0
+        # Whatever follows the array may still carry last_updated/ttl.
+        while self._read():
+            pass
+        self._scan_meta(self._buffer)
+
+_last_applied = {}
+_last_applied_lock = threading.Lock()
+
+def _is_stale(source, feed, last_updated):
+    if last_updated is None:
+        return False
+    with _last_applied_lock:
+        return _last_applied.get((source, feed), -1) >= last_updated
+
+def _mark_applied(source, feed, last_updated):
+    if last_updated is not None:
+        with _last_applied_lock:
+            _last_applied[(source, feed)] = max(_last_applied.get((source, feed), -1), last_updated)
+
+_vehicles = Vehicle.__table__
+_update_vehicle = (
+    update(_vehicles)
+    .where(_vehicles.c.id == bindparam('b_id'))
+    .values(status=bindparam('b_status'), latitude=bindparam('b_lat'),
+            longitude=bindparam('b_lon'), location=bindparam('b_location'))
+)
+_vehicle_referenced = or_(
+    exists().where(Trip.vehicle_id == _vehicles.c.id),
+    exists().where(Maintenance.vehicle_id == _vehicles.c.id),
+    exists().where(Alert.vehicle_id == _vehicles.c.id),
+)
+
+def _vehicle_state(item):
+    if item.get('is_disabled'):
+        status = 'disabled'
+    elif item.get('is_reserved'):
+        status = 'reserved'
+    else:
+        status = 'available'
+    return (status, item.get('lat'), item.get('lon'), item.get('station_id'))
+
+def ingest_vehicle_feed(source, reader):
+    """Diff a free_bike_status/vehicle_status feed against ``source``'s vehicles.
+
+    Vehicles are matched on ``serial_number`` (``<source>:<vehicle id>``).
+    Vehicles missing from the feed are deleted, or set ``offline`` when trips,
+    maintenance or alerts still reference them. A new vehicle whose serial
+    is already taken by a vehicle outside ``source`` is skipped and counted
+    in ``conflicts``, its id listed in ``conflicting_ids``. Runs in one
+    transaction.
+    """
+    prefix = f"{source}:"
+    current = {serial: (vid, (status, lat, lon, location))
+               for vid, serial, status, lat, lon, location in
+               db.session.query(Vehicle.id, Vehicle.serial_number, Vehicle.status, Vehicle.latitude,
+                                Vehicle.longitude, Vehicle.location)
+               .filter(Vehicle.source == source).yield_per(10000)}
+    stats = {'items': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'retired': 0, 'invalid': 0,
+             'conflicts': 0, 'conflicting_ids': []}
+    seen = set()
+    inserts, updates, touched = [], [], []
+
+    def flush_inserts():
+        # Serials are globally unique, and vehicles created through the API may use any of them.
+        taken = {serial for (serial,) in db.session.query(Vehicle.serial_number)
+                 .filter(Vehicle.serial_number.in_([row['serial_number'] for row in inserts]))}
+        if taken:
+            stats['conflicts'] += len(taken)
+            stats['conflicting_ids'].extend(row['name'] for row in inserts if row['serial_number'] in taken)
+            del stats['conflicting_ids'][MAX_REPORTED_CONFLICTS:]
+            inserts[:] = [row for row in inserts if row['serial_number'] not in taken]
+            if not inserts:
+                return
+        result = db.session.execute(insert(Vehicle).returning(Vehicle.id, sort_by_parameter_order=True), inserts)
+        for vehicle_id, row in zip(result.scalars(), inserts):
+            touched.append((vehicle_id, row['latitude'], row['longitude'], row['status']))
+        stats['inserted'] += len(inserts)
+        inserts.clear()
+
+    def flush_updates():
+        db.session.execute(_update_vehicle, updates)
+        for row in updates:
+            touched.append((row['b_id'], row['b_lat'], row['b_lon'], row['b_status']))
+        stats['updated'] += len(updates)
+        updates.clear()
+
+    for item in reader.items():
+        stats['items'] += 1
+        external_id = item.get('vehicle_id') or item.get('bike_id') if isinstance(item, dict) else None
+        if not external_id:
+            stats['invalid'] += 1
+            continue
+        serial = f"{prefix}{external_id}"[:64]
+        if serial in seen:
+            continue
+        seen.add(serial)
+        state = _vehicle_state(item)
+        existing = current.get(serial)
+        if existing is None:
+            status, lat, lon, location = state
+            inserts.append({'serial_number': serial, 'source': source, 'name': str(external_id)[:80],
+                            'status': status, 'latitude': lat, 'longitude': lon, 'location': location})
+            if len(inserts) >= WRITE_BATCH_SIZE:
+                flush_inserts()
+        elif existing[1] != state:
+            status, lat, lon, location = state
+            updates.append({'b_id': existing[0], 'b_status': status, 'b_lat': lat, 'b_lon': lon,
+                            'b_location': location})
+            if len(updates) >= WRITE_BATCH_SIZE:
+                flush_updates()
+        else:
+            stats['unchanged'] += 1
+    if inserts:
+        flush_inserts()
+    if updates:
+        flush_updates()
+
+    missing = [vid for serial, (vid, state) in current.items()
+               if serial not in seen and state[0] != 'offline']
+    removed = []
+    for start in range(0, len(missing), WRITE_BATCH_SIZE):
+        chunk = missing[start:start + WRITE_BATCH_SIZE]
+        stats['retired'] += db.session.execute(
+            update(_vehicles).where(_vehicles.c.id.in_(chunk), _vehicle_referenced).values(status='offline')
+        ).rowcount
+        stats['deleted'] += db.session.execute(
+            delete(_vehicles).where(_vehicles.c.id.in_(chunk), ~_vehicle_referenced)
+        ).rowcount
+        removed.extend(chunk)
+    db.session.commit()
+
+    entity_cache.invalidate('vehicle', *(t[0] for t in touched), *removed)
+    if vehicle_index.loaded:
+        for vehicle_id, lat, lon, status in touched:
+            index_vehicle_values(vehicle_id, lat, lon, status)
+        for vehicle_id in removed:
+            vehicle_index.remove(vehicle_id)
+    return stats
+
+_stations = Station.__table__
+_STATION_FIELDS = ('num_bikes_available', 'num_docks_available', 'is_installed', 'is_renting', 'is_returning',
+                   'last_reported')
+_update_station = (
+    update(_stations)
+    .where(_stations.c.id == bindparam('b_id'))
+    .values(**{field: bindparam(f'b_{field}') for field in _STATION_FIELDS})
+)
+
+def _station_state(item):
+    return tuple(
+        bool(item.get(field)) if field.startswith('is_') and item.get(field) is not None else item.get(field)
+        for field in _STATION_FIELDS
+    )
+
+def ingest_station_feed(source, reader):
+    """Diff a station_status feed against ``source``'s stations."""
+    current = {station_id: (sid, tuple(state))
+               for sid, station_id, *state in
+               db.session.query(Station.id, Station.station_id,
+                                *(getattr(Station, field) for field in _STATION_FIELDS))
+               .filter(Station.source == source)}
+    stats = {'items': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0, 'invalid': 0}
+    seen = set()
+    inserts, updates = [], []
+    for item in reader.items():
+        stats['items'] += 1
+        station_id = item.get('station_id') if isinstance(item, dict) else None
+        if not station_id:
+            stats['invalid'] += 1
+            continue
+        station_id = str(station_id)[:64]
+        if station_id in seen:
+            continue
+        seen.add(station_id)
+        state = _station_state(item)
+        existing = current.get(station_id)
+        if existing is None:
+            inserts.append(dict(zip(_STATION_FIELDS, state), source=source, station_id=station_id))
+        elif existing[1] != state:
+            updates.append(dict({f'b_{f}': v for f, v in zip(_STATION_FIELDS, state)}, b_id=existing[0]))
+        else:
+            stats['unchanged'] += 1
+        if len(inserts) >= WRITE_BATCH_SIZE:
+            db.session.execute(insert(Station), inserts)
+            stats['inserted'] += len(inserts)
+            inserts.clear()
+        if len(updates) >= WRITE_BATCH_SIZE:
+            db.session.execute(_update_station, updates)
+            stats['updated'] += len(updates)
+            updates.clear()
+    if inserts:
+        db.session.execute(insert(Station), inserts)
+        stats['inserted'] += len(inserts)
+    if updates:
+        db.session.execute(_update_station, updates)
+        stats['updated'] += len(updates)
+    missing = [sid for station_id, (sid, _) in current.items() if station_id not in seen]
+    for start in range(0, len(missing), WRITE_BATCH_SIZE):
+        stats['deleted'] += db.session.execute(
+            delete(_stations).where(_stations.c.id.in_(missing[start:start + WRITE_BATCH_SIZE]))
+        ).rowcount
+    db.session.commit()
+    return stats
+
+def ingest_feed(source, feed, stream):
+    """Parse and apply one GBFS feed document read from ``stream``.
+
+    Returns a stats dict. A feed whose ``last_updated`` is not newer than the
+    last one applied for the same source is skipped.
+    """
+    if feed not in VEHICLE_FEEDS + STATION_FEEDS:
+        raise FeedError(f"Unsupported feed: {feed}")
+    start = time.perf_counter()
+    reader = FeedReader(stream)
+    last_updated = reader.meta.get('last_updated')
+    if _is_stale(source, feed, last_updated):
+        return {'skipped': True, 'last_updated': last_updated}
+    if feed in VEHICLE_FEEDS:
+        stats = ingest_vehicle_feed(source, reader)
+    else:
+        stats = ingest_station_feed(source, reader)
+    _mark_applied(source, feed, reader.meta.get('last_updated'))
+    stats.update(reader.meta)
+    stats['duration_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return stats
@@ -0,0 +1,211 @@
+import gzip
+import json
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from flask import current_app
+
+from extensions import db
+from models import Vehicle
+
+DEFAULT_TTL_SECONDS = 10
+# Changes written through another worker are published within this many seconds.
+DEFAULT_MAX_AGE_S = 30
+# Collapse bursts of changes into at most one rebuild per interval.
+MIN_REBUILD_INTERVAL = 1.0
+
+# status -> (is_reserved, is_disabled); other statuses (in_use, offline, ...) are not published
+PUBLISHED_STATUSES = {
+    'available': (False, False),
+    'reserved': (True, False),
+    'disabled': (False, True),
+    'maintenance': (False, True),
+}
+# Each feed belongs to the discovery document of its version; 3.0 timestamps are RFC 3339 strings.
+FEEDS = {
+    'free_bike_status': {'array': 'bikes', 'id_field': 'bike_id', 'version': '2.3'},
+    'vehicle_status': {'array': 'vehicles', 'id_field': 'vehicle_id', 'version': '3.0'},
+}
+
+def gbfs_timestamp(epoch, version):
+    """``epoch`` as the given GBFS version encodes it: POSIX seconds before 3.0, RFC 3339 after."""
+    if version.startswith('2.'):
+        return epoch
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+
+class FeedDocument:
+    __slots__ = ('raw', 'gzipped', 'etag', 'last_updated', 'ttl', 'version', 'built_at')
+
+    def __init__(self, raw, last_updated, ttl, version):
+        self.raw = raw
+        self.gzipped = gzip.compress(raw, compresslevel=6)
+        self.etag = f"{zlib.crc32(raw):08x}"
+        self.last_updated = last_updated
+        self.ttl = ttl
+        self.version = version
+        self.built_at = time.monotonic()
+
+class GbfsSnapshot:
+    """Pre-serialized GBFS vehicle feeds for our own fleet.
+
+    Each published vehicle keeps a ready-made JSON fragment per feed, so a
+    change re-encodes one vehicle and a rebuild is a string join plus gzip.
+    Requests between changes are served the same bytes.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS):
+        self.ttl = ttl
+        self._states = {}  # (lat, lon, status) of every own-fleet vehicle with coordinates, published or not
+        self._fragments = {feed: {} for feed in FEEDS}
+        self._documents = {}
+        self._version = 0
+        self._last_updated = int(time.time())
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self.loaded = False
+        self.loaded_at = None
+
+    def __contains__(self, vehicle_id):
+        return vehicle_id in self._states
+
+    def status(self, vehicle_id):
+        state = self._states.get(vehicle_id)
+        return state[2] if state is not None else None
+
+    def _encode(self, vehicle_id, lat, lon, status, now):
+        """Feed to JSON fragment for one vehicle; empty if its status is not published."""
+        flags = PUBLISHED_STATUSES.get(status)
+        if flags is None:
+            return {}
+        fragments = {}
+        for feed, spec in FEEDS.items():
+            entry = {spec['id_field']: str(vehicle_id), 'lat': lat, 'lon': lon,
+                     'is_reserved': flags[0], 'is_disabled': flags[1]}
+            if feed == 'vehicle_status':
+                entry['last_reported'] = gbfs_timestamp(now, spec['version'])
+            fragments[feed] = json.dumps(entry, separators=(',', ':'))
+        return fragments
+
+    def upsert(self, vehicle_id, lat, lon, status):
+        if lat is None or lon is None:
+            self.remove(vehicle_id)
+            return
+        now = int(time.time())
+        encoded = self._encode(vehicle_id, lat, lon, status, now)
+        with self._lock:
+            self._states[vehicle_id] = (lat, lon, status)
+            changed = False
+            for feed in FEEDS:
+                fragments = self._fragments[feed]
+                if feed not in encoded:
+                    changed |= fragments.pop(vehicle_id, None) is not None
+                    continue
+                fragments[vehicle_id] = encoded[feed]
+                changed = True
+            if changed:
+                self._touch(now)
+
+    def replace(self, rows):
+        """Swap in the vehicles of ``(id, lat, lon, status)`` rows, re-encoding only those that changed."""
+        now = int(time.time())
+        old_states, old_fragments = self._states, self._fragments
+        states = {}
+        fragments = {feed: {} for feed in FEEDS}
+        for vehicle_id, lat, lon, status in rows:
+            state = (lat, lon, status)
+            states[vehicle_id] = state
+            if old_states.get(vehicle_id) == state:
+                # Unchanged: keep its fragments, and with them its last_reported.
+                encoded = {feed: old_fragments[feed].get(vehicle_id) for feed in FEEDS}
+            else:
+                encoded = self._encode(vehicle_id, lat, lon, status, now)
+            for feed, fragment in encoded.items():
+                if fragment is not None:
+                    fragments[feed][vehicle_id] = fragment
+        with self._lock:
+            changed = fragments != self._fragments
+            self._states, self._fragments = states, fragments
+            if changed:
+                self._touch(now)
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+
+    def remove(self, vehicle_id):
+        with self._lock:
+            self._states.pop(vehicle_id, None)
+            removed = [self._fragments[feed].pop(vehicle_id, None) for feed in FEEDS]
+            if any(f is not None for f in removed):
+                self._touch(int(time.time()))
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+            for fragments in self._fragments.values():
+                fragments.clear()
+            self._documents.clear()
+            self._touch(int(time.time()))
+            self.loaded = False
+            self.loaded_at = None
+
+    def _touch(self, now):
+        self._version += 1
+        self._last_updated = now
+
+    def document(self, feed):
+        """The current ``FeedDocument`` for ``feed``, rebuilt if stale."""
+        current = self._documents.get(feed)
+        if current is not None and (current.version == self._version or
+                                    time.monotonic() - current.built_at < MIN_REBUILD_INTERVAL):
+            return current
+        with self._build_lock:
+            current = self._documents.get(feed)
+            if current is not None and current.version == self._version:
+                return current
+            spec = FEEDS[feed]
+            with self._lock:
+                version = self._version
+                last_updated = self._last_updated
+                body = ','.join(self._fragments[feed].values())
+            stamp = json.dumps(gbfs_timestamp(last_updated, spec['version']))
+            raw = (f'{{"last_updated":{stamp},"ttl":{self.ttl},"version":"{spec["version"]}",'
+                   f'"data":{{"{spec["array"]}":[{body}]}}}}').encode()
+            document = FeedDocument(raw, last_updated, self.ttl, version)
+            self._documents[feed] = document
+            return document
+
+gbfs_snapshot = GbfsSnapshot()
+
+def publish_vehicle(vehicle):
+    if vehicle.source is None:
+        gbfs_snapshot.upsert(vehicle.id, vehicle.latitude, vehicle.longitude, vehicle.status)
+
+_reload_lock = threading.Lock()
+
+def ensure_gbfs_snapshot():
+    """``gbfs_snapshot``, loaded from the database on first use and reloaded once GBFS_SNAPSHOT_MAX_AGE_S old.
+
+    Writes publish only in the worker that made them, so the others catch
+    up on reload. A reload runs on the request that finds the snapshot
+    stale while other requests keep being served the current one.
+    """
+    config = current_app.config
+    max_age = config.get('GBFS_SNAPSHOT_MAX_AGE_S', DEFAULT_MAX_AGE_S)
+    loaded_at = gbfs_snapshot.loaded_at
+    if gbfs_snapshot.loaded and loaded_at is not None and time.monotonic() - loaded_at < max_age:
+        return gbfs_snapshot
+    if not _reload_lock.acquire(blocking=not gbfs_snapshot.loaded):
+        return gbfs_snapshot  # another request is already reloading
+    try:
+        loaded_at = gbfs_snapshot.loaded_at
+        if gbfs_snapshot.loaded and loaded_at is not None and time.monotonic() - loaded_at < max_age:
+            return gbfs_snapshot
+        gbfs_snapshot.ttl = config.get('GBFS_TTL', DEFAULT_TTL_SECONDS)
+        rows = (db.session.query(Vehicle.id, Vehicle.latitude, Vehicle.longitude, Vehicle.status)
+                .filter(Vehicle.source.is_(None), Vehicle.latitude.isnot(None), Vehicle.longitude.isnot(None))
+                .yield_per(10000))
+        gbfs_snapshot.replace(rows)
+    finally:
+        _reload_lock.release()
+    return gbfs_snapshot
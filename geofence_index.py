@@ -0,0 +1,261 @@
+import json
+import logging
+import math
+import threading
+import time
+
+from flask import current_app
+
+from extensions import db
+from models import Geofence
+
+logger = logging.getLogger(__name__)
+
+# Polygons whose bounding box spans more cells than this are checked on every
+# query instead of being copied into each cell.
+MAX_CELLS_PER_POLYGON = 4096
+# Upper bound on horizontal slabs per compiled polygon.
+MAX_SLABS = 64
+# Geofences changed through another worker are picked up within this many seconds.
+DEFAULT_MAX_AGE_S = 30
+
+class GeofenceError(ValueError):
+    pass
+
+def _point(value):
+    if isinstance(value, dict):
+        lat = value.get('lat', value.get('latitude'))
+        lon = value.get('lon', value.get('lng', value.get('longitude')))
+    elif isinstance(value, (list, tuple)) and len(value) >= 2:
+        # Bare pairs follow GeoJSON order: [longitude, latitude].
+        lon, lat = value[0], value[1]
+    else:
+        raise GeofenceError("Each vertex must be [lon, lat] or an object with lat and lon")
+    if isinstance(lat, bool) or isinstance(lon, bool) or not isinstance(lat, (int, float)) \
+            or not isinstance(lon, (int, float)):
+        raise GeofenceError("Vertex coordinates must be numbers")
+    return float(lon), float(lat)
+
+def _ring(vertices):
+    if not isinstance(vertices, list):
+        raise GeofenceError("A ring must be a list of vertices")
+    ring = [_point(v) for v in vertices]
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring.pop()
+    if len(ring) < 3:
+        raise GeofenceError("A polygon ring needs at least three distinct vertices")
+    return ring
+
+def _polygons(value):
+    """Normalise decoded coordinates to a list of polygons, each a list of rings."""
+    if isinstance(value, dict):
+        if value.get('type') == 'Feature':
+            return _polygons(value.get('geometry'))
+        if value.get('type') == 'Polygon':
+            return [[_ring(r) for r in value.get('coordinates') or []]]
+        if value.get('type') == 'MultiPolygon':
+            return [[_ring(r) for r in polygon] for polygon in value.get('coordinates') or []]
+        raise GeofenceError("Expected a Polygon, MultiPolygon or Feature")
+    if isinstance(value, list) and value:
+        first = value[0]
+        if isinstance(first, list) and first and isinstance(first[0], (list, dict)):
+            # A list of rings: outer boundary followed by holes.
+            return [[_ring(r) for r in value]]
+        return [[_ring(value)]]
+    raise GeofenceError("Coordinates must describe at least one polygon")
+
+class CompiledPolygon:
+    """A geofence flattened into per-slab edge tables for ray casting.
+
+    The bounding box is cut into horizontal slabs and each slab keeps only
+    the ``(y1, y2, x1, dx/dy)`` edges that cross it, so a containment test
+    walks a handful of edges instead of the whole outline. Holes and
+    multi-part geofences follow the even-odd rule per part.
+    """
+
+    __slots__ = ('id', 'name', 'bbox', '_parts', '_slab_scale')
+
+    def __init__(self, geofence_id, name, polygons):
+        self.id = geofence_id
+        self.name = name
+        rings = [ring for rings in polygons for ring in rings]
+        if not rings:
+            raise GeofenceError("Coordinates must describe at least one polygon")
+        xs = [x for ring in rings for x, _ in ring]
+        ys = [y for ring in rings for _, y in ring]
+        self.bbox = (min(xs), min(ys), max(xs), max(ys))
+        edge_count = sum(len(ring) for ring in rings)
+        slab_count = max(1, min(MAX_SLABS, edge_count // 2))
+        height = self.bbox[3] - self.bbox[1]
+        self._slab_scale = slab_count / height if height > 0 else 0.0
+        min_y, scale, last = self.bbox[1], self._slab_scale, slab_count - 1
+
+        def slab_of(y):
+            return min(int((y - min_y) * scale), last)
+
+        self._parts = []
+        for part in polygons:
+            if not part:
+                continue
+            slabs = [[] for _ in range(slab_count)]
+            for ring in part:
+                for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+                    if y1 == y2:
+                        continue
+                    edge = (y1, y2, x1, (x2 - x1) / (y2 - y1))
+                    for slab in range(slab_of(min(y1, y2)), slab_of(max(y1, y2)) + 1):
+                        slabs[slab].append(edge)
+            self._parts.append(tuple(tuple(edges) for edges in slabs))
+
+    def contains(self, lon, lat):
+        min_x, min_y, max_x, max_y = self.bbox
+        if lon < min_x or lon > max_x or lat < min_y or lat > max_y:
+            return False
+        slab = int((lat - min_y) * self._slab_scale)
+        for slabs in self._parts:
+            inside = False
+            for y1, y2, x1, slope in slabs[min(slab, len(slabs) - 1)]:
+                if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * slope:
+                    inside = not inside
+            if inside:
+                return True
+        return False
+
+def compile_geofence(geofence_id, name, coordinates):
+    """Compile a stored ``coordinates`` JSON string; raises ``GeofenceError``."""
+    try:
+        value = json.loads(coordinates) if isinstance(coordinates, str) else coordinates
+    except json.JSONDecodeError as e:
+        raise GeofenceError(f"Invalid JSON: {e.msg}")
+    return CompiledPolygon(geofence_id, name, _polygons(value))
+
+class GeofenceIndex:
+    """Compiled geofences bucketed by the grid cells their bounding boxes cover."""
+
+    def __init__(self, cell_size_deg=0.002):
+        self.cell_size = cell_size_deg
+        self._polygons = {}
+        self._cells = {}  # cell -> {id: (min_lon, min_lat, max_lon, max_lat, polygon)}
+        self._large = {}
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._polygons)
+
+    def _cell_range(self, bbox):
+        size = self.cell_size
+        return (math.floor(bbox[0] / size), math.floor(bbox[1] / size),
+                math.floor(bbox[2] / size), math.floor(bbox[3] / size))
+
+    def upsert(self, polygon):
+        with self._lock:
+            self._discard(polygon.id)
+            self._polygons[polygon.id] = polygon
+            col_min, row_min, col_max, row_max = self._cell_range(polygon.bbox)
+            if (col_max - col_min + 1) * (row_max - row_min + 1) > MAX_CELLS_PER_POLYGON:
+                self._large[polygon.id] = polygon
+                return
+            for col in range(col_min, col_max + 1):
+                for row in range(row_min, row_max + 1):
+                    self._cells.setdefault((col, row), {})[polygon.id] = polygon.bbox + (polygon,)
+
+    def remove(self, geofence_id):
+        with self._lock:
+            self._discard(geofence_id)
+
+    def clear(self):
+        with self._lock:
+            self._polygons.clear()
+            self._cells.clear()
+            self._large.clear()
+            self.loaded = False
+            self.loaded_at = None
+
+    def replace(self, polygons):
+        """Swap in ``polygons``, indexed without holding the lock."""
+        fresh = GeofenceIndex(self.cell_size)
+        for polygon in polygons:
+            fresh.upsert(polygon)
+        with self._lock:
+            self._polygons, self._cells, self._large = fresh._polygons, fresh._cells, fresh._large
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+
+    def _discard(self, geofence_id):
+        polygon = self._polygons.pop(geofence_id, None)
+        if polygon is None:
+            return
+        if self._large.pop(geofence_id, None) is not None:
+            return
+        col_min, row_min, col_max, row_max = self._cell_range(polygon.bbox)
+        for col in range(col_min, col_max + 1):
+            for row in range(row_min, row_max + 1):
+                members = self._cells.get((col, row))
+                if members is not None:
+                    members.pop(geofence_id, None)
+                    if not members:
+                        del self._cells[(col, row)]
+
+    def containing(self, lat, lon):
+        """Compiled polygons containing (lat, lon), ordered by id."""
+        return self.containing_many([(lat, lon)])[0]
+
+    def containing_many(self, points):
+        """Containing polygons for each ``(lat, lon)`` in ``points``, in order."""
+        size = self.cell_size
+        floor = math.floor
+        results = []
+        with self._lock:
+            cells = self._cells
+            large = list(self._large.values())
+            for lat, lon in points:
+                members = cells.get((floor(lon / size), floor(lat / size)))
+                # Most candidates are rejected by the inline bounding-box test.
+                hits = [p for x0, y0, x1, y1, p in members.values()
+                        if x0 <= lon <= x1 and y0 <= lat <= y1 and p.contains(lon, lat)] if members else []
+                if large:
+                    hits.extend(p for p in large if p.contains(lon, lat))
+                    hits.sort(key=lambda p: p.id)
+                elif len(hits) > 1:
+                    hits.sort(key=lambda p: p.id)
+                results.append(hits)
+        return results
+
+geofence_index = GeofenceIndex()
+
+def index_geofence(geofence):
+    """Compile ``geofence`` into the index; raises ``GeofenceError`` if it is not a polygon."""
+    geofence_index.upsert(compile_geofence(geofence.id, geofence.name, geofence.coordinates))
+
+def _compile_all():
+    for geofence_id, name, coordinates in db.session.query(Geofence.id, Geofence.name, Geofence.coordinates):
+        try:
+            yield compile_geofence(geofence_id, name, coordinates)
+        except GeofenceError as e:
+            logger.warning(f"Skipping geofence {geofence_id}: {str(e)}")
+
+_reload_lock = threading.Lock()
+
+def ensure_geofence_index():
+    """``geofence_index``, compiled on first use and recompiled once GEOFENCE_INDEX_MAX_AGE_S old.
+
+    Writes update the index only in the worker that made them, so the
+    others catch up on reload. A reload runs on the request that finds the
+    index stale while other requests keep reading the current one.
+    """
+    max_age = current_app.config.get('GEOFENCE_INDEX_MAX_AGE_S', DEFAULT_MAX_AGE_S)
+    loaded_at = geofence_index.loaded_at
+    if geofence_index.loaded and loaded_at is not None and time.monotonic() - loaded_at < max_age:
+        return geofence_index
+    if not _reload_lock.acquire(blocking=not geofence_index.loaded):
+        return geofence_index  # another request is already reloading
+    try:
+        loaded_at = geofence_index.loaded_at
+        if geofence_index.loaded and loaded_at is not None and time.monotonic() - loaded_at < max_age:
+            return geofence_index
+        geofence_index.replace(_compile_all())
+    finally:
+        _reload_lock.release()
+    return geofence_index
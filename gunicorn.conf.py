@@ -0,0 +1,32 @@
+# Pre-fork serving for wsgi:app. Every setting can be overridden from the
+# environment; db_pool reads WEB_CONCURRENCY and GUNICORN_THREADS too, so
+# each worker's connection pool is sized for the process layout set here.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# Recycle workers now and then so slow leaks cannot build up.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+# Off by default so the app, and its engine, is built in each worker after
+# fork. With it on, db_pool still replaces inherited pools in the child.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+def on_starting(server):
+    # Workers size their pools from these, so they must match the server's.
+    # With preload_app the app is built before this runs; set them in the
+    # environment instead.
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
+    os.environ['GUNICORN_THREADS'] = str(server.cfg.threads)
+    # Each worker starts its own password hashing pool; share the cores out
+    # rather than giving every worker one process per core.
+    os.environ.setdefault('PASSWORD_HASH_WORKERS',
+                          str(max(multiprocessing.cpu_count() // server.cfg.workers, 1)))
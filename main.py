@@ -1,11 +1,17 @@
-from flask import Flask, render_template, jsonify, request
+import click
+from flask import Flask, Response, render_template, jsonify, request
 from flask_migrate import Migrate
 from flask_cors import CORS
 from extensions import db
+from auth_tokens import secret_key_configured
 import os
 import logging
+import secrets
 from dotenv import load_dotenv
 from data_store import data_store
+from blueprints import register_blueprints
+from db_pool import engine_options, in_memory_database, pool_metrics, track_engines
+from request_metrics import CONTENT_TYPE, request_metrics
 
 load_dotenv()
 
@@ -16,15 +22,46 @@ def create_app():
     # Configure logging
     logging.basicConfig(filename='app.log', level=logging.DEBUG)
     logger = logging.getLogger(__name__)
+    debug_mode = os.environ.get('FLASK_ENV') == 'development' or os.environ.get('FLASK_DEBUG') in ('1', 'true')
+
+    # Threads and processes each server worker starts; gunicorn.conf.py divides them among workers.
+    for key in ('PAYMENT_WORKERS', 'PASSWORD_HASH_WORKERS'):
+        if os.environ.get(key):
+            app.config[key] = int(os.environ[key])
 
     # Database configuration
     app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    
+    # Pool sizing per server worker; see db_pool.engine_options.
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+
     db.init_app(app)
+    with app.app_context():
+        track_engines(db.engines.values())
+    # Per-endpoint latency, SQL statements and DB time, served at /metrics.
+    request_metrics.init_app(app)
     migrate = Migrate(app, db)
 
-    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key')  # Provide a default secret key
+    # SECRET_KEY signs access tokens, so it must be private. Development falls
+    # back to a random key per process; anything else refuses to start.
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    if not secret_key_configured(app.config):
+        if not debug_mode:
+            raise RuntimeError("Set SECRET_KEY to a private value, or FLASK_ENV=development for a throwaway key")
+        logger.warning("SECRET_KEY is not set; using a random key, so tokens last only for this process")
+        app.config['SECRET_KEY'] = secrets.token_hex(32)
+
+    # Every api.* blueprint; with LAZY_BLUEPRINTS a module is imported on its first request.
+    app.config['LAZY_BLUEPRINTS'] = os.environ.get('LAZY_BLUEPRINTS', '1') != '0'
+    register_blueprints(app, lazy=app.config['LAZY_BLUEPRINTS'])
+
+    # Quotes for rules with a min_demand condition need the demand forecasts,
+    # which take seconds to build; start building them now, in the background.
+    # An in-memory database has one connection, which the thread cannot share.
+    database_uri = app.config['SQLALCHEMY_DATABASE_URI']
+    if os.environ.get('DEMAND_WARM_START', '1') != '0' and database_uri and not in_memory_database(database_uri):
+        from demand_model import demand_model
+        demand_model.start(app, warm=True)
 
     @app.route('/')
     def index():
@@ -76,6 +113,16 @@ def create_app():
         }
         return jsonify(api_config)
 
+    @app.route('/api/db/pool')
+    def get_db_pool_metrics():
+        """Checkout waits and saturation of this worker process's database pool."""
+        return jsonify(pool_metrics.metrics())
+
+    @app.route('/metrics')
+    def get_metrics():
+        """Request and database pool metrics of this worker process, in Prometheus text format."""
+        return Response(request_metrics.render(), content_type=CONTENT_TYPE)
+
     @app.errorhandler(404)
     def not_found(error):
         logger.error(f"404 error: {error}")
@@ -91,6 +138,21 @@ def create_app():
         logger.error(f"Unhandled exception: {str(e)}")
         return jsonify({"error": "An unexpected error occurred", "message": str(e)}), 500
 
+    @app.cli.command('grant-superuser')
+    @click.argument('username')
+    def grant_superuser_command(username):
+        """Give USERNAME the superuser role, which holds every permission."""
+        from permissions import grant_superuser  # Imported here so models load with the first blueprint, not at startup
+        if grant_superuser(username, app.config) is None:
+            raise click.ClickException(f"No user named {username!r}")
+        click.echo(f"{username} now has the {app.config.get('RBAC_SUPERUSER_ROLE', 'admin')} role")
+
+    @app.cli.command('convert-reports')
+    def convert_reports_command():
+        """Rewrite report results stored before the JSON format as JSON."""
+        from report_jobs import convert_legacy_reports
+        click.echo(f"Converted {convert_legacy_reports()} reports")
+
     # ... rest of your routes ...
 
     return app
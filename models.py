@@ -1,18 +1,26 @@
 from extensions import db
 from datetime import datetime
+from sqlalchemy import literal_column
 from werkzeug.security import generate_password_hash, check_password_hash
+from password_hasher import DEFAULT_METHOD
+
+def version_column():
+    # Bumped by every UPDATE, ORM or Core, so cached reads can key their ETag on it.
+    return db.Column(db.Integer, nullable=False, default=1, server_default='1',
+                     onupdate=literal_column('version + 1'))
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(255))  # werkzeug's scrypt strings run past 128
     role_id = db.Column(db.Integer, db.ForeignKey('role.id'))
     role = db.relationship('Role', back_populates='users')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # Inline; the auth endpoints hash on password_hasher's process pool instead.
+        self.password_hash = generate_password_hash(password, method=DEFAULT_METHOD)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -22,18 +30,50 @@ class Role(db.Model):
     name = db.Column(db.String(80), unique=True, nullable=False)
     description = db.Column(db.String(255))
     users = db.relationship('User', back_populates='role')
+    permissions = db.relationship('RolePermission', cascade='all, delete-orphan')
+
+# A permission granted to a role; names come from permissions.PERMISSIONS.
+class RolePermission(db.Model):
+    role_id = db.Column(db.Integer, db.ForeignKey('role.id'), primary_key=True)
+    permission = db.Column(db.String(50), primary_key=True)
 
 class Vehicle(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    serial_number = db.Column(db.String(64), unique=True)  # External/manufacturer ID
+    source = db.Column(db.String(64), index=True)  # Partner system for GBFS-ingested vehicles
     name = db.Column(db.String(80), nullable=False)
     status = db.Column(db.String(20), nullable=False)
     location = db.Column(db.String(120))
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    last_ping_ts = db.Column(db.Float)  # Device epoch seconds of the position above, when it came from telemetry
+    fleet_id = db.Column(db.Integer, db.ForeignKey('fleet.id', ondelete='SET NULL'), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = version_column()
+
+    __table_args__ = (
+        db.Index('ix_vehicle_created_at_id', 'created_at', 'id'),
+        db.Index('ix_vehicle_lat_lon', 'latitude', 'longitude'),
+    )
+
+class Station(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(64), nullable=False)
+    station_id = db.Column(db.String(64), nullable=False)  # ID in the partner's GBFS feed
+    num_bikes_available = db.Column(db.Integer)
+    num_docks_available = db.Column(db.Integer)
+    is_installed = db.Column(db.Boolean)
+    is_renting = db.Column(db.Boolean)
+    is_returning = db.Column(db.Boolean)
+    last_reported = db.Column(db.Integer)  # POSIX timestamp from the feed
+
+    __table_args__ = (db.UniqueConstraint('source', 'station_id', name='uq_station_source_station_id'),)
 
 class Fleet(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = version_column()
 
 class Trip(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -42,6 +82,48 @@ class Trip(db.Model):
     end_time = db.Column(db.DateTime)
     start_location = db.Column(db.String(120))
     end_location = db.Column(db.String(120))
+    start_latitude = db.Column(db.Float)  # Vehicle position when the trip started
+    start_longitude = db.Column(db.Float)
+    fare = db.Column(db.Float)  # Amount charged once the trip is priced
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # Rider, billed for the fare
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'))  # Set once the fare is on an invoice
+    version = version_column()
+
+    __table_args__ = (
+        db.Index('ix_trip_start_time_id', 'start_time', 'id'),
+        # Covers the usage aggregate: window range on start_time, grouped by vehicle.
+        db.Index('ix_trip_start_time_vehicle_end', 'start_time', 'vehicle_id', 'end_time'),
+        # Covers the period close: trips ended in the period, grouped by rider.
+        db.Index('ix_trip_end_time_user', 'end_time', 'user_id', 'invoice_id', 'fare'),
+    )
+
+# Trips started per vehicle per hour, day and month, maintained by the trip endpoints.
+class VehicleTripRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    grain = db.Column(db.String(5), nullable=False)  # 'hour', 'day' or 'month'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    vehicle_id = db.Column(db.Integer, nullable=False)
+    trips = db.Column(db.Integer, nullable=False, default=0)
+    ride_seconds = db.Column(db.Float, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('grain', 'bucket_start', 'vehicle_id', name='uq_vehicle_trip_rollup_bucket'),
+    )
+
+# Trips started per fleet per hour, day and month, maintained by the trip endpoints.
+class FleetTripRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    grain = db.Column(db.String(5), nullable=False)  # 'hour', 'day' or 'month'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    fleet_id = db.Column(db.Integer, nullable=False)
+    trips = db.Column(db.Integer, nullable=False, default=0)
+    ride_seconds = db.Column(db.Float, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('grain', 'bucket_start', 'fleet_id', name='uq_fleet_trip_rollup_bucket'),
+    )
 
 class Maintenance(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -51,6 +133,8 @@ class Maintenance(db.Model):
     status = db.Column(db.String(20))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_maintenance_created_at_id', 'created_at', 'id'),)
+
 class Alert(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicle.id'), nullable=False)
@@ -61,21 +145,86 @@ class Alert(db.Model):
 class Report(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100))
-    content = db.Column(db.Text)
+    content = db.Column(db.Text)  # Compact JSON; NULL while pending or when stored compressed
+    content_gzip = db.Column(db.LargeBinary)  # Gzipped JSON for large results
+    content_format = db.Column(db.String(10), default='json')  # NULL: written before results were JSON
+    report_type = db.Column(db.String(40))  # NULL for reports posted with their content
+    params = db.Column(db.Text)  # Canonical JSON of the generation parameters
+    params_hash = db.Column(db.String(64), index=True)
+    status = db.Column(db.String(20), nullable=False, default='completed', server_default='completed')
+    progress = db.Column(db.Integer, nullable=False, default=100, server_default='100')
+    error = db.Column(db.String(500))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
 
 class Invoice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
+    description = db.Column(db.String(200))
     status = db.Column(db.String(20))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    billing_run_id = db.Column(db.Integer, db.ForeignKey('billing_run.id'))  # Set on period-close invoices
+    version = version_column()
+
+    __table_args__ = (
+        db.Index('ix_invoice_created_at_id', 'created_at', 'id'),
+        db.Index('ix_invoice_billing_run_user', 'billing_run_id', 'user_id'),
+        # Billing history: one rider's invoices newest first. Postgres answers
+        # the page from the index alone; SQLite reads one row per result.
+        db.Index('ix_invoice_user_created_id', 'user_id', 'created_at', 'id',
+                 postgresql_include=['amount', 'status', 'description']),
+    )
+
+# Running invoice totals per rider, maintained by billing as invoices are written and paid.
+class UserBillingSummary(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    invoices = db.Column(db.Integer, nullable=False, default=0)
+    billed = db.Column(db.Float, nullable=False, default=0)
+    paid = db.Column(db.Float, nullable=False, default=0)
+
+# A request to pay an invoice and its progress through the payment gateway:
+# pending -> processing -> succeeded | failed, back to pending between retries.
+class PaymentIntent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False, index=True)
+    amount = db.Column(db.Float, nullable=False)
+    payment_method = db.Column(db.String(50), nullable=False)
+    idempotency_key = db.Column(db.String(255), unique=True, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending', server_default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_attempt_at = db.Column(db.DateTime)  # Earliest retry; NULL means now
+    claimed_at = db.Column(db.DateTime)  # When a worker took it to the gateway
+    gateway_reference = db.Column(db.String(100))
+    last_error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    version = version_column()
+
+    __table_args__ = (
+        db.Index('ix_payment_intent_status_next_attempt', 'status', 'next_attempt_at'),
+        # At most one pending or processing intent per invoice, whichever request inserts first.
+        db.Index('uq_payment_intent_in_flight', 'invoice_id', unique=True,
+                 sqlite_where=db.text("status IN ('pending', 'processing')"),
+                 postgresql_where=db.text("status IN ('pending', 'processing')")),
+    )
+
+# One period close: every priced trip that ended in the period, invoiced per rider.
+class BillingRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    period_start = db.Column(db.DateTime, nullable=False)
+    period_end = db.Column(db.DateTime, nullable=False)
+    invoices = db.Column(db.Integer, nullable=False, default=0)
+    trips = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
 
 class Geofence(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), nullable=False)
     coordinates = db.Column(db.Text)  # Store as JSON string
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = version_column()
 
 class PricingRule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
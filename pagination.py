@@ -0,0 +1,107 @@
+import base64
+import json
+from datetime import datetime
+
+from flask import Response, jsonify, request, stream_with_context
+from sqlalchemy import DateTime, and_, or_
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 1000
+
+class CursorError(ValueError):
+    pass
+
+def encode_cursor(values):
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, columns):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise CursorError("Malformed cursor")
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise CursorError("Malformed cursor")
+    try:
+        return [_cursor_value(col, v) for col, v in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise CursorError("Malformed cursor")
+
+def _cursor_value(column, value):
+    # A cursor comes back from the client, so each value must have its column's type.
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    expected = column.type.python_type
+    if isinstance(value, bool) or not isinstance(value, expected):
+        raise TypeError(f"{column.key} must be {expected.__name__}")
+    return value
+
+def parse_page_args():
+    """Read ``limit`` and ``after`` from the query string."""
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        raise CursorError("limit must be a positive integer")
+    return min(limit, MAX_PAGE_SIZE), request.args.get('after')
+
+def wants_stream():
+    return request.args.get('format') == 'ndjson'
+
+def _after_clause(columns, values, descending=False):
+    # Expands (a, b) > (x, y) into a OR-chain so it works on every backend.
+    clauses = []
+    for i, col in enumerate(columns):
+        equal_prefix = [columns[j] == values[j] for j in range(i)]
+        clauses.append(and_(*equal_prefix, col < values[i] if descending else col > values[i]))
+    return or_(*clauses)
+
+def keyset_query(query, columns, after=None, descending=False):
+    if after:
+        query = query.filter(_after_clause(columns, decode_cursor(after, columns), descending))
+    return query.order_by(*(col.desc() for col in columns) if descending else columns)
+
+def keyset_page(query, columns, limit, after=None, descending=False):
+    """Return ``(rows, next_cursor)`` for the page following ``after``.
+
+    ``columns`` must end with a unique column (normally the primary key) so
+    that the ordering is total and no row is skipped or repeated. Rows may
+    be ORM objects or column tuples that include every ordering column.
+    """
+    rows = keyset_query(query, columns, after, descending).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, col.key) for col in columns])
+    return rows, next_cursor
+
+def ndjson_response(query, columns, serialize, after=None, descending=False):
+    """Stream every row after ``after`` as newline-delimited JSON."""
+    query = keyset_query(query, columns, after, descending).yield_per(STREAM_BATCH_SIZE)
+
+    def generate():
+        batch = []
+        for row in query:
+            batch.append(json.dumps(serialize(row)))
+            if len(batch) >= STREAM_BATCH_SIZE:
+                yield '\n'.join(batch) + '\n'
+                batch = []
+        if batch:
+            yield '\n'.join(batch) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def paginated_response(query, columns, serialize):
+    """Shared body of the list endpoints: keyset page or NDJSON stream."""
+    limit, after = parse_page_args()
+    if wants_stream():
+        return ndjson_response(query, columns, serialize, after)
+    rows, next_cursor = keyset_page(query, columns, limit, after)
+    return jsonify({"data": [serialize(row) for row in rows], "next_cursor": next_cursor}), 200
@@ -0,0 +1,150 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+# PBKDF2 keeps hashes within User.password_hash and is what werkzeug <3 wrote.
+# Lower it for development and tests, raise it as hardware gets faster.
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_PENDING_PER_WORKER = 4
+DEFAULT_TIMEOUT_S = 10
+
+class HasherBusy(RuntimeError):
+    """Too many hashes queued already; the caller should answer 503."""
+
+def needs_rehash(password_hash, method):
+    """True if ``password_hash`` was not made with ``method`` and should be upgraded."""
+    return password_hash.split('$', 1)[0] != method
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+def _verify(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+class PasswordHasher:
+    """Runs password hashing and verification on a bounded process pool.
+
+    Key stretching is deliberately CPU-bound, so on request threads a burst
+    of logins takes every core the server has, for as long as it lasts. The
+    pool caps hashing at PASSWORD_HASH_WORKERS cores. At most
+    PASSWORD_HASH_MAX_PENDING hashes may be queued or running, counting
+    those whose caller timed out; beyond that ``HasherBusy`` is raised so
+    the endpoint can shed load instead of queueing it.
+    ``PASSWORD_HASH_WORKERS = 0`` hashes inline.
+
+    Workers are spawned rather than forked: the server process runs
+    payment, telemetry and demand threads, and a lock one of them held at
+    fork time would stay locked in the child.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.workers = DEFAULT_WORKERS
+        self.max_pending = DEFAULT_WORKERS * DEFAULT_PENDING_PER_WORKER
+        self.stats = {'hashed': 0, 'verified': 0, 'rehashed': 0, 'shed': 0}
+
+    def _pool(self, config):
+        # A forked server worker must not reuse its parent's pool.
+        if self._executor is not None and self._pid == os.getpid():
+            return self._executor
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self.workers = config.get('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS)
+                self.max_pending = config.get('PASSWORD_HASH_MAX_PENDING',
+                                              max(self.workers, 1) * DEFAULT_PENDING_PER_WORKER)
+                if self._pid != os.getpid():
+                    self._pending = 0
+                self._executor = (ProcessPoolExecutor(self.workers,
+                                                      mp_context=multiprocessing.get_context('spawn'))
+                                  if self.workers > 0 else None)
+                self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, config, fn, *args):
+        executor = self._pool(config)
+        if executor is None:
+            return fn(*args)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.stats['shed'] += 1
+                raise HasherBusy("Password hashing is at capacity")
+            self._pending += 1
+        try:
+            try:
+                future = executor.submit(fn, *args)
+            except BaseException:
+                self._release()
+                raise
+            # The slot is held until the job is done, not just until this caller stops waiting.
+            future.add_done_callback(self._release)
+            try:
+                return future.result(timeout=config.get('PASSWORD_HASH_TIMEOUT_S', DEFAULT_TIMEOUT_S))
+            except FutureTimeout:
+                # A job still queued is dropped; one already running keeps its slot until it ends.
+                future.cancel()
+                self.stats['shed'] += 1
+                raise HasherBusy("Password hashing timed out")
+        except BrokenProcessPool:
+            # A worker died (OOM killer, signal); start a fresh pool on the next call.
+            logger.error("Password hashing pool broke; restarting it")
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise HasherBusy("Password hashing pool restarted")
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def hash(self, password, config):
+        """Hash ``password`` with PASSWORD_HASH_METHOD."""
+        self.stats['hashed'] += 1
+        return self._run(config, _hash, password, config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD))
+
+    def verify(self, password_hash, password, config):
+        """Check ``password`` against a stored hash; a missing hash never matches."""
+        if not password_hash:
+            return False
+        self.stats['verified'] += 1
+        return self._run(config, _verify, password_hash, password)
+
+    def upgrade(self, user, password, config):
+        """Rehash a just-verified password if PASSWORD_HASH_METHOD changed; True if ``user`` was updated.
+
+        Best effort: if the pool is busy the old hash stays until the next login.
+        """
+        if not needs_rehash(user.password_hash, config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD)):
+            return False
+        try:
+            user.password_hash = self.hash(password, config)
+        except HasherBusy:
+            return False
+        self.stats['rehashed'] += 1
+        return True
+
+    def metrics(self):
+        snapshot = dict(self.stats)
+        snapshot.update(workers=self.workers, pending=self._pending, max_pending=self.max_pending)
+        return snapshot
+
+    def shutdown(self):
+        """Stop this process's pool; the next hash starts a fresh one with the then-current config."""
+        with self._lock:
+            executor, pid = self._executor, self._pid
+            self._executor, self._pid = None, None
+        if executor is not None and pid == os.getpid():
+            executor.shutdown(wait=True, cancel_futures=True)
+
+password_hasher = PasswordHasher()
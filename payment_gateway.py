@@ -0,0 +1,192 @@
+import argparse
+import http.client
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT_S = 10
+DEFAULT_POOL_SIZE = 8
+
+class GatewayError(Exception):
+    """The charge may not have happened; safe to retry with the same idempotency key."""
+
+class GatewayDeclined(Exception):
+    """The gateway refused the charge; retrying will not help."""
+
+class GatewayClient:
+    """Charges through an HTTP payment gateway over a pool of keep-alive connections.
+
+    At most ``pool_size`` requests are in flight; idle connections are
+    reused newest first so the pool shrinks back when traffic drops.
+    """
+
+    def __init__(self, base_url, timeout=DEFAULT_TIMEOUT_S, pool_size=DEFAULT_POOL_SIZE, api_key=None):
+        parts = urlsplit(base_url)
+        self._connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                  else http.client.HTTPConnection)
+        self._host, self._port = parts.hostname, parts.port
+        self._path = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._api_key = api_key
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self.stats = {'requests': 0, 'connections_opened': 0}
+
+    def _connection(self):
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            self.stats['connections_opened'] += 1
+            return self._connection_class(self._host, self._port, timeout=self.timeout), False
+
+    def _release(self, connection, response):
+        if response.will_close:
+            connection.close()
+            return
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def _post(self, path, payload, headers):
+        body = json.dumps(payload).encode()
+        headers = dict(headers, **{'Content-Type': 'application/json'})
+        if self._api_key:
+            headers['Authorization'] = f"Bearer {self._api_key}"
+        with self._slots:
+            while True:
+                connection, reused = self._connection()
+                try:
+                    connection.request('POST', self._path + path, body=body, headers=headers)
+                    response = connection.getresponse()
+                    data = response.read()
+                except (OSError, http.client.HTTPException) as e:
+                    connection.close()
+                    if reused:
+                        # The gateway closed an idle keep-alive connection; try a fresh one.
+                        continue
+                    raise GatewayError(f"Gateway request failed: {str(e)}")
+                self.stats['requests'] += 1
+                self._release(connection, response)
+                return response.status, data
+
+    def charge(self, amount, payment_method, idempotency_key, reference):
+        """Charge ``amount``; returns the gateway's charge id."""
+        status, data = self._post('/charges', {'amount': amount, 'payment_method': payment_method,
+                                               'reference': reference},
+                                  {'Idempotency-Key': idempotency_key})
+        try:
+            body = json.loads(data) if data else {}
+        except ValueError:
+            body = {}
+        if 200 <= status < 300:
+            return str(body.get('id'))
+        message = body.get('error') or f"HTTP {status}"
+        if status == 429 or status >= 500:
+            raise GatewayError(f"Gateway unavailable: {message}")
+        raise GatewayDeclined(message)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+class LocalGateway:
+    """Approves every charge without a network call; used when no gateway URL is configured."""
+
+    def charge(self, amount, payment_method, idempotency_key, reference):
+        return f"local-{reference}"
+
+    def close(self):
+        pass
+
+def gateway_from_config(config):
+    url = config.get('PAYMENT_GATEWAY_URL')
+    if not url:
+        return LocalGateway()
+    return GatewayClient(url, timeout=config.get('PAYMENT_GATEWAY_TIMEOUT_S', DEFAULT_TIMEOUT_S),
+                         pool_size=config.get('PAYMENT_GATEWAY_POOL_SIZE', DEFAULT_POOL_SIZE),
+                         api_key=config.get('PAYMENT_GATEWAY_API_KEY'))
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so client pooling is exercised
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(server.latency)
+        key = self.headers.get('Idempotency-Key')
+        with server.lock:
+            server.requests += 1
+            replay = server.charges.get(key) if key else None
+        if replay is not None:
+            self._send(200, replay)
+            return
+        if server.failure_rate and random.random() < server.failure_rate:
+            self._send(503, {'error': 'temporarily unavailable'})
+            return
+        payload = json.loads(body or b'{}')
+        if payload.get('payment_method') == 'declined':
+            self._send(402, {'error': 'card declined'})
+            return
+        with server.lock:
+            charge = server.charges.setdefault(key, {'id': f"ch_{len(server.charges) + 1}", 'status': 'succeeded',
+                                                     'amount': payload.get('amount')})
+        self._send(200, charge)
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class StubGatewayServer(ThreadingHTTPServer):
+    """Local stand-in for a payment gateway with configurable latency.
+
+    POST /charges succeeds after ``latency_s`` unless the payment method is
+    ``declined`` (402) or a ``failure_rate`` fraction of requests gets a 503.
+    Charges are remembered by Idempotency-Key and replayed, as real
+    gateways do, so ``charges`` counts money actually taken.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, latency_s=0.0, failure_rate=0.0):
+        super().__init__(('127.0.0.1', port), _StubHandler)
+        self.latency = latency_s
+        self.failure_rate = failure_rate
+        self.charges = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='stub-gateway', daemon=True).start()
+        return self
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the stub payment gateway")
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=300)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    stub = StubGatewayServer(args.port, args.latency_ms / 1000, args.failure_rate)
+    print(f"stub gateway on {stub.url}")
+    stub.serve_forever()
@@ -0,0 +1,237 @@
+import atexit
+import logging
+import queue
+import random
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+from sqlalchemy.exc import SQLAlchemyError
+
+from billing import mark_invoice_paid
+from entity_cache import entity_cache
+from extensions import db
+from models import PaymentIntent
+from payment_gateway import GatewayDeclined, GatewayError, gateway_from_config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_BASE_S = 1.0
+DEFAULT_POLL_INTERVAL_S = 1.0
+# A worker that holds an intent longer than this is presumed dead and the
+# intent goes back to pending; the gateway dedupes the repeat by idempotency key.
+DEFAULT_LEASE_S = 120
+ACTIVE_STATUSES = ('pending', 'processing')
+TERMINAL_STATUSES = ('succeeded', 'failed')
+
+_intents = PaymentIntent.__table__
+
+def retry_delay(attempts, base):
+    """Exponential backoff with full jitter after ``attempts`` failed tries."""
+    return random.uniform(0, base * 2 ** (attempts - 1))
+
+def _finish(intent_id, **values):
+    return db.session.execute(
+        update(_intents).where(_intents.c.id == intent_id, _intents.c.status == 'processing').values(**values)
+    ).rowcount
+
+def process_intent(intent_id, gateway, config):
+    """Take one due intent through a gateway attempt; needs an application context.
+
+    Claiming is a conditional UPDATE, so an intent is charged by one worker
+    at a time across every process. No transaction is open while the
+    gateway call is in flight.
+    """
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(_intents)
+        .where(_intents.c.id == intent_id, _intents.c.status == 'pending',
+               (_intents.c.next_attempt_at.is_(None)) | (_intents.c.next_attempt_at <= now))
+        .values(status='processing', attempts=_intents.c.attempts + 1, claimed_at=now)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return None
+    intent = db.session.get(PaymentIntent, intent_id)
+    amount, payment_method, key, attempts = intent.amount, intent.payment_method, intent.idempotency_key, \
+        intent.attempts
+    invoice_id = intent.invoice_id
+    db.session.commit()  # Hand the connection back for the gateway round trip
+
+    try:
+        reference = gateway.charge(amount, payment_method, key, intent_id)
+    except GatewayDeclined as e:
+        _finish(intent_id, status='failed', last_error=str(e)[:500], completed_at=datetime.utcnow())
+        db.session.commit()
+        return 'failed'
+    except GatewayError as e:
+        max_attempts = config.get('PAYMENT_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+        if attempts >= max_attempts:
+            _finish(intent_id, status='failed', last_error=f"Gave up after {attempts} attempts: {str(e)}"[:500],
+                    completed_at=datetime.utcnow())
+            db.session.commit()
+            return 'failed'
+        delay = retry_delay(attempts, config.get('PAYMENT_RETRY_BASE_S', DEFAULT_RETRY_BASE_S))
+        _finish(intent_id, status='pending', last_error=str(e)[:500],
+                next_attempt_at=datetime.utcnow() + timedelta(seconds=delay))
+        db.session.commit()
+        return 'pending'
+
+    if _finish(intent_id, status='succeeded', gateway_reference=reference, last_error=None,
+               completed_at=datetime.utcnow()):
+        mark_invoice_paid(invoice_id)
+    db.session.commit()
+    entity_cache.invalidate('invoice', invoice_id)
+    return 'succeeded'
+
+class PaymentWorkerPool:
+    """Bounded pool of threads that take payment intents to the gateway.
+
+    Requests only record an intent and hand its id over, so their latency
+    does not depend on the gateway's. A dispatcher thread polls for intents
+    that are due (retries, overflow from a full queue, work left by a
+    crashed process) and reclaims ones whose worker lease expired. With
+    ``PAYMENT_WORKERS = 0`` intents are processed inline, which an
+    in-memory SQLite database requires.
+    """
+
+    def __init__(self):
+        self._app = None
+        self._queue = None
+        self._queued = set()
+        self._gateway = None
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.workers = DEFAULT_WORKERS
+        self.stats = {'submitted': 0, 'overflow': 0, 'succeeded': 0, 'failed': 0, 'retried': 0, 'reclaimed': 0,
+                      'errors': 0}
+
+    def start(self, app):
+        """Start the workers and dispatcher for ``app`` once per process."""
+        if self._app is not None:
+            return
+        with self._lock:
+            if self._app is not None:
+                return
+            self.workers = app.config.get('PAYMENT_WORKERS', DEFAULT_WORKERS)
+            self._gateway = gateway_from_config(app.config)
+            self._queue = queue.Queue(maxsize=app.config.get('PAYMENT_QUEUE_SIZE', DEFAULT_QUEUE_SIZE))
+            self._app = app
+            if self.workers > 0:
+                self._stop.clear()
+                for n in range(self.workers):
+                    thread = threading.Thread(target=self._work, args=(app,), name=f'payment-worker-{n}',
+                                              daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+                thread = threading.Thread(target=self._dispatch, args=(app,), name='payment-dispatcher', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, intent_id):
+        """Queue ``intent_id`` for a worker; if the queue is full the dispatcher picks it up later."""
+        self.stats['submitted'] += 1
+        if self.workers <= 0:
+            self._run(intent_id)
+            return
+        self._enqueue(intent_id)
+
+    def _enqueue(self, intent_id):
+        with self._lock:
+            if intent_id in self._queued:
+                return True
+            try:
+                self._queue.put_nowait(intent_id)
+            except queue.Full:
+                self.stats['overflow'] += 1
+                return False
+            self._queued.add(intent_id)
+            return True
+
+    def _run(self, intent_id, app=None):
+        try:
+            outcome = process_intent(intent_id, self._gateway, (app or self._app).config)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            self.stats['errors'] += 1
+            logger.error(f"Database error processing payment intent {intent_id}: {str(e)}")
+            return
+        if outcome == 'pending':
+            self.stats['retried'] += 1
+        elif outcome is not None:
+            self.stats[outcome] += 1
+
+    def _work(self, app):
+        while True:
+            intent_id = self._queue.get()
+            if intent_id is None:
+                return
+            with self._lock:
+                self._queued.discard(intent_id)
+            try:
+                with app.app_context():
+                    self._run(intent_id, app)
+            except Exception as e:
+                # Keep the worker alive; the intent is retried once its lease expires.
+                self.stats['errors'] += 1
+                logger.error(f"Unexpected error processing payment intent {intent_id}: {str(e)}")
+
+    def _dispatch(self, app):
+        while not self._stop.wait(app.config.get('PAYMENT_POLL_INTERVAL_S', DEFAULT_POLL_INTERVAL_S)):
+            try:
+                with app.app_context():
+                    self.sweep(app.config)
+            except Exception as e:
+                logger.error(f"Unexpected error in payment dispatcher: {str(e)}")
+
+    def sweep(self, config):
+        """Reclaim expired leases and queue due intents; needs an application context."""
+        now = datetime.utcnow()
+        lease = timedelta(seconds=config.get('PAYMENT_LEASE_S', DEFAULT_LEASE_S))
+        reclaimed = db.session.execute(
+            update(_intents)
+            .where(_intents.c.status == 'processing', _intents.c.claimed_at < now - lease)
+            .values(status='pending', last_error='Worker lease expired')
+        ).rowcount
+        db.session.commit()
+        self.stats['reclaimed'] += reclaimed
+        room = self._queue.maxsize - self._queue.qsize()
+        if room <= 0:
+            return
+        due = (db.session.query(PaymentIntent.id)
+               .filter(PaymentIntent.status == 'pending',
+                       (PaymentIntent.next_attempt_at.is_(None)) | (PaymentIntent.next_attempt_at <= now))
+               .order_by(PaymentIntent.id).limit(room).all())
+        db.session.commit()
+        for (intent_id,) in due:
+            if not self._enqueue(intent_id):
+                break
+
+    def metrics(self):
+        snapshot = dict(self.stats)
+        snapshot['workers'] = self.workers
+        snapshot['queue_depth'] = self._queue.qsize() if self._queue is not None else 0
+        snapshot['queue_capacity'] = self._queue.maxsize if self._queue is not None else 0
+        return snapshot
+
+    def shutdown(self):
+        """Stop the threads; a later ``start`` binds afresh."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+            app, self._app = self._app, None
+        if app is None:
+            return
+        self._stop.set()
+        for _ in range(len(threads) - 1):
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout=5)
+        self._queued.clear()
+        self._gateway.close()
+
+payment_workers = PaymentWorkerPool()
+atexit.register(payment_workers.shutdown)
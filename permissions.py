@@ -0,0 +1,141 @@
+import functools
+import threading
+import time
+
+from flask import current_app, jsonify
+from sqlalchemy import select
+
+from auth_tokens import current_principal, token_auth
+from extensions import db
+from models import Role, RolePermission, User
+
+# Each permission is one bit, by position. Append new names; roles store
+# names, so reordering is safe but churns every compiled mask.
+PERMISSIONS = (
+    'vehicles:write',
+    'fleets:write',
+    'trips:write',
+    'geofences:write',
+    'maintenance:write',
+    'pricing:write',
+    'payments:write',
+    'billing:manage',
+    'reports:read',
+    'exports:read',
+    'telemetry:write',
+    'rebalancing:manage',
+    'users:manage',
+    'roles:manage',
+)
+BITS = {name: 1 << i for i, name in enumerate(PERMISSIONS)}
+ALL_PERMISSIONS = (1 << len(PERMISSIONS)) - 1
+DEFAULT_SUPERUSER_ROLE = 'admin'
+DEFAULT_MAX_AGE_S = 30
+
+def mask_of(names):
+    """OR of the bits for ``names``; raises ``KeyError`` for a name not in ``PERMISSIONS``."""
+    mask = 0
+    for name in names:
+        mask |= BITS[name]
+    return mask
+
+def names_of(mask):
+    return [name for name in PERMISSIONS if mask & BITS[name]]
+
+class CompiledPermissions:
+    """Role id to permission bitset, read without locks or queries."""
+
+    def __init__(self, masks):
+        self.masks = masks
+        self.compiled_at = time.monotonic()
+
+    def mask(self, role_id):
+        return self.masks.get(role_id, 0)
+
+class PermissionTable:
+    """The compiled role permissions for this process, rebuilt after a change or once they are ``max_age`` old.
+
+    The superuser role (RBAC_SUPERUSER_ROLE, default ``admin``) holds every
+    permission. Only ``roles:manage`` holders can create, rename or assign
+    roles, so the first superuser comes from ``grant_superuser``, run from
+    the command line.
+    """
+
+    def __init__(self, max_age_s=DEFAULT_MAX_AGE_S):
+        self.max_age = max_age_s
+        self._compiled = None
+        self._lock = threading.Lock()
+        self.stats = {'compiles': 0, 'last_compile_ms': 0.0}
+
+    def invalidate(self):
+        self._compiled = None
+
+    def compiled(self, config):
+        """Current ``CompiledPermissions``; needs an application context when a recompile is due."""
+        current = self._compiled
+        max_age = config.get('RBAC_MAX_AGE_S', self.max_age)
+        if current is not None and time.monotonic() - current.compiled_at < max_age:
+            return current
+        with self._lock:
+            current = self._compiled
+            if current is not None and time.monotonic() - current.compiled_at < max_age:
+                return current
+            start = time.perf_counter()
+            masks = {}
+            for role_id, permission in db.session.execute(select(RolePermission.role_id, RolePermission.permission)):
+                masks[role_id] = masks.get(role_id, 0) | BITS.get(permission, 0)
+            superuser = config.get('RBAC_SUPERUSER_ROLE', DEFAULT_SUPERUSER_ROLE)
+            for role_id in db.session.execute(select(Role.id).where(Role.name == superuser)).scalars():
+                masks[role_id] = ALL_PERMISSIONS
+            current = CompiledPermissions(masks)
+            self._compiled = current
+            self.stats['compiles'] += 1
+            self.stats['last_compile_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            return current
+
+    def allows(self, role_id, required, config):
+        return self.compiled(config).mask(role_id) & required == required
+
+permission_table = PermissionTable()
+
+def grant_superuser(username, config):
+    """Give ``username`` the superuser role, creating the role if needed; needs an application context.
+
+    Returns the user, or None if there is no such user.
+    """
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        return None
+    name = config.get('RBAC_SUPERUSER_ROLE', DEFAULT_SUPERUSER_ROLE)
+    role = Role.query.filter_by(name=name).first()
+    if role is None:
+        role = Role(name=name, description='Holds every permission')
+        db.session.add(role)
+    user.role = role
+    db.session.commit()
+    token_auth.invalidate_user(user.id)
+    permission_table.invalidate()
+    return user
+
+def require_permission(*names):
+    """Allow the view only to callers whose role holds every permission in ``names``.
+
+    The names are turned into a bitset when the module is imported, so a
+    check is a dict lookup and an AND. No token is 401, a missing
+    permission 403.
+    """
+    required = mask_of(names)
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            principal = current_principal()
+            if principal is None:
+                response = jsonify({"error": "A valid access token is required"})
+                response.headers['WWW-Authenticate'] = 'Bearer'
+                return response, 401
+            if not permission_table.allows(principal.role_id, required, current_app.config):
+                return jsonify({"error": "Permission denied", "required": list(names)}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
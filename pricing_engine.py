@@ -0,0 +1,220 @@
+import json
+import logging
+import threading
+import time
+
+from demand_model import HOURS_PER_WEEK, demand_model
+from extensions import db
+from models import PricingRule
+from rebalancer import DEFAULT_ZONE_SIZE_DEG, zone_key
+from timestamps import naive_utc
+
+logger = logging.getLogger(__name__)
+
+RULE_TYPES = ('base', 'surge', 'time-based')
+CONDITION_KEYS = {'days', 'hours', 'zones', 'min_demand', 'per_minute', 'minimum_fare'}
+BASE_ONLY_CONDITIONS = {'per_minute', 'minimum_fare'}
+# Rules changed by another worker are picked up within this many seconds.
+DEFAULT_MAX_AGE_S = 30
+_ALL_HOURS = (1 << HOURS_PER_WEEK) - 1
+
+class PricingRuleError(ValueError):
+    pass
+
+class NoBasePrice(LookupError):
+    """No base rule matches the quote, so there is nothing to multiply."""
+
+class CompiledRule:
+    __slots__ = ('id', 'rule_type', 'modifier', 'hours', 'min_demand', 'per_minute', 'minimum_fare')
+
+    def __init__(self, rule_id, rule_type, modifier, hours, min_demand=None, per_minute=0.0, minimum_fare=0.0):
+        self.id = rule_id
+        self.rule_type = rule_type
+        self.modifier = modifier
+        self.hours = hours  # bit h set: applies at local hour-of-week h (Monday 00:00 = 0)
+        self.min_demand = min_demand
+        self.per_minute = per_minute
+        self.minimum_fare = minimum_fare
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def check_conditions(rule_type, conditions):
+    """Raise ``PricingRuleError`` unless ``conditions`` is something the engine can evaluate for ``rule_type``."""
+    if rule_type not in RULE_TYPES:
+        raise PricingRuleError(f"Unknown rule type {rule_type!r}")
+    if not isinstance(conditions, dict):
+        raise PricingRuleError("Conditions must be a JSON object")
+    unknown = set(conditions) - CONDITION_KEYS
+    if unknown:
+        raise PricingRuleError(f"Unknown conditions: {', '.join(sorted(unknown))}")
+    if rule_type != 'base' and set(conditions) & BASE_ONLY_CONDITIONS:
+        raise PricingRuleError("per_minute and minimum_fare only apply to base rules")
+    for key, low, high in (('days', 0, 6), ('hours', 0, 23)):
+        values = conditions.get(key, [])
+        if not isinstance(values, list) or not all(_number(v) and v == int(v) and low <= v <= high for v in values):
+            raise PricingRuleError(f"{key} must be a list of integers from {low} to {high}")
+    for point in conditions.get('zones', []):
+        if not (isinstance(point, list) and len(point) == 2 and all(_number(v) for v in point)
+                and -90 <= point[0] <= 90 and -180 <= point[1] <= 180):
+            raise PricingRuleError("zones must be a list of [lat, lon] points")
+    for key in ('min_demand', 'per_minute', 'minimum_fare'):
+        if key in conditions and not (_number(conditions[key]) and conditions[key] >= 0):
+            raise PricingRuleError(f"{key} must be a non-negative number")
+
+def _hour_mask(days, hours):
+    if not days and not hours:
+        return _ALL_HOURS
+    mask = 0
+    for day in days or range(7):
+        for hour in hours or range(24):
+            mask |= 1 << (day * 24 + hour)
+    return mask
+
+class CompiledRules:
+    """Pricing rules indexed for evaluation.
+
+    Rules without a zone condition are bucketed by local hour of the week;
+    zone rules are keyed by the grid zone they name and checked against
+    their hour mask. A quote touches only the rules in its bucket and zone.
+    Matching base rules: the newest wins. Surge: the largest multiplier
+    wins. Time-based multipliers stack.
+    """
+
+    def __init__(self, rules, zone_size_deg=DEFAULT_ZONE_SIZE_DEG, utc_offset_hours=0):
+        self.zone_size = zone_size_deg
+        self.utc_offset_hours = utc_offset_hours
+        self.compiled_at = time.monotonic()
+        self.rule_count = 0
+        by_hour = [[] for _ in range(HOURS_PER_WEEK)]
+        by_zone = {}
+        for rule_id, rule_type, modifier, conditions in rules:
+            try:
+                check_conditions(rule_type, conditions)
+            except PricingRuleError as e:
+                # An unreadable rule must not silently change fares; leave it out.
+                logger.error(f"Skipping pricing rule {rule_id}: {str(e)}")
+                continue
+            compiled = CompiledRule(rule_id, rule_type, modifier or 0.0,
+                                    _hour_mask([int(d) for d in conditions.get('days', [])],
+                                               [int(h) for h in conditions.get('hours', [])]),
+                                    conditions.get('min_demand'), conditions.get('per_minute', 0.0),
+                                    conditions.get('minimum_fare', 0.0))
+            self.rule_count += 1
+            if 'zones' in conditions:
+                for key in {zone_key(lat, lon, zone_size_deg) for lat, lon in conditions['zones']}:
+                    by_zone.setdefault(key, []).append(compiled)
+                continue
+            for hour in range(HOURS_PER_WEEK):
+                if compiled.hours >> hour & 1:
+                    by_hour[hour].append(compiled)
+        self._by_hour = [tuple(rules) for rules in by_hour]
+        self._by_zone = {key: tuple(rules) for key, rules in by_zone.items()}
+
+    def hour_of_week(self, moment):
+        moment = naive_utc(moment)
+        return (moment.weekday() * 24 + moment.hour + self.utc_offset_hours) % HOURS_PER_WEEK
+
+    def quote(self, moment, minutes=0.0, lat=None, lon=None, demand_rate=None):
+        """Fare breakdown for a ride of ``minutes`` starting at ``moment`` near ``(lat, lon)``.
+
+        ``demand_rate(lat, lon, moment)`` supplies trip starts per hour for
+        rules with a ``min_demand`` condition; such rules never match
+        without a location.
+        """
+        # Demand forecasts, like rule hours, are kept in naive UTC.
+        moment = naive_utc(moment)
+        hour = self.hour_of_week(moment)
+        candidates = self._by_hour[hour]
+        located = lat is not None and lon is not None
+        if located and self._by_zone:
+            zone_rules = self._by_zone.get(zone_key(lat, lon, self.zone_size))
+            if zone_rules:
+                candidates = candidates + tuple(rule for rule in zone_rules if rule.hours >> hour & 1)
+        base = surge = None
+        multiplier = 1.0
+        stacked = []
+        rate = None
+        for rule in candidates:
+            if rule.min_demand is not None:
+                if not located or demand_rate is None:
+                    continue
+                if rate is None:
+                    rate = demand_rate(lat, lon, moment)
+                if rate < rule.min_demand:
+                    continue
+            if rule.rule_type == 'base':
+                if base is None or rule.id > base.id:
+                    base = rule
+            elif rule.rule_type == 'surge':
+                if surge is None or rule.modifier > surge.modifier:
+                    surge = rule
+            else:
+                multiplier *= rule.modifier
+                stacked.append(rule.id)
+        if base is None:
+            raise NoBasePrice("No base price applies")
+        surge_multiplier = surge.modifier if surge is not None else 1.0
+        fare = (base.modifier + base.per_minute * minutes) * multiplier * surge_multiplier
+        rule_ids = [base.id] + stacked + ([surge.id] if surge is not None else [])
+        return {
+            'fare': round(max(fare, base.minimum_fare), 2),
+            'base_fare': base.modifier,
+            'per_minute': base.per_minute,
+            'minutes': minutes,
+            'multiplier': round(multiplier, 6),
+            'surge_multiplier': surge_multiplier,
+            'rule_ids': rule_ids,
+        }
+
+def _load_rules():
+    rules = []
+    for rule_id, rule_type, modifier, conditions in db.session.query(
+            PricingRule.id, PricingRule.rule_type, PricingRule.price_modifier, PricingRule.conditions):
+        try:
+            parsed = json.loads(conditions) if conditions else {}
+        except ValueError:
+            parsed = None
+        if not isinstance(parsed, dict):
+            logger.error(f"Skipping pricing rule {rule_id}: conditions are not a JSON object")
+            continue
+        rules.append((rule_id, rule_type, modifier, parsed))
+    return rules
+
+class PricingEngine:
+    """The compiled rules for this process, rebuilt after a change or once they are ``max_age`` old."""
+
+    def __init__(self, max_age_s=DEFAULT_MAX_AGE_S):
+        self.max_age = max_age_s
+        self._compiled = None
+        self._lock = threading.Lock()
+        self.stats = {'compiles': 0, 'last_compile_ms': 0.0}
+
+    def invalidate(self):
+        self._compiled = None
+
+    def compiled(self, config):
+        """Current ``CompiledRules``; needs an application context when a recompile is due."""
+        current = self._compiled
+        max_age = config.get('PRICING_RULES_MAX_AGE_S', self.max_age)
+        if current is not None and time.monotonic() - current.compiled_at < max_age:
+            return current
+        with self._lock:
+            current = self._compiled
+            if current is not None and time.monotonic() - current.compiled_at < max_age:
+                return current
+            start = time.perf_counter()
+            current = CompiledRules(_load_rules(), config.get('DEMAND_ZONE_SIZE_DEG', DEFAULT_ZONE_SIZE_DEG),
+                                    config.get('DEMAND_UTC_OFFSET_HOURS', 0))
+            self._compiled = current
+            self.stats['compiles'] += 1
+            self.stats['last_compile_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            return current
+
+    def quote(self, config, moment, minutes=0.0, lat=None, lon=None):
+        """Price one ride; raises ``NoBasePrice`` when no base rule matches."""
+        def demand_rate(lat, lon, moment):
+            return demand_model.snapshot(config).hourly_rate(lat, lon, moment)
+        return self.compiled(config).quote(moment, minutes, lat, lon, demand_rate)
+
+pricing_engine = PricingEngine()
@@ -0,0 +1,218 @@
+import math
+
+import numpy as np
+
+from extensions import db
+from models import Vehicle
+
+DEFAULT_ZONE_SIZE_DEG = 0.01  # Rebalancing zones are grid cells of about 1 km
+DEFAULT_MAX_MOVE_M = 5000  # Leave a vehicle where it is rather than move it further than this
+SINKHORN_TOLERANCE = 0.5  # Largest row-marginal error, in vehicles, before rounding
+SINKHORN_ITERATIONS_PER_ABSORPTION = 50
+SINKHORN_MAX_ABSORPTIONS = 200
+METERS_PER_DEGREE = math.pi * 6371008.8 / 180
+_ZONE_KEY_BASE = 1 << 24  # Room for grid cells down to 0.00003 degrees
+
+class Zones:
+    """Grid cells covering a set of points, as parallel NumPy arrays."""
+
+    def __init__(self, size_deg, keys):
+        self.size = size_deg
+        self.keys = keys  # sorted, unique
+        rows, cols = keys // _ZONE_KEY_BASE - (_ZONE_KEY_BASE >> 1), keys % _ZONE_KEY_BASE - (_ZONE_KEY_BASE >> 1)
+        self.lat = (rows + 0.5) * size_deg
+        self.lon = (cols + 0.5) * size_deg
+
+    def __len__(self):
+        return len(self.keys)
+
+    def label(self, zone):
+        return f"{self.lat[zone]:.5f},{self.lon[zone]:.5f}"
+
+def zone_keys(lats, lons, size_deg):
+    rows = np.floor(np.asarray(lats) / size_deg).astype(np.int64) + (_ZONE_KEY_BASE >> 1)
+    cols = np.floor(np.asarray(lons) / size_deg).astype(np.int64) + (_ZONE_KEY_BASE >> 1)
+    return rows * _ZONE_KEY_BASE + cols
+
+def zone_key(lat, lon, size_deg):
+    """``zone_keys`` for a single point, without the NumPy overhead."""
+    half = _ZONE_KEY_BASE >> 1
+    return (math.floor(lat / size_deg) + half) * _ZONE_KEY_BASE + math.floor(lon / size_deg) + half
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Equirectangular distance in metres; broadcasts like any NumPy expression."""
+    x = np.radians(lon2 - lon1) * np.cos(np.radians((lat1 + lat2) / 2))
+    y = np.radians(lat2 - lat1)
+    return np.hypot(x, y) * (METERS_PER_DEGREE * 180 / math.pi)
+
+def _sinkhorn(a, b, cost, reg, tolerance):
+    # Entropy-regularised transport plan with marginals ``a`` and ``b``. The
+    # regularisation is lowered in stages, and the scalings are folded into
+    # the log-domain potentials ``f`` and ``g`` every few iterations so the
+    # kernel never underflows.
+    f, g = np.zeros(len(a)), np.zeros(len(b))
+    stages = []
+    stage_reg = cost.max() / 8
+    while stage_reg > reg:
+        stages.append(stage_reg)
+        stage_reg /= 2
+    stages.append(reg)
+    for stage_reg in stages:
+        for _ in range(SINKHORN_MAX_ABSORPTIONS):
+            kernel = np.exp((f[:, None] + g[None, :] - cost) / stage_reg)
+            u, v = np.ones(len(a)), np.ones(len(b))
+            for _ in range(SINKHORN_ITERATIONS_PER_ABSORPTION):
+                u = a / np.maximum(kernel @ v, 1e-300)
+                v = b / np.maximum(kernel.T @ u, 1e-300)
+            f += stage_reg * np.log(u)
+            g += stage_reg * np.log(v)
+            if np.abs(u * (kernel @ v) - a).max() < tolerance:
+                break
+    return np.exp((f[:, None] + g[None, :] - cost) / reg)
+
+def solve_transport(supply, capacity, cost, max_cost, reg=None):
+    """Min-cost transport of ``supply[s]`` units into ``capacity[d]`` slots.
+
+    Returns ``[(s, d, units)]``. Units whose every option costs more than
+    ``max_cost`` stay put, as do units left over when capacity runs out, so
+    the problem is always feasible. Solved as entropy-regularised optimal
+    transport (Sinkhorn) and rounded to whole units; with the default
+    ``reg`` of ``max_cost / 500`` the total saving over leaving everything
+    in place is typically within 1% of the exact optimum.
+    """
+    rows, columns = np.flatnonzero(np.asarray(supply) > 0), np.flatnonzero(np.asarray(capacity) > 0)
+    if not len(rows) or not len(columns):
+        return []
+    supply = np.asarray(supply, dtype=np.int64)[rows]
+    capacity = np.asarray(capacity, dtype=np.int64)[columns]
+    cost = np.asarray(cost, dtype=float)[np.ix_(rows, columns)]
+    sources, sinks = cost.shape
+    reg = reg or max_cost / 500
+    # Balanced with a final "stay" column that can take every unit, and a
+    # final dummy source whose units fill the slots nobody moves into.
+    # Pairs past max_cost are clipped: they lose to staying either way.
+    extended = np.zeros((sources + 1, sinks + 1))
+    extended[:sources, :sinks] = np.minimum(cost, 2 * max_cost)
+    extended[:sources, sinks] = max_cost
+    plan = _sinkhorn(np.append(supply, capacity.sum()).astype(float),
+                     np.append(capacity, supply.sum()).astype(float),
+                     extended, reg, SINKHORN_TOLERANCE)[:sources, :sinks]
+    plan[cost > max_cost] = 0
+
+    # Whole units: the integer part of the plan, then the largest leftover
+    # fractions, then any still-free capacity cheapest pair first.
+    flows = np.floor(plan + 1e-6).astype(np.int64)
+    for axis, limit in ((1, supply), (0, capacity)):
+        excess = flows.sum(axis=axis) - limit
+        for i in np.flatnonzero(excess > 0):
+            line = flows[i] if axis == 1 else flows[:, i]
+            for j in np.argsort(cost[i] if axis == 1 else cost[:, i])[::-1]:
+                trim = min(line[j], excess[i])
+                line[j] -= trim
+                excess[i] -= trim
+                if not excess[i]:
+                    break
+    spare_supply = supply - flows.sum(axis=1)
+    spare_capacity = capacity - flows.sum(axis=0)
+    fractions = plan - flows
+    candidates = np.flatnonzero((fractions > 0.01).ravel() & (cost <= max_cost).ravel())
+    by_cost = np.flatnonzero((cost <= max_cost).ravel())
+    for order in (candidates[np.argsort(-fractions.ravel()[candidates], kind='stable')],
+                  by_cost[np.argsort(cost.ravel()[by_cost], kind='stable')]):
+        for flat in order:
+            if not spare_supply.any() or not spare_capacity.any():
+                break
+            s, d = divmod(int(flat), sinks)
+            units = min(spare_supply[s], spare_capacity[d])
+            if units > 0:
+                flows[s, d] += units
+                spare_supply[s] -= units
+                spare_capacity[d] -= units
+    return [(int(rows[s]), int(columns[d]), int(flows[s, d])) for s, d in zip(*np.nonzero(flows))]
+
+def zone_targets(demand, total):
+    """Share ``total`` vehicles out over zones in proportion to ``demand`` (largest remainder)."""
+    quota = demand * (total / demand.sum())
+    targets = np.floor(quota).astype(np.int64)
+    short = total - int(targets.sum())
+    if short:
+        targets[np.argsort(targets - quota)[:short]] += 1
+    return targets
+
+def transport_problem(zones, supply, targets):
+    """``(sources, sinks, surplus, deficit, cost)`` for moving vehicles from zones over target to zones under it."""
+    surplus = np.maximum(supply - targets, 0)
+    deficit = np.maximum(targets - supply, 0)
+    sources, sinks = np.flatnonzero(surplus), np.flatnonzero(deficit)
+    cost = distance_m(zones.lat[sources, None], zones.lon[sources, None], zones.lat[None, sinks], zones.lon[None, sinks])
+    return sources, sinks, surplus[sources], deficit[sinks], cost
+
+def plan_rebalancing(vehicle_ids, lats, lons, demand_keys, demand_rates,
+                     zone_size_deg=DEFAULT_ZONE_SIZE_DEG, max_move_m=DEFAULT_MAX_MOVE_M):
+    """Moves that bring available vehicles in line with forecast demand.
+
+    ``demand_keys``/``demand_rates`` are expected trip starts per day by
+    zone key, as in a ``demand_model.Forecast``. Each zone's target is its
+    share of that demand applied to the available fleet. Vehicles over
+    target are surplus and zones under target have deficit slots; the
+    surplus is assigned to the slots by ``solve_transport`` on distance.
+    Returns ``(zones, summary, moves)``, with moves ranked by estimated
+    benefit in extra trips per day.
+    """
+    vehicle_ids = np.asarray(vehicle_ids)
+    vehicle_keys = zone_keys(lats, lons, zone_size_deg)
+    zones = Zones(zone_size_deg, np.union1d(vehicle_keys, demand_keys))
+    vehicle_zone = np.searchsorted(zones.keys, vehicle_keys)
+    supply = np.bincount(vehicle_zone, minlength=len(zones))
+    demand = np.zeros(len(zones))
+    demand[np.searchsorted(zones.keys, demand_keys)] = demand_rates
+    summary = {'zones': len(zones), 'vehicles': int(len(vehicle_ids)),
+               'forecast_trip_starts_per_day': round(float(demand.sum()), 2)}
+    if not len(vehicle_ids) or not demand.sum():
+        return zones, dict(summary, surplus=0, deficit=0, moves=0), []
+
+    targets = zone_targets(demand, len(vehicle_ids))
+    sources, sinks, surplus, deficit, cost = transport_problem(zones, supply, targets)
+    flows = solve_transport(surplus, deficit, cost, max_move_m)
+
+    # Trips per day each vehicle can expect: at a deficit zone once it reaches
+    # target, and at the surplus zone it leaves, where it is spare capacity.
+    gain = demand / np.maximum(targets, 1)
+    loss = np.divide(demand, supply, out=np.zeros_like(demand), where=supply > 0)
+    order = np.argsort(vehicle_zone, kind='stable')
+    starts = np.searchsorted(vehicle_zone[order], np.arange(len(zones) + 1))
+    remaining = {}
+    moves = []
+    for s, d, units in sorted(flows, key=lambda flow: cost[flow[0], flow[1]]):
+        source, sink = sources[s], sinks[d]
+        pool = remaining.get(source)
+        if pool is None:
+            pool = remaining[source] = order[starts[source]:starts[source + 1]]
+        distances = distance_m(lats[pool], lons[pool], zones.lat[sink], zones.lon[sink])
+        chosen = np.argsort(distances, kind='stable')[:units]
+        benefit = round(float(gain[sink] - loss[source]), 4)
+        for i in chosen:
+            moves.append((benefit, float(distances[i]), int(vehicle_ids[pool[i]]), int(pool[i]), int(source), int(sink)))
+        remaining[source] = np.delete(pool, chosen)
+    moves.sort(key=lambda move: (-move[0], move[1]))
+    summary.update(surplus=int(surplus.sum()), deficit=int(deficit.sum()), moves=len(moves),
+                   total_distance_m=round(sum(move[1] for move in moves), 1),
+                   estimated_trips_gained_per_day=round(sum(move[0] for move in moves), 2))
+    return zones, summary, moves
+
+def available_vehicle_positions():
+    """``(ids, lats, lons)`` of own-fleet vehicles that are available and located."""
+    rows = (db.session.query(Vehicle.id, Vehicle.latitude, Vehicle.longitude)
+            .filter(Vehicle.source.is_(None), Vehicle.status == 'available',
+                    Vehicle.latitude.isnot(None), Vehicle.longitude.isnot(None))
+            .order_by(Vehicle.id).all())
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+    ids, lats, lons = zip(*rows)
+    return np.array(ids, dtype=np.int64), np.array(lats), np.array(lons)
+
+def current_rebalancing_plan(config, forecast):
+    """Plan for the available fleet against a ``demand_model.Forecast``, in the forecast's zones."""
+    ids, lats, lons = available_vehicle_positions()
+    return plan_rebalancing(ids, lats, lons, forecast.keys, forecast.rates, zone_size_deg=forecast.zone_size,
+                            max_move_m=config.get('REBALANCING_MAX_MOVE_M', DEFAULT_MAX_MOVE_M))
@@ -0,0 +1,274 @@
+import ast
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from flask import Flask
+from marshmallow import Schema, fields, validate
+from sqlalchemy import func, update
+
+from extensions import db
+from models import Fleet, FleetTripRollup, Report, Vehicle, VehicleTripRollup
+from rollups import GRAINS, next_bucket, truncate, window_filter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_CACHE_TTL_SECONDS = 300
+COMPRESS_THRESHOLD = 64 * 1024  # Results at least this large are stored gzipped
+PROGRESS_STEP = 5  # Percent; limits progress UPDATEs per job
+VEHICLE_CHUNK = 500
+PENDING_STATUSES = ('queued', 'running')
+LEGACY_BATCH = 500
+
+class UsageReportParams(Schema):
+    window_hours = fields.Integer(load_default=30 * 24, validate=validate.Range(min=1, max=366 * 24))
+    fleet_id = fields.Integer(allow_none=True)
+
+class FleetActivityReportParams(Schema):
+    window_hours = fields.Integer(load_default=30 * 24, validate=validate.Range(min=1, max=366 * 24))
+    grain = fields.String(load_default='day', validate=validate.OneOf(GRAINS))
+
+def canonical_params(params):
+    return json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+def params_digest(report_type, canonical):
+    return hashlib.sha256(f"{report_type}\n{canonical}".encode()).hexdigest()
+
+def encode_content(content):
+    """``(text, gzipped)`` for a result; exactly one of the two is set."""
+    raw = json.dumps(content, separators=(',', ':'))
+    if len(raw) >= COMPRESS_THRESHOLD:
+        return None, gzip.compress(raw.encode(), compresslevel=6)
+    return raw, None
+
+def content_json(report):
+    """The stored result as JSON text, or ``None`` if there is none."""
+    if report.content_gzip is not None:
+        return gzip.decompress(report.content_gzip).decode()
+    if report.content is None or report.content_format == 'json':
+        return report.content
+    return _legacy_json(report.content)
+
+def _legacy_json(text):
+    # Reports stored before results were JSON mostly hold the repr() of a dict.
+    try:
+        json.loads(text)
+        return text
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.dumps(ast.literal_eval(text), separators=(',', ':'))
+    except (ValueError, SyntaxError):
+        return json.dumps(text)
+
+def convert_legacy_reports(batch=LEGACY_BATCH):
+    """Rewrite results stored before the JSON format as JSON, once; returns how many were converted.
+
+    Until a report is converted every read of it has to detect its format.
+    """
+    converted = 0
+    last_id = 0
+    while True:
+        rows = (db.session.query(Report.id, Report.content)
+                .filter(Report.content_format.is_(None), Report.id > last_id)
+                .order_by(Report.id).limit(batch).all())
+        if not rows:
+            return converted
+        for report_id, text in rows:
+            db.session.execute(update(Report).where(Report.id == report_id).values(
+                content=None if text is None else _legacy_json(text), content_format='json'))
+        db.session.commit()
+        converted += len(rows)
+        last_id = rows[-1][0]
+
+def _window(hours):
+    end = next_bucket(truncate(datetime.utcnow(), 'hour'), 'hour')
+    return end - timedelta(hours=hours), end
+
+def build_usage_report(params, progress):
+    start, end = _window(params['window_hours'])
+    vehicles = db.session.query(Vehicle.id).order_by(Vehicle.id)
+    if params.get('fleet_id') is not None:
+        vehicles = vehicles.filter(Vehicle.fleet_id == params['fleet_id'])
+    vehicle_ids = [vehicle_id for (vehicle_id,) in vehicles]
+
+    rollup = VehicleTripRollup
+    rows = []
+    totals = [0, 0.0, 0.0]
+    for offset in range(0, len(vehicle_ids), VEHICLE_CHUNK):
+        chunk = vehicle_ids[offset:offset + VEHICLE_CHUNK]
+        usage = {vehicle_id: (trips, seconds, revenue) for vehicle_id, trips, seconds, revenue in
+                 db.session.query(rollup.vehicle_id, func.sum(rollup.trips), func.sum(rollup.ride_seconds),
+                                  func.sum(rollup.revenue))
+                 .filter(window_filter(rollup, start, end), rollup.vehicle_id.in_(chunk))
+                 .group_by(rollup.vehicle_id)}
+        for vehicle_id in chunk:
+            trips, seconds, revenue = usage.get(vehicle_id, (0, 0.0, 0.0))
+            rows.append([vehicle_id, trips, round(seconds, 3), round(revenue, 2)])
+            totals[0] += trips
+            totals[1] += seconds
+            totals[2] += revenue
+        progress((offset + len(chunk)) / len(vehicle_ids))
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'fleet_id': params.get('fleet_id'),
+        'totals': {'trips': totals[0], 'ride_seconds': round(totals[1], 3), 'revenue': round(totals[2], 2)},
+        'columns': ['vehicle_id', 'trips', 'ride_seconds', 'revenue'],
+        'rows': rows,
+    }
+
+def build_fleet_activity_report(params, progress):
+    start, end = _window(params['window_hours'])
+    grain = params['grain']
+    since = truncate(start, grain)
+    fleet_ids = [fleet_id for (fleet_id,) in db.session.query(Fleet.id).order_by(Fleet.id)]
+    rollup = FleetTripRollup
+    fleets = []
+    for done, fleet_id in enumerate(fleet_ids, 1):
+        series = [[bucket.isoformat(), trips, round(seconds, 3), round(revenue, 2)]
+                  for bucket, trips, seconds, revenue in
+                  db.session.query(rollup.bucket_start, rollup.trips, rollup.ride_seconds, rollup.revenue)
+                  .filter(rollup.grain == grain, rollup.fleet_id == fleet_id, rollup.bucket_start >= since)
+                  .order_by(rollup.bucket_start)]
+        fleets.append({'fleet_id': fleet_id, 'series': series})
+        progress(done / len(fleet_ids))
+    return {
+        'start': since.isoformat(),
+        'end': end.isoformat(),
+        'grain': grain,
+        'columns': ['bucket_start', 'trips', 'ride_seconds', 'revenue'],
+        'fleets': fleets,
+    }
+
+# report type -> (parameter schema, builder)
+REPORT_TYPES = {
+    'usage': (UsageReportParams, build_usage_report),
+    'fleet_activity': (FleetActivityReportParams, build_fleet_activity_report),
+}
+
+def _set_status(report_id, **values):
+    db.session.execute(update(Report).where(Report.id == report_id).values(**values))
+    db.session.commit()
+
+def generate_report_content(report_id):
+    """Build a queued report and store its result; needs an application context."""
+    report = db.session.get(Report, report_id)
+    if report is None or report.status != 'queued':
+        return
+    _set_status(report_id, status='running', progress=0)
+    reported = [0]
+
+    def progress(fraction):
+        percent = int(fraction * 100)
+        if PROGRESS_STEP <= percent - reported[0] and percent < 100:
+            reported[0] = percent
+            _set_status(report_id, progress=percent)
+
+    try:
+        _, build = REPORT_TYPES[report.report_type]
+        text, packed = encode_content(build(json.loads(report.params), progress))
+        _set_status(report_id, status='completed', progress=100, content=text, content_gzip=packed,
+                    completed_at=datetime.utcnow())
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Report {report_id} failed: {str(e)}")
+        _set_status(report_id, status='failed', error=str(e)[:500], completed_at=datetime.utcnow())
+
+_worker_app = None
+
+def _init_worker(database_uri):
+    global _worker_app
+    _worker_app = Flask('report-worker')
+    _worker_app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    db.init_app(_worker_app)
+
+def run_report_job(report_id):
+    # Entry point inside a pool process.
+    with _worker_app.app_context():
+        try:
+            generate_report_content(report_id)
+        finally:
+            db.session.remove()
+
+class ReportJobRunner:
+    """Runs queued reports on a process pool, off the request threads.
+
+    Workers are spawned rather than forked so they never inherit the web
+    process's threads or pooled connections. With ``REPORT_WORKERS = 0`` jobs
+    run inline, which an in-memory SQLite database requires.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._app = None
+        self._workers = DEFAULT_WORKERS
+        self._lock = threading.Lock()
+
+    def start(self, app):
+        """Bind to ``app`` once per process; the pool itself is created on first submit."""
+        if self._app is not None:
+            return
+        with self._lock:
+            if self._app is None:
+                self._workers = app.config.get('REPORT_WORKERS', DEFAULT_WORKERS)
+                self._app = app
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self._app.config['SQLALCHEMY_DATABASE_URI'],))
+            return self._executor
+
+    def submit(self, report_id):
+        if self._workers <= 0:
+            generate_report_content(report_id)
+            return
+        try:
+            future = self._pool().submit(run_report_job, report_id)
+        except BrokenProcessPool as e:
+            self._mark_failed(report_id, e)
+            return
+        future.add_done_callback(lambda f: self._on_done(report_id, f))
+
+    def _on_done(self, report_id, future):
+        error = future.exception()
+        if error is None:
+            return
+        # The worker died before it could record the failure itself.
+        try:
+            self._mark_failed(report_id, error)
+        except Exception as e:
+            logger.error(f"Could not mark report {report_id} as failed: {str(e)}")
+
+    def _mark_failed(self, report_id, error):
+        logger.error(f"Report worker failed for report {report_id}: {str(error)}")
+        if isinstance(error, BrokenProcessPool):
+            # Replaced on the next submit.
+            with self._lock:
+                self._executor = None
+        with self._app.app_context():
+            db.session.execute(update(Report)
+                               .where(Report.id == report_id, Report.status.in_(PENDING_STATUSES))
+                               .values(status='failed', error=str(error)[:500], completed_at=datetime.utcnow()))
+            db.session.commit()
+            db.session.remove()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+report_jobs = ReportJobRunner()
@@ -0,0 +1,233 @@
+import bisect
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event
+
+from db_pool import pool_metrics
+from extensions import db
+
+# Upper bounds, Prometheus' default latency buckets and a spread of statement counts.
+LATENCY_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+UNMATCHED_ENDPOINT = '<unmatched>'
+
+class Histogram:
+    """Bucket counts, sum and count for one label set; written by a single thread."""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+class _Shard:
+    # One per thread, so recording never takes a lock; a scrape sums them.
+
+    def __init__(self):
+        self.latency = {}
+        self.statements = {}
+        self.db_time = {}
+        self.responses = {}
+
+    def merge(self, other):
+        for target, source in ((self.latency, other.latency), (self.statements, other.statements),
+                               (self.db_time, other.db_time)):
+            for key, histogram in dict(source).items():
+                if key not in target:
+                    target[key] = Histogram(histogram.bounds)
+                target[key].merge(histogram)
+        for key, count in dict(other.responses).items():
+            self.responses[key] = self.responses.get(key, 0) + count
+
+class _Request:
+    __slots__ = ('started', 'statements', 'db_time', 'status', 'sql_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.status = 500  # until after_request says otherwise
+        self.sql_started = None
+
+class RequestMetrics:
+    """Per-endpoint latency, SQL statement count and DB time of every request, in Prometheus form.
+
+    Each thread records into its own shard, so a request costs a few dict
+    lookups and list increments and no lock; only a thread's first request
+    and a scrape lock. Statements are counted with cursor execute events,
+    so only those a request runs on its own thread are attributed to it.
+    Shards of threads that have exited are folded into one retired shard,
+    so a server that starts a thread per request keeps a bounded number.
+    Each server worker process keeps its own numbers, so a scrape through
+    gunicorn reports whichever worker answered; the pool series carry its
+    pid to tell them apart.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = {}  # thread ident -> shard
+        self._retired = _Shard()
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        with app.app_context():
+            for engine in db.engines.values():
+                # retval=True spares SQLAlchemy wrapping the listener on every statement.
+                event.listen(engine, 'before_cursor_execute', self._before_cursor_execute, retval=True)
+                event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._retire_exited()
+                previous = self._shards.get(threading.get_ident())
+                if previous is not None:
+                    # The ident was reused after its thread exited.
+                    self._retired.merge(previous)
+                self._shards[threading.get_ident()] = shard
+        return shard
+
+    def _retire_exited(self):
+        # Called with the lock held.
+        running = {thread.ident for thread in threading.enumerate()}
+        for ident in [ident for ident in self._shards if ident not in running]:
+            self._retired.merge(self._shards.pop(ident))
+
+    def _before_request(self):
+        self._local.request = _Request()
+
+    def _after_request(self, response):
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            current.status = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        current = getattr(self._local, 'request', None)
+        if current is None:
+            return
+        self._local.request = None
+        elapsed = time.perf_counter() - current.started
+        key = (request.endpoint or UNMATCHED_ENDPOINT, request.method)
+        shard = self._shard()
+        histogram = shard.latency.get(key)
+        if histogram is None:
+            histogram = shard.latency[key] = Histogram(LATENCY_BUCKETS_S)
+            shard.statements[key] = Histogram(STATEMENT_BUCKETS)
+            shard.db_time[key] = Histogram(LATENCY_BUCKETS_S)
+        histogram.observe(elapsed)
+        shard.statements[key].observe(current.statements)
+        shard.db_time[key].observe(current.db_time)
+        response_key = key + (current.status,)
+        shard.responses[response_key] = shard.responses.get(response_key, 0) + 1
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            current.sql_started = time.perf_counter()
+        return statement, parameters
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        current = getattr(self._local, 'request', None)
+        if current is not None and current.sql_started is not None:
+            current.db_time += time.perf_counter() - current.sql_started
+            current.statements += 1
+            current.sql_started = None
+
+    def collect(self):
+        """Every shard summed: ``(latency, statements, db_time, responses)`` keyed by label tuple."""
+        merged = _Shard()
+        with self._lock:
+            self._retire_exited()
+            merged.merge(self._retired)
+            shards = list(self._shards.values())
+        for shard in shards:
+            merged.merge(shard)
+        return merged.latency, merged.statements, merged.db_time, merged.responses
+
+    def render(self):
+        """The Prometheus text exposition of these metrics and the database pool's."""
+        latency, statements, db_time, responses = self.collect()
+        lines = []
+        _counter(lines, 'http_requests_total', 'Requests handled, by endpoint, method and status.',
+                 {('endpoint', 'method', 'status'): responses})
+        _histograms(lines, 'http_request_duration_seconds', 'Time from before_request to teardown.', latency)
+        _histograms(lines, 'http_request_sql_statements', 'SQL statements executed per request.', statements)
+        _histograms(lines, 'http_request_db_seconds', 'Time spent executing SQL per request.', db_time)
+        _pool(lines, pool_metrics.metrics())
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _counter(lines, name, help_text, series):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} counter')
+    for names, values in series.items():
+        for key, count in sorted(values.items(), key=lambda item: tuple(map(str, item[0]))):
+            lines.append(f'{name}{{{_labels(names, key)}}} {count}')
+
+def _histograms(lines, name, help_text, series):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for key, histogram in sorted(series.items()):
+        labels = _labels(('endpoint', 'method'), key)
+        cumulative = 0
+        for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {_number(histogram.sum)}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+def _pool(lines, snapshot):
+    pid = f'pid="{snapshot["pid"]}"'
+    for name, key, help_text in (
+            ('db_pool_size', 'pool_size', 'Connections the pool keeps open.'),
+            ('db_pool_capacity', 'capacity', 'Pool size plus overflow.'),
+            ('db_pool_checked_out', 'checked_out', 'Connections in use.'),
+            ('db_pool_overflow', 'overflow', 'Connections open beyond the pool size.'),
+            ('db_pool_saturation', 'saturation', 'Checked out connections over capacity.')):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name}{{{pid}}} {_number(snapshot[key])}')
+    lines.append('# HELP db_pool_checkout_timeouts_total Checkouts that gave up waiting for a connection.')
+    lines.append('# TYPE db_pool_checkout_timeouts_total counter')
+    lines.append(f'db_pool_checkout_timeouts_total{{{pid}}} {snapshot["timeouts"]}')
+    lines.append('# HELP db_pool_checkout_wait_seconds Time to check out a connection, including pre-ping.')
+    lines.append('# TYPE db_pool_checkout_wait_seconds histogram')
+    cumulative = 0
+    for bucket in snapshot['wait_ms_buckets']:
+        cumulative += bucket['count']
+        bound = bucket['le'] if bucket['le'] == '+Inf' else bucket['le'] / 1000
+        lines.append(f'db_pool_checkout_wait_seconds_bucket{{{pid},le="{bound}"}} {cumulative}')
+    lines.append(f'db_pool_checkout_wait_seconds_sum{{{pid}}} {_number(snapshot["wait_ms_total"] / 1000)}')
+    lines.append(f'db_pool_checkout_wait_seconds_count{{{pid}}} {snapshot["checkouts"] + snapshot["timeouts"]}')
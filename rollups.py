@@ -0,0 +1,173 @@
+from datetime import timedelta
+
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from extensions import db
+from models import FleetTripRollup, Trip, Vehicle, VehicleTripRollup
+
+GRAINS = ('hour', 'day', 'month')  # finest first; each grain is built from the one before it
+_UPSERT_INSERTS = {'sqlite': sqlite_insert, 'postgresql': postgresql_insert}
+# Same text layout SQLAlchemy uses for DateTime on SQLite, so range filters compare correctly.
+_SQLITE_BUCKET_FORMATS = {
+    'hour': '%Y-%m-%d %H:00:00.000000',
+    'day': '%Y-%m-%d 00:00:00.000000',
+    'month': '%Y-%m-01 00:00:00.000000',
+}
+
+def trip_duration_seconds():
+    """SQL expression for ``Trip.end_time - Trip.start_time`` in seconds."""
+    if db.engine.dialect.name == 'sqlite':
+        return (func.julianday(Trip.end_time) - func.julianday(Trip.start_time)) * 86400
+    return func.extract('epoch', Trip.end_time - Trip.start_time)
+
+def truncate(moment, grain):
+    """Start of the hour, day or month containing ``moment``."""
+    if grain == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if grain == 'day':
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_bucket(bucket, grain):
+    if grain == 'hour':
+        return bucket + timedelta(hours=1)
+    if grain == 'day':
+        return bucket + timedelta(days=1)
+    return (bucket.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def _ceil(moment, grain):
+    bucket = truncate(moment, grain)
+    return bucket if bucket == moment else next_bucket(bucket, grain)
+
+def window_segments(start, end, grains=GRAINS[::-1]):
+    """``(grain, lo, hi)`` ranges tiling hour-aligned ``[start, end)`` with the coarsest whole buckets.
+
+    A year-long window reads about a dozen monthly rows per key plus daily
+    and hourly rows for the ragged ends, instead of every hour in between.
+    """
+    if start >= end:
+        return []
+    grain, finer = grains[0], grains[1:]
+    if not finer:
+        return [(grain, start, end)]
+    inner_start, inner_end = _ceil(start, grain), truncate(end, grain)
+    if inner_start >= inner_end:
+        return window_segments(start, end, finer)
+    return (window_segments(start, inner_start, finer) + [(grain, inner_start, inner_end)]
+            + window_segments(inner_end, end, finer))
+
+def window_filter(model, start, end):
+    return or_(*(and_(model.grain == grain, model.bucket_start >= lo, model.bucket_start < hi)
+                 for grain, lo, hi in window_segments(start, end)))
+
+def _bucket_sql(grain, column):
+    if db.engine.dialect.name == 'sqlite':
+        return func.strftime(_SQLITE_BUCKET_FORMATS[grain], column)
+    return func.date_trunc(grain, column)
+
+def increment(model, key, deltas):
+    """Add ``deltas`` to the counters of the ``model`` row identified by ``key``, creating it if missing."""
+    table = model.__table__
+    insert_for_dialect = _UPSERT_INSERTS.get(db.engine.dialect.name)
+    if insert_for_dialect is not None:
+        stmt = insert_for_dialect(table).values(**key, **deltas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key),
+            set_={name: table.c[name] + stmt.excluded[name] for name in deltas})
+        db.session.execute(stmt)
+        return
+    updated = db.session.execute(
+        update(table)
+        .where(*(table.c[name] == value for name, value in key.items()))
+        .values({name: table.c[name] + value for name, value in deltas.items()})
+    ).rowcount
+    if not updated:
+        db.session.execute(insert(table).values(**key, **deltas))
+
+def increment_from_select(model, key_columns, delta_columns, select_stmt):
+    """``increment`` for every row of ``select_stmt``, which yields the key columns then the deltas.
+
+    One INSERT ... SELECT ... ON CONFLICT where the dialect has upserts.
+    The select must have a WHERE clause, which SQLite needs to parse it.
+    """
+    table = model.__table__
+    columns = list(key_columns) + list(delta_columns)
+    insert_for_dialect = _UPSERT_INSERTS.get(db.engine.dialect.name)
+    if insert_for_dialect is not None:
+        stmt = insert_for_dialect(table).from_select(columns, select_stmt)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={name: table.c[name] + stmt.excluded[name] for name in delta_columns})
+        return db.session.execute(stmt).rowcount
+    rows = db.session.execute(select_stmt).all()
+    for row in rows:
+        values = dict(zip(columns, row))
+        increment(model, {name: values[name] for name in key_columns},
+                  {name: values[name] for name in delta_columns})
+    return len(rows)
+
+def _record(trip, fleet_id, deltas):
+    for grain in GRAINS:
+        bucket = truncate(trip.start_time, grain)
+        increment(VehicleTripRollup, {'grain': grain, 'bucket_start': bucket, 'vehicle_id': trip.vehicle_id}, deltas)
+        if fleet_id is not None:
+            increment(FleetTripRollup, {'grain': grain, 'bucket_start': bucket, 'fleet_id': fleet_id}, deltas)
+
+def record_trip_start(trip, fleet_id):
+    """Count a new trip in its start hour, day and month; call inside the trip's transaction."""
+    _record(trip, fleet_id, {'trips': 1, 'ride_seconds': 0.0, 'revenue': 0.0})
+
+def record_trip_end(trip, fleet_id):
+    """Add a finished trip's ride time and fare to the buckets it started in."""
+    _record(trip, fleet_id, {
+        'trips': 0,
+        'ride_seconds': (trip.end_time - trip.start_time).total_seconds(),
+        'revenue': trip.fare or 0.0,
+    })
+
+def rebuild_trip_rollups(start, end):
+    """Recompute both rollup tables for trips started in ``[start, end)`` from raw trips.
+
+    The range is widened to whole months. Fleet rollups use each vehicle's
+    current fleet. Runs in the caller's transaction; returns rows written.
+    """
+    start, end = truncate(start, 'month'), _ceil(end, 'month')
+    for model in (VehicleTripRollup, FleetTripRollup):
+        db.session.execute(delete(model).where(model.bucket_start >= start, model.bucket_start < end))
+
+    # Only the hourly vehicle rows scan raw trips; every other grain is
+    # re-aggregated from the grain below it, which is far fewer rows to group.
+    duration = trip_duration_seconds()
+    hour = _bucket_sql('hour', Trip.start_time)
+    hourly_vehicle = (select(literal('hour'), hour, Trip.vehicle_id, func.count(Trip.id),
+                             func.coalesce(func.sum(duration), 0), func.coalesce(func.sum(Trip.fare), 0))
+                      .where(Trip.start_time >= start, Trip.start_time < end)
+                      .group_by(hour, Trip.vehicle_id))
+    written = _insert_rollups(VehicleTripRollup, 'vehicle_id', hourly_vehicle)
+
+    source = VehicleTripRollup
+    hourly_fleet = (select(literal('hour'), source.bucket_start, Vehicle.fleet_id, *_sums(source))
+                    .join(Vehicle, Vehicle.id == source.vehicle_id)
+                    .where(source.grain == 'hour', source.bucket_start >= start, source.bucket_start < end,
+                           Vehicle.fleet_id.isnot(None))
+                    .group_by(source.bucket_start, Vehicle.fleet_id))
+    written += _insert_rollups(FleetTripRollup, 'fleet_id', hourly_fleet)
+
+    for model, key_column in ((VehicleTripRollup, 'vehicle_id'), (FleetTripRollup, 'fleet_id')):
+        key = getattr(model, key_column)
+        for finer, grain in zip(GRAINS, GRAINS[1:]):
+            bucket = _bucket_sql(grain, model.bucket_start)
+            coarser = (select(literal(grain), bucket, key, *_sums(model))
+                       .where(model.grain == finer, model.bucket_start >= start, model.bucket_start < end)
+                       .group_by(bucket, key))
+            written += _insert_rollups(model, key_column, coarser)
+    return written
+
+def _sums(model):
+    return (func.sum(model.trips), func.sum(model.ride_seconds), func.sum(model.revenue))
+
+def _insert_rollups(model, key_column, select_stmt):
+    columns = ['grain', 'bucket_start', key_column, 'trips', 'ride_seconds', 'revenue']
+    return db.session.execute(insert(model).from_select(columns, select_stmt)).rowcount
@@ -0,0 +1,213 @@
+import math
+import threading
+import time
+from heapq import nsmallest
+
+from flask import current_app
+
+from extensions import db
+from models import Vehicle
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+# Moves written through another worker are picked up within this many seconds.
+DEFAULT_MAX_AGE_S = 30
+
+class GridIndex:
+    """Uniform lat/lon grid of points keyed by id.
+
+    Each point lives in exactly one cell, so upsert and remove are O(1) and a
+    query only visits the cells overlapping its search circle.
+    """
+
+    def __init__(self, cell_size_deg=0.001):
+        self.cell_size = cell_size_deg
+        self._points = {}
+        self._cells = {}
+        self._bounds = None
+        self._lock = threading.Lock()
+        self.loaded = False
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._points)
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_size), math.floor(lon / self.cell_size))
+
+    def get(self, key):
+        point = self._points.get(key)
+        return point[:3] if point is not None else None
+
+    def upsert(self, key, lat, lon, status=None):
+        cell = self._cell(lat, lon)
+        with self._lock:
+            old = self._points.get(key)
+            if old is not None and old[3] != cell:
+                self._discard(key, old[3])
+            self._points[key] = (lat, lon, status, cell)
+            self._cells.setdefault(cell, set()).add(key)
+            # Bounds only ever grow; they cap how far a k-nearest search rings out.
+            if self._bounds is None:
+                self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+            else:
+                b = self._bounds
+                b[0], b[1] = min(b[0], cell[0]), max(b[1], cell[0])
+                b[2], b[3] = min(b[2], cell[1]), max(b[3], cell[1])
+
+    def remove(self, key):
+        with self._lock:
+            old = self._points.pop(key, None)
+            if old is not None:
+                self._discard(key, old[3])
+
+    def clear(self):
+        with self._lock:
+            self._points.clear()
+            self._cells.clear()
+            self._bounds = None
+            self.loaded = False
+            self.loaded_at = None
+
+    def replace(self, rows):
+        """Swap in the points of ``(key, lat, lon, status)`` rows, built without holding the lock."""
+        fresh = GridIndex(self.cell_size)
+        for key, lat, lon, status in rows:
+            fresh.upsert(key, lat, lon, status)
+        with self._lock:
+            self._points, self._cells, self._bounds = fresh._points, fresh._cells, fresh._bounds
+            self.loaded = True
+            self.loaded_at = time.monotonic()
+
+    def _discard(self, key, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self._cells[cell]
+
+    def _scan_cells(self, lat, lon, cells, status, out):
+        # Equirectangular distance scaled at the query latitude; accurate at city scale.
+        points = self._points
+        grid = self._cells
+        kx = math.radians(1) * math.cos(math.radians(lat)) * EARTH_RADIUS_M
+        ky = math.radians(1) * EARTH_RADIUS_M
+        hypot = math.hypot
+        for cell in cells:
+            members = grid.get(cell)
+            if not members:
+                continue
+            for key in members:
+                p_lat, p_lon, p_status, _ = points[key]
+                if status is not None and p_status != status:
+                    continue
+                out.append((hypot((p_lon - lon) * kx, (p_lat - lat) * ky), key, p_lat, p_lon, p_status))
+
+    def within(self, lat, lon, radius_m, status=None, limit=None):
+        """Points within ``radius_m`` of (lat, lon), nearest first."""
+        lat_span = radius_m / METERS_PER_DEGREE
+        lon_span = lat_span / max(math.cos(math.radians(lat)), 1e-6)
+        row_min, col_min = self._cell(lat - lat_span, lon - lon_span)
+        row_max, col_max = self._cell(lat + lat_span, lon + lon_span)
+        candidates = []
+        with self._lock:
+            if (row_max - row_min + 1) * (col_max - col_min + 1) > len(self._cells):
+                # Search box is wider than the populated grid; walk occupied cells instead.
+                cells = [cell for cell in self._cells
+                         if row_min <= cell[0] <= row_max and col_min <= cell[1] <= col_max]
+            else:
+                cells = [(r, c) for r in range(row_min, row_max + 1) for c in range(col_min, col_max + 1)]
+            self._scan_cells(lat, lon, cells, status, candidates)
+        hits = [c for c in candidates if c[0] <= radius_m]
+        if limit is not None:
+            return nsmallest(limit, hits)
+        return sorted(hits)
+
+    def nearest(self, lat, lon, k, status=None, max_radius_m=None):
+        """The ``k`` nearest points, searched in rings of cells outward."""
+        if k < 1:
+            return []
+        center_row, center_col = self._cell(lat, lon)
+        # Smallest ground distance a single cell step is guaranteed to cover.
+        cell_m = self.cell_size * METERS_PER_DEGREE * max(math.cos(math.radians(abs(lat) + self.cell_size)), 1e-6)
+        candidates = []
+        with self._lock:
+            if not self._points:
+                return []
+            row_min, row_max, col_min, col_max = self._bounds
+            max_ring = max(abs(center_row - row_min), abs(center_row - row_max),
+                           abs(center_col - col_min), abs(center_col - col_max))
+            ring = 0
+            while ring <= max_ring:
+                if ring == 0:
+                    cells = [(center_row, center_col)]
+                elif 8 * ring > len(self._cells):
+                    # Empty rings now cost more than visiting every occupied cell left.
+                    cells = [cell for cell in self._cells
+                             if max(abs(cell[0] - center_row), abs(cell[1] - center_col)) >= ring]
+                    self._scan_cells(lat, lon, cells, status, candidates)
+                    break
+                else:
+                    top, bottom = center_row - ring, center_row + ring
+                    left, right = center_col - ring, center_col + ring
+                    cells = [(top, c) for c in range(left, right + 1)]
+                    cells += [(bottom, c) for c in range(left, right + 1)]
+                    cells += [(r, left) for r in range(top + 1, bottom)]
+                    cells += [(r, right) for r in range(top + 1, bottom)]
+                self._scan_cells(lat, lon, cells, status, candidates)
+                covered_m = ring * cell_m
+                if max_radius_m is not None and covered_m >= max_radius_m:
+                    break
+                if len(candidates) >= k and nsmallest(k, candidates)[-1][0] <= covered_m:
+                    break
+                ring += 1
+        if max_radius_m is not None:
+            candidates = [c for c in candidates if c[0] <= max_radius_m]
+        return nsmallest(k, candidates)
+
+    def scan(self, lat, lon, radius_m=None, k=None, status=None):
+        """Brute-force reference query over every point; used by benchmarks."""
+        hits = []
+        with self._lock:
+            self._scan_cells(lat, lon, list(self._cells), status, hits)
+        if radius_m is not None:
+            hits = [h for h in hits if h[0] <= radius_m]
+        return nsmallest(k, hits) if k is not None else sorted(hits)
+
+vehicle_index = GridIndex()
+
+def index_vehicle_values(vehicle_id, lat, lon, status):
+    if lat is None or lon is None:
+        vehicle_index.remove(vehicle_id)
+    else:
+        vehicle_index.upsert(vehicle_id, lat, lon, status)
+
+def index_vehicle(vehicle):
+    index_vehicle_values(vehicle.id, vehicle.latitude, vehicle.longitude, vehicle.status)
+
+_reload_lock = threading.Lock()
+
+def ensure_vehicle_index():
+    """``vehicle_index``, loaded from the database on first use and reloaded once VEHICLE_INDEX_MAX_AGE_S old.
+
+    Writes update the index only in the worker that made them, so the
+    others catch up on reload. A reload runs on the request that finds the
+    index stale while other requests keep reading the current one.
+    """
+    max_age = current_app.config.get('VEHICLE_INDEX_MAX_AGE_S', DEFAULT_MAX_AGE_S)
+    loaded_at = vehicle_index.loaded_at
+    if vehicle_index.loaded and loaded_at is not None and time.monotonic() - loaded_at < max_age:
+        return vehicle_index
+    if not _reload_lock.acquire(blocking=not vehicle_index.loaded):
+        return vehicle_index  # another request is already reloading
+    try:
+        loaded_at = vehicle_index.loaded_at
+        if vehicle_index.loaded and loaded_at is not None and time.monotonic() - loaded_at < max_age:
+            return vehicle_index
+        rows = (db.session.query(Vehicle.id, Vehicle.latitude, Vehicle.longitude, Vehicle.status)
+                .filter(Vehicle.latitude.isnot(None), Vehicle.longitude.isnot(None))
+                .yield_per(10000))
+        vehicle_index.replace(rows)
+    finally:
+        _reload_lock.release()
+    return vehicle_index
@@ -0,0 +1,199 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, func, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from entity_cache import entity_cache
+from extensions import db
+from gbfs_snapshot import gbfs_snapshot, publish_vehicle
+from models import Vehicle
+from spatial_index import index_vehicle, vehicle_index
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL_MS = 500
+DEFAULT_MAX_BUFFERED = 200000
+FLUSH_CHUNK_SIZE = 5000
+
+_vehicles = Vehicle.__table__
+# One statement shape for every ping, so a flush is a single executemany.
+# A ping without a status keeps the stored one. A ping older than the stored
+# position, flushed late or by another worker, leaves the row alone.
+_update_position = (
+    update(_vehicles)
+    .where(_vehicles.c.id == bindparam('b_id'),
+           or_(_vehicles.c.last_ping_ts.is_(None), _vehicles.c.last_ping_ts < bindparam('b_ts')))
+    .values(latitude=bindparam('b_lat'),
+            longitude=bindparam('b_lon'),
+            status=func.coalesce(bindparam('b_status'), _vehicles.c.status),
+            last_ping_ts=bindparam('b_ts'))
+)
+_read_positions = (
+    select(_vehicles.c.id, _vehicles.c.latitude, _vehicles.c.longitude, _vehicles.c.status, _vehicles.c.source)
+    .where(_vehicles.c.id.in_(bindparam('ids', expanding=True)))
+)
+
+class TelemetryBuffer:
+    """Latest-ping-per-vehicle buffer flushed to the Vehicle table in bulk.
+
+    Pings for the same vehicle between two flushes overwrite each other, so
+    the database sees at most one UPDATE per vehicle per flush interval and
+    memory is bounded by ``max_buffered`` distinct vehicles. The newest
+    ping flushed is remembered for as many of the most recently flushed
+    vehicles, and older ones for them are dropped as stale; the database
+    itself refuses any ping older than the position it holds.
+    """
+
+    def __init__(self, flush_interval_ms=DEFAULT_FLUSH_INTERVAL_MS, max_buffered=DEFAULT_MAX_BUFFERED):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_buffered = max_buffered
+        self._pending = {}
+        self._flushed = OrderedDict()  # vehicle id -> timestamp of the newest ping written, least recent first
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._app = None
+        self.stats = {
+            'received': 0,
+            'coalesced': 0,
+            'stale': 0,
+            'dropped': 0,
+            'flushes': 0,
+            'rows_written': 0,
+            'flush_errors': 0,
+            'last_flush_ms': 0.0,
+            'last_flush_rows': 0,
+        }
+
+    def add(self, pings):
+        """Buffer ``(vehicle_id, lat, lon, status, ts)`` tuples; returns the number dropped."""
+        dropped = coalesced = stale = 0
+        with self._lock:
+            pending, flushed = self._pending, self._flushed
+            for ping in pings:
+                current = pending.get(ping[0])
+                if current is None:
+                    if flushed.get(ping[0], -1) >= ping[4]:
+                        stale += 1
+                        continue
+                    if len(pending) >= self.max_buffered:
+                        dropped += 1
+                        continue
+                elif current[4] > ping[4]:
+                    stale += 1
+                    continue
+                else:
+                    coalesced += 1
+                pending[ping[0]] = ping
+            stats = self.stats
+            stats['received'] += len(pings)
+            stats['coalesced'] += coalesced
+            stats['stale'] += stale
+            stats['dropped'] += dropped
+            full = len(pending) >= self.max_buffered
+        if full:
+            self._wakeup.set()
+        return dropped
+
+    def start(self, app):
+        """Start the background flusher for ``app`` once per process."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._flush_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._app = app
+            self.flush_interval = app.config.get('TELEMETRY_FLUSH_INTERVAL_MS', DEFAULT_FLUSH_INTERVAL_MS) / 1000
+            self.max_buffered = app.config.get('TELEMETRY_MAX_BUFFERED', DEFAULT_MAX_BUFFERED)
+            self._thread = threading.Thread(target=self._run, name='telemetry-flusher', daemon=True)
+            self._thread.start()
+            atexit.register(self._flush_on_exit)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                with self._app.app_context():
+                    self.flush()
+            except Exception as e:
+                # Keep the flusher alive; the next ping batch will be retried.
+                logger.error(f"Unexpected error in telemetry flusher: {str(e)}")
+
+    def _flush_on_exit(self):
+        if self._app is not None and self._pending:
+            with self._app.app_context():
+                self.flush()
+
+    def flush(self):
+        """Write everything buffered so far; needs an application context."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            start = time.perf_counter()
+            rows = [{'b_id': vid, 'b_lat': lat, 'b_lon': lon, 'b_status': status, 'b_ts': ts}
+                    for vid, lat, lon, status, ts in batch.values()]
+            try:
+                for offset in range(0, len(rows), FLUSH_CHUNK_SIZE):
+                    db.session.execute(_update_position, rows[offset:offset + FLUSH_CHUNK_SIZE])
+                db.session.commit()
+            except SQLAlchemyError as e:
+                logger.error(f"Database error flushing telemetry: {str(e)}")
+                db.session.rollback()
+                self._requeue(batch)
+                self.stats['flush_errors'] += 1
+                return 0
+            with self._lock:
+                flushed = self._flushed
+                for vehicle_id, ping in batch.items():
+                    flushed[vehicle_id] = ping[4]
+                    flushed.move_to_end(vehicle_id)
+                while len(flushed) > self.max_buffered:
+                    flushed.popitem(last=False)
+            entity_cache.invalidate('vehicle', *batch)
+            self._sync_views(list(batch))
+            self.stats['flushes'] += 1
+            self.stats['rows_written'] += len(rows)
+            self.stats['last_flush_rows'] = len(rows)
+            self.stats['last_flush_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            return len(rows)
+
+    def _requeue(self, batch):
+        # Keep the failed batch unless newer pings arrived in the meantime.
+        with self._lock:
+            for vehicle_id, ping in batch.items():
+                if vehicle_id not in self._pending and len(self._pending) < self.max_buffered:
+                    self._pending[vehicle_id] = ping
+
+    def _sync_views(self, vehicle_ids):
+        # Refresh the spatial index and the GBFS snapshot from the rows as
+        # stored, not from the batch: the UPDATE skips pings older than the
+        # stored position, and those must not move the vehicle here either.
+        index_loaded, snapshot_loaded = vehicle_index.loaded, gbfs_snapshot.loaded
+        if not (index_loaded or snapshot_loaded):
+            return
+        for offset in range(0, len(vehicle_ids), FLUSH_CHUNK_SIZE):
+            chunk = vehicle_ids[offset:offset + FLUSH_CHUNK_SIZE]
+            for vehicle in db.session.execute(_read_positions, {'ids': chunk}):
+                if index_loaded:
+                    index_vehicle(vehicle)
+                if snapshot_loaded:
+                    publish_vehicle(vehicle)
+
+    def metrics(self):
+        with self._lock:
+            snapshot = dict(self.stats)
+            snapshot['buffer_depth'] = len(self._pending)
+        snapshot['buffer_capacity'] = self.max_buffered
+        snapshot['flush_interval_ms'] = int(self.flush_interval * 1000)
+        snapshot['flusher_running'] = self._thread is not None and self._thread.is_alive()
+        return snapshot
+
+telemetry_buffer = TelemetryBuffer()
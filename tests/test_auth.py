@@ -0,0 +1,80 @@
+"""Sign-in: password hashing on the process pool, load shedding and rehashing.
+
+Each test gets its own temp-file SQLite database. Hashes use a cheap
+PBKDF2 cost so the pool's spawn start-up dominates, not the hashing.
+"""
+import threading
+import time
+
+import pytest
+from flask import Flask
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from api import auth
+from extensions import db
+from models import User
+from password_hasher import password_hasher
+
+CHEAP = 'pbkdf2:sha256:1000'
+CONFIG = {'SECRET_KEY': 'test-secret', 'PASSWORD_HASH_METHOD': CHEAP, 'PASSWORD_HASH_WORKERS': 0}
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'auth.db'}"
+    app.config.update(CONFIG)
+    db.init_app(app)
+    app.register_blueprint(auth.bp)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username='rider', email='rider@example.com',
+                            password_hash=generate_password_hash('secret', method=CHEAP)))
+        db.session.commit()
+    password_hasher.shutdown()
+    yield app
+    password_hasher.shutdown()
+
+def _login(client, password='secret'):
+    return client.post('/api/v1/auth/login', json={'username': 'rider', 'password': password})
+
+def _stored_hash(app):
+    with app.app_context():
+        return User.query.filter_by(username='rider').one().password_hash
+
+def test_login_sheds_with_503_once_max_pending_is_reached(app):
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_MAX_PENDING=1)
+    # Hold the only slot with a job that outlasts the login attempt.
+    holder = threading.Thread(target=password_hasher._run, args=(app.config, time.sleep, 2.0))
+    holder.start()
+    try:
+        deadline = time.monotonic() + 10
+        while password_hasher.metrics()['pending'] < 1:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        shed = password_hasher.stats['shed']
+        response = _login(app.test_client())
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert password_hasher.stats['shed'] == shed + 1
+    finally:
+        holder.join()
+    assert _login(app.test_client()).status_code == 200
+
+def test_login_rehashes_when_the_method_changes(app):
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_METHOD='pbkdf2:sha256:2000')
+    client = app.test_client()
+    rehashed = password_hasher.stats['rehashed']
+    assert _login(client).status_code == 200
+    upgraded = _stored_hash(app)
+    assert upgraded.startswith('pbkdf2:sha256:2000$')
+    assert check_password_hash(upgraded, 'secret')
+    assert password_hasher.stats['rehashed'] == rehashed + 1
+    # Already on the current method: nothing more to do.
+    assert _login(client).status_code == 200
+    assert _stored_hash(app) == upgraded
+    assert password_hasher.stats['rehashed'] == rehashed + 1
+
+def test_wrong_password_is_not_rehashed(app):
+    app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+    assert _login(app.test_client(), password='wrong').status_code == 400
+    assert _stored_hash(app).startswith(CHEAP + '$')
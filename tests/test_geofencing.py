@@ -0,0 +1,136 @@
+"""Geofence containment: compiled polygons with holes and parts, and the lookup endpoints.
+
+Coordinates are GeoJSON, [lon, lat]. Each endpoint test gets its own
+temp-file SQLite database and an empty geofence index.
+"""
+import json
+import math
+import random
+
+import pytest
+from flask import Flask
+
+from api import geofencing
+from extensions import db
+from geofence_index import MAX_CELLS_PER_POLYGON, GeofenceError, GeofenceIndex, compile_geofence, geofence_index
+
+def _square(x0, y0, x1, y1):
+    return [[x0, y0], [x1, y0], [x1, y1], [x0, y1], [x0, y0]]
+
+SQUARE_WITH_HOLE = {'type': 'Polygon', 'coordinates': [_square(0, 0, 10, 10), _square(4, 4, 6, 6)]}
+TWO_PARTS = {'type': 'MultiPolygon', 'coordinates': [
+    [_square(0, 0, 2, 2)],
+    [_square(10, 10, 20, 20), _square(12, 12, 18, 18)],
+]}
+
+def _naive_contains(polygons, lon, lat):
+    # Plain even-odd ray casting over every edge of each part.
+    for rings in polygons:
+        inside = False
+        for ring in rings:
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+                if (y1 > lat) != (y2 > lat) and lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+        if inside:
+            return True
+    return False
+
+def test_hole_is_outside():
+    polygon = compile_geofence(1, 'ring', json.dumps(SQUARE_WITH_HOLE))
+    assert polygon.contains(2, 2)
+    assert polygon.contains(8, 5)
+    assert not polygon.contains(5, 5)
+    assert not polygon.contains(11, 5)
+
+def test_multipolygon_matches_any_part_minus_its_holes():
+    polygon = compile_geofence(1, 'parts', TWO_PARTS)
+    assert polygon.contains(1, 1)
+    assert polygon.contains(11, 15)
+    assert not polygon.contains(15, 15)  # hole of the second part
+    assert not polygon.contains(5, 5)  # between the parts, inside the bounding box
+
+def test_slabs_agree_with_plain_ray_casting():
+    rng = random.Random(7)
+    # A 60-point star with a 20-point star hole, so edges cross many slabs.
+    def star(points, radius, spike):
+        return [[math.cos(2 * math.pi * i / points) * (radius if i % 2 else spike),
+                 math.sin(2 * math.pi * i / points) * (radius if i % 2 else spike)] for i in range(points)]
+    rings = [star(60, 1.0, 0.6), star(20, 0.3, 0.2)]
+    polygon = compile_geofence(1, 'star', {'type': 'Polygon', 'coordinates': rings})
+    for _ in range(5000):
+        lon, lat = rng.uniform(-1.1, 1.1), rng.uniform(-1.1, 1.1)
+        assert polygon.contains(lon, lat) == _naive_contains([rings], lon, lat), (lon, lat)
+
+@pytest.mark.parametrize('coordinates', [
+    '{not json',
+    json.dumps({'type': 'Point', 'coordinates': [1, 2]}),
+    json.dumps([[0, 0], [1, 1]]),
+    json.dumps([[0, 0], [1, 'x'], [1, 1]]),
+])
+def test_invalid_coordinates_are_rejected(coordinates):
+    with pytest.raises(GeofenceError):
+        compile_geofence(1, 'bad', coordinates)
+
+def test_index_finds_small_and_large_polygons_ordered_by_id():
+    index = GeofenceIndex(cell_size_deg=0.01)
+    large = _square(0, 0, 20, 20)
+    assert (20 / 0.01) ** 2 > MAX_CELLS_PER_POLYGON  # so it is checked on every query, not per cell
+    index.upsert(compile_geofence(3, 'large', [large]))
+    index.upsert(compile_geofence(2, 'small', SQUARE_WITH_HOLE['coordinates']))
+    index.upsert(compile_geofence(1, 'parts', TWO_PARTS))
+    assert [p.id for p in index.containing(1, 1)] == [1, 2, 3]
+    assert [p.id for p in index.containing(5, 5)] == [3]
+    index.remove(3)
+    assert [[p.id for p in hits] for hits in index.containing_many([(1, 1), (5, 5), (15, 11)])] == [[1, 2], [], [1]]
+
+@pytest.fixture
+def client(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'geofences.db'}"
+    db.init_app(app)
+    app.register_blueprint(geofencing.bp)
+    with app.app_context():
+        db.create_all()
+    geofence_index.clear()
+    yield app.test_client()
+    geofence_index.clear()
+
+def _create(client, name, coordinates):
+    response = client.post('/api/v1/geofences', json={'name': name, 'coordinates': json.dumps(coordinates)})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['geofence_id']
+
+def test_contains_endpoints(client):
+    ring = _create(client, 'ring', SQUARE_WITH_HOLE)
+    parts = _create(client, 'parts', TWO_PARTS)
+    response = client.get('/api/v1/geofences/contains?lat=1&lon=1')
+    assert response.get_json()['data'] == [{'id': ring, 'name': 'ring'}, {'id': parts, 'name': 'parts'}]
+    response = client.post('/api/v1/geofences/contains', json={'points': [
+        {'lat': 1, 'lon': 1}, {'lat': 5, 'lon': 5}, {'lat': 11, 'lon': 15}, {'lat': 15, 'lon': 15}]})
+    assert response.status_code == 200
+    assert response.get_json()['results'] == [[ring, parts], [], [parts], []]
+
+def test_create_rejects_bad_coordinates(client):
+    response = client.post('/api/v1/geofences', json={'name': 'line', 'coordinates': '[[0, 0], [1, 1]]'})
+    assert response.status_code == 400
+
+@pytest.mark.parametrize('payload', [
+    {'points': 'nope'},
+    {'points': [{'lat': 1, 'lon': 1}, {'lat': 91, 'lon': 0}]},
+    [{'lat': 1}],
+    [{'lat': True, 'lon': 0}],
+    [[1, 1]],
+])
+def test_batch_rejects_bad_points_with_400(client, payload):
+    response = client.post('/api/v1/geofences/contains', json=payload)
+    assert response.status_code == 400
+
+def test_batch_reports_which_point_is_bad(client):
+    response = client.post('/api/v1/geofences/contains', json=[{'lat': 1, 'lon': 1}, {'lat': 0, 'lon': 200}])
+    assert [error['index'] for error in response.get_json()['details']] == [1]
+
+def test_batch_over_the_limit_is_413(client, monkeypatch):
+    monkeypatch.setattr(geofencing, 'MAX_POINTS_PER_REQUEST', 3)
+    points = [{'lat': 1, 'lon': 1}] * 4
+    assert client.post('/api/v1/geofences/contains', json=points).status_code == 413
+    assert client.post('/api/v1/geofences/contains', json=points[:3]).status_code == 200
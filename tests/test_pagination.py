@@ -0,0 +1,101 @@
+"""Keyset pagination and NDJSON streaming on the list endpoints.
+
+Each test gets its own temp-file SQLite database of vehicles, several of
+them sharing a created_at so the cursor has to break ties on the id.
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import insert
+
+from api import vehicle
+from extensions import db
+from models import Vehicle
+from pagination import encode_cursor
+
+VEHICLES = 25
+
+@pytest.fixture
+def client(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'pagination.db'}"
+    db.init_app(app)
+    app.register_blueprint(vehicle.bp)
+    start = datetime(2026, 1, 1)
+    with app.app_context():
+        db.create_all()
+        # Inserted newest first, three to a timestamp, so id order is not created_at order.
+        db.session.execute(insert(Vehicle), [
+            {"name": f"v{i}", "status": "available", "location": "depot",
+             "created_at": start + timedelta(minutes=(VEHICLES - i) // 3)}
+            for i in range(VEHICLES)])
+        db.session.commit()
+    return app.test_client()
+
+def _expected_order(client):
+    rows = client.get(f'/api/v1/vehicles?limit={VEHICLES}').get_json()['data']
+    return [row['id'] for row in rows]
+
+def _tampered(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+def test_cursor_round_trip_visits_every_row_once_in_order(client):
+    seen, after, pages = [], None, 0
+    while True:
+        url = '/api/v1/vehicles?limit=4' + (f'&after={after}' if after else '')
+        body = client.get(url).get_json()
+        assert len(body['data']) <= 4
+        seen += [row['id'] for row in body['data']]
+        pages += 1
+        after = body['next_cursor']
+        if after is None:
+            break
+    assert pages == 7
+    assert sorted(seen) == list(range(1, VEHICLES + 1))
+    assert seen == _expected_order(client)
+
+def test_rows_come_in_created_at_then_id_order(client):
+    rows = client.get(f'/api/v1/vehicles?limit={VEHICLES}').get_json()['data']
+    keys = [(row['created_at'], row['id']) for row in rows]
+    assert keys == sorted(keys)
+    assert [row['id'] for row in rows] != sorted(row['id'] for row in rows)
+
+def test_last_full_page_has_no_next_cursor(client):
+    body = client.get(f'/api/v1/vehicles?limit={VEHICLES}').get_json()
+    assert len(body['data']) == VEHICLES
+    assert body['next_cursor'] is None
+
+@pytest.mark.parametrize('after', [
+    'not a cursor!',
+    _tampered(['2026-01-01T00:00:00']),
+    _tampered(['yesterday', 3]),
+    _tampered(['2026-01-01T00:00:00', {'id': 3}]),
+    _tampered(['2026-01-01T00:00:00', '3']),
+    _tampered({'created_at': '2026-01-01T00:00:00', 'id': 3}),
+])
+def test_tampered_cursor_is_400(client, after):
+    response = client.get(f'/api/v1/vehicles?after={after}')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid pagination parameters'
+
+@pytest.mark.parametrize('limit', ['0', '-1', 'ten'])
+def test_bad_limit_is_400(client, limit):
+    assert client.get(f'/api/v1/vehicles?limit={limit}').status_code == 400
+
+def test_ndjson_streams_every_row_after_the_cursor(client):
+    order = _expected_order(client)
+    response = client.get('/api/v1/vehicles?format=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)['id'] for line in lines] == order
+
+    first_page = client.get('/api/v1/vehicles?limit=10').get_json()
+    response = client.get(f"/api/v1/vehicles?format=ndjson&after={first_page['next_cursor']}")
+    assert [json.loads(line)['id'] for line in response.get_data(as_text=True).splitlines()] == order[10:]
+
+def test_cursor_encodes_the_ordering_columns():
+    cursor = encode_cursor([datetime(2026, 1, 1, 12), 7])
+    assert json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))) == ['2026-01-01T12:00:00', 7]
@@ -0,0 +1,234 @@
+"""Payment intents: acceptance, idempotent replay, claiming, retries and lease reclaim.
+
+Run with ``python -m pytest tests``. Each test gets its own temp-file SQLite
+database; PAYMENT_WORKERS = 0 charges inline, so no threads are involved.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy.exc import IntegrityError
+
+from api import payment
+from extensions import db
+from models import Invoice, PaymentIntent, User, UserBillingSummary
+from payment_gateway import GatewayDeclined, GatewayError
+from payment_worker import PaymentWorkerPool, _finish, payment_workers, process_intent
+
+CONFIG = {'PAYMENT_WORKERS': 0, 'PAYMENT_MAX_ATTEMPTS': 3, 'PAYMENT_RETRY_BASE_S': 1.0, 'PAYMENT_LEASE_S': 60}
+
+class RecordingGateway:
+    """Charges once per idempotency key, as real gateways do, after failing ``fail`` times."""
+
+    def __init__(self, fail=0, error=GatewayError):
+        self.fail = fail
+        self.error = error
+        self.calls = []
+        self.charges = {}
+
+    def charge(self, amount, payment_method, idempotency_key, reference):
+        self.calls.append(idempotency_key)
+        if self.fail:
+            self.fail -= 1
+            raise self.error("gateway said no")
+        return self.charges.setdefault(idempotency_key, f"ch_{len(self.charges) + 1}")
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'payments.db'}"
+    app.config.update(CONFIG)
+    db.init_app(app)
+    app.register_blueprint(payment.bp)
+    with app.app_context():
+        db.create_all()
+        db.session.add(User(username='payer', email='payer@example.com'))
+        db.session.commit()
+    yield app
+    payment_workers.shutdown()
+
+@pytest.fixture
+def ctx(app):
+    with app.app_context():
+        yield
+
+def _invoice(amount=9.5):
+    invoice = Invoice(user_id=1, amount=amount, description='ride', status='Pending')
+    db.session.add(invoice)
+    db.session.commit()
+    return invoice.id
+
+def _intent(invoice_id, key='key-1', **values):
+    intent = PaymentIntent(invoice_id=invoice_id, amount=9.5, payment_method='card', idempotency_key=key,
+                           **values)
+    db.session.add(intent)
+    db.session.commit()
+    return intent.id
+
+def _pay(client, invoice_id, key, amount=9.5, payment_method='card'):
+    return client.post('/api/v1/payments', headers={'Idempotency-Key': key},
+                       json={'invoice_id': invoice_id, 'amount': amount, 'payment_method': payment_method})
+
+def _reload(intent_id):
+    db.session.expire_all()
+    return db.session.get(PaymentIntent, intent_id)
+
+def test_accepted_payment_is_charged_and_marks_invoice_paid(app, ctx):
+    invoice_id = _invoice()
+    response = _pay(app.test_client(), invoice_id, 'pay-1')
+    assert response.status_code == 202
+    intent = _reload(response.get_json()['id'])
+    assert intent.status == 'succeeded'
+    assert intent.attempts == 1
+    assert db.session.get(Invoice, invoice_id).status == 'Paid'
+    assert db.session.get(UserBillingSummary, 1).paid == 9.5
+
+def test_replay_with_same_key_returns_original_without_charging_again(app, ctx):
+    invoice_id = _invoice()
+    client = app.test_client()
+    first = _pay(client, invoice_id, 'pay-1')
+    second = _pay(client, invoice_id, 'pay-1')
+    assert second.status_code == 200
+    assert second.get_json()['id'] == first.get_json()['id']
+    assert PaymentIntent.query.count() == 1
+
+def test_same_key_for_a_different_payment_is_refused(app, ctx):
+    invoice_id = _invoice()
+    client = app.test_client()
+    _pay(client, invoice_id, 'pay-1')
+    assert _pay(client, invoice_id, 'pay-1', payment_method='other').status_code == 422
+
+def test_second_payment_while_one_is_in_flight_gets_409(app, ctx):
+    invoice_id = _invoice()
+    intent_id = _intent(invoice_id, status='processing', claimed_at=datetime.utcnow())
+    response = _pay(app.test_client(), invoice_id, 'pay-2')
+    assert response.status_code == 409
+    assert response.get_json()['status_url'].endswith(f'/payments/{intent_id}')
+
+def test_database_allows_one_in_flight_intent_per_invoice(ctx):
+    invoice_id = _invoice()
+    _intent(invoice_id, key='a', status='pending')
+    with pytest.raises(IntegrityError):
+        _intent(invoice_id, key='b', status='processing')
+    db.session.rollback()
+    # Finished intents do not count, so a failed payment can be retried under a new key.
+    _intent(_invoice(), key='c', status='failed')
+
+def test_failed_payment_can_be_retried_with_a_new_key(app, ctx):
+    invoice_id = _invoice()
+    _intent(invoice_id, key='old', status='failed')
+    response = _pay(app.test_client(), invoice_id, 'new')
+    assert response.status_code == 202
+    assert _reload(response.get_json()['id']).status == 'succeeded'
+
+def test_insert_race_for_the_same_invoice_gets_409(app, ctx, monkeypatch):
+    # Both requests pass the in-flight check; the unique index rejects the loser.
+    invoice_id = _invoice()
+    intent_id = _intent(invoice_id, key='winner', status='pending',
+                        next_attempt_at=datetime.utcnow() + timedelta(hours=1))
+    checks = iter([None])
+    real_in_flight = payment._in_flight
+    monkeypatch.setattr(payment, '_in_flight', lambda invoice: next(checks, None) or real_in_flight(invoice))
+    response = _pay(app.test_client(), invoice_id, 'loser')
+    assert response.status_code == 409
+    assert response.get_json()['status_url'].endswith(f'/payments/{intent_id}')
+    assert PaymentIntent.query.count() == 1
+
+def test_claim_takes_only_pending_intents_that_are_due(ctx):
+    gateway = RecordingGateway()
+    processing = _intent(_invoice(), key='a', status='processing', claimed_at=datetime.utcnow())
+    later = _intent(_invoice(), key='b', status='pending', next_attempt_at=datetime.utcnow() + timedelta(hours=1))
+    done = _intent(_invoice(), key='c', status='succeeded')
+    for intent_id in (processing, later, done):
+        assert process_intent(intent_id, gateway, CONFIG) is None
+    assert gateway.calls == []
+    assert _reload(later).attempts == 0
+
+def test_claim_is_exclusive(ctx):
+    intent_id = _intent(_invoice(), status='pending')
+    inner = []
+
+    class ReentrantGateway(RecordingGateway):
+        def charge(self, *args):
+            # Another worker tries the same intent while this one is at the gateway.
+            inner.append(process_intent(intent_id, RecordingGateway(), CONFIG))
+            return super().charge(*args)
+
+    gateway = ReentrantGateway()
+    assert process_intent(intent_id, gateway, CONFIG) == 'succeeded'
+    assert inner == [None]
+    assert len(gateway.calls) == 1
+
+def test_gateway_error_schedules_a_retry_with_backoff(ctx):
+    intent_id = _intent(_invoice(), status='pending')
+    gateway = RecordingGateway(fail=1)
+    assert process_intent(intent_id, gateway, CONFIG) == 'pending'
+    intent = _reload(intent_id)
+    assert (intent.status, intent.attempts, intent.last_error) == ('pending', 1, 'gateway said no')
+    assert intent.next_attempt_at is not None
+    # Not due until the backoff has passed.
+    intent.next_attempt_at = datetime.utcnow() + timedelta(hours=1)
+    db.session.commit()
+    assert process_intent(intent_id, gateway, CONFIG) is None
+    intent.next_attempt_at = None
+    db.session.commit()
+    assert process_intent(intent_id, gateway, CONFIG) == 'succeeded'
+    intent = _reload(intent_id)
+    assert (intent.status, intent.attempts, intent.last_error) == ('succeeded', 2, None)
+    assert gateway.calls == ['key-1', 'key-1']
+
+def test_gives_up_after_max_attempts(ctx):
+    invoice_id = _invoice()
+    intent_id = _intent(invoice_id, status='pending')
+    gateway = RecordingGateway(fail=CONFIG['PAYMENT_MAX_ATTEMPTS'])
+    outcomes = []
+    for _ in range(CONFIG['PAYMENT_MAX_ATTEMPTS']):
+        outcomes.append(process_intent(intent_id, gateway, CONFIG))
+        PaymentIntent.query.filter_by(id=intent_id).update({'next_attempt_at': None})
+        db.session.commit()
+    assert outcomes == ['pending', 'pending', 'failed']
+    intent = _reload(intent_id)
+    assert intent.status == 'failed'
+    assert intent.last_error.startswith('Gave up after 3 attempts')
+    assert db.session.get(Invoice, invoice_id).status == 'Pending'
+
+def test_decline_fails_without_retry(ctx):
+    intent_id = _intent(_invoice(), status='pending')
+    gateway = RecordingGateway(fail=1, error=GatewayDeclined)
+    assert process_intent(intent_id, gateway, CONFIG) == 'failed'
+    assert (_reload(intent_id).status, len(gateway.calls)) == ('failed', 1)
+
+def test_expired_lease_is_reclaimed_and_charged_once(app, ctx):
+    invoice_id = _invoice()
+    stale = datetime.utcnow() - timedelta(seconds=CONFIG['PAYMENT_LEASE_S'] + 1)
+    # The worker holding this one died after the gateway took the charge.
+    gateway = RecordingGateway()
+    gateway.charge(9.5, 'card', 'key-1', None)
+    intent_id = _intent(invoice_id, status='processing', attempts=1, claimed_at=stale)
+    fresh_id = _intent(_invoice(), key='key-2', status='processing', attempts=1, claimed_at=datetime.utcnow())
+
+    pool = PaymentWorkerPool()
+    pool.start(app)
+    try:
+        pool.sweep(CONFIG)
+    finally:
+        pool.shutdown()
+    assert pool.stats['reclaimed'] == 1
+    assert (_reload(intent_id).status, _reload(intent_id).last_error) == ('pending', 'Worker lease expired')
+    assert _reload(fresh_id).status == 'processing'
+
+    assert process_intent(intent_id, gateway, CONFIG) == 'succeeded'
+    assert len(gateway.charges) == 1  # the retry reused the idempotency key
+    assert _reload(intent_id).attempts == 2
+    assert db.session.get(Invoice, invoice_id).status == 'Paid'
+
+def test_late_finish_after_reclaim_does_not_pay_twice(ctx):
+    # A worker that outlived its lease finishes after another already succeeded.
+    invoice_id = _invoice()
+    intent_id = _intent(invoice_id, status='pending')
+    assert process_intent(intent_id, RecordingGateway(), CONFIG) == 'succeeded'
+    assert _finish(intent_id, status='succeeded') == 0
+    assert db.session.get(UserBillingSummary, 1).paid == 9.5
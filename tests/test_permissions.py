@@ -0,0 +1,125 @@
+"""Role-based access: tokens, the roles:manage guard and the superuser role.
+
+Each test gets its own temp-file SQLite database with an admin (the
+superuser role), a user manager, a role manager and a rider without a
+role. Tokens are issued directly rather than through /login.
+"""
+import pytest
+from flask import Flask
+from werkzeug.security import generate_password_hash
+
+from api import auth
+from auth_tokens import token_auth
+from extensions import db
+from models import Role, RolePermission, User
+from permissions import ALL_PERMISSIONS, grant_superuser, permission_table
+
+CONFIG = {'SECRET_KEY': 'test-secret', 'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000', 'PASSWORD_HASH_WORKERS': 0}
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'permissions.db'}"
+    app.config.update(CONFIG)
+    db.init_app(app)
+    app.register_blueprint(auth.bp)
+    token_auth.cache.clear()
+    permission_table.invalidate()
+    with app.app_context():
+        db.create_all()
+        password_hash = generate_password_hash('secret', method=CONFIG['PASSWORD_HASH_METHOD'])
+        for name in ('admin', 'user-manager', 'role-manager', 'rider'):
+            db.session.add(User(username=name, email=f'{name}@example.com', password_hash=password_hash))
+        for name, permission in (('ops', 'users:manage'), ('iam', 'roles:manage')):
+            db.session.add(Role(name=name, permissions=[RolePermission(permission=permission)]))
+        db.session.commit()
+        User.query.filter_by(username='user-manager').one().role = Role.query.filter_by(name='ops').one()
+        User.query.filter_by(username='role-manager').one().role = Role.query.filter_by(name='iam').one()
+        db.session.commit()
+        grant_superuser('admin', app.config)
+    yield app
+    token_auth.cache.clear()
+    permission_table.invalidate()
+
+def _headers(app, username):
+    with app.app_context():
+        token, _ = token_auth.issue(User.query.filter_by(username=username).one(), app.config)
+    return {'Authorization': f'Bearer {token}'}
+
+def _ids(app):
+    with app.app_context():
+        return ({user.username: user.id for user in User.query}, {role.name: role.id for role in Role.query})
+
+def _guarded_requests(app):
+    users, roles = _ids(app)
+    return [
+        ('post', '/api/v1/auth/roles', {'name': 'admin-too'}),
+        ('put', f"/api/v1/auth/roles/{roles['ops']}", {'name': 'admin'}),
+        ('delete', f"/api/v1/auth/roles/{roles['iam']}", None),
+        ('put', f"/api/v1/auth/roles/{roles['ops']}/permissions", {'permissions': ['roles:manage']}),
+        ('post', f"/api/v1/auth/users/{users['rider']}/roles/{roles['admin']}", None),
+        ('delete', f"/api/v1/auth/users/{users['admin']}/roles/{roles['admin']}", None),
+    ]
+
+def _send(client, method, url, body, headers=None):
+    return getattr(client, method)(url, json=body, headers=headers or {})
+
+def test_role_management_without_a_token_is_401(app):
+    client = app.test_client()
+    for method, url, body in _guarded_requests(app):
+        for headers in (None, {'Authorization': 'Bearer not-a-token'}):
+            response = _send(client, method, url, body, headers)
+            assert response.status_code == 401, (method, url)
+            assert response.headers['WWW-Authenticate'] == 'Bearer'
+
+@pytest.mark.parametrize('username', ['rider', 'user-manager'])
+def test_role_management_without_roles_manage_is_403(app, username):
+    client = app.test_client()
+    headers = _headers(app, username)
+    for method, url, body in _guarded_requests(app):
+        response = _send(client, method, url, body, headers)
+        assert response.status_code == 403, (method, url)
+        assert response.get_json()['required'] == ['roles:manage']
+    _, roles = _ids(app)
+    assert set(roles) == {'admin', 'ops', 'iam'}
+
+@pytest.mark.parametrize('username', ['admin', 'role-manager'])
+def test_roles_manage_and_the_superuser_may_manage_roles(app, username):
+    client = app.test_client()
+    headers = _headers(app, username)
+    users, _ = _ids(app)
+    response = client.post('/api/v1/auth/roles', json={'name': 'dispatch'}, headers=headers)
+    assert response.status_code == 201
+    role_id = response.get_json()['role_id']
+    response = client.put(f'/api/v1/auth/roles/{role_id}/permissions', json={'permissions': ['roles:manage']},
+                          headers=headers)
+    assert response.status_code == 200
+    assert client.post(f"/api/v1/auth/users/{users['rider']}/roles/{role_id}", headers=headers).status_code == 200
+    # The rider's next request sees the new role and its permission.
+    response = client.post('/api/v1/auth/roles', json={'name': 'night-shift'}, headers=_headers(app, 'rider'))
+    assert response.status_code == 201
+
+def test_superuser_role_holds_every_permission_without_grants(app):
+    with app.app_context():
+        admin = Role.query.filter_by(name='admin').one()
+        assert admin.permissions == []
+        assert permission_table.allows(admin.id, ALL_PERMISSIONS, app.config)
+
+def test_register_with_a_role_needs_roles_manage(app):
+    client = app.test_client()
+    body = {'username': 'new', 'password': 'pw', 'email': 'new@example.com', 'role': 'admin'}
+    assert client.post('/api/v1/auth/register', json=body).status_code == 403
+    # users:manage alone would let its holder mint a superuser account.
+    assert client.post('/api/v1/auth/register', json=body, headers=_headers(app, 'user-manager')).status_code == 403
+    assert client.post('/api/v1/auth/register', json=body, headers=_headers(app, 'role-manager')).status_code == 403
+    response = client.post('/api/v1/auth/register', json=body, headers=_headers(app, 'admin'))
+    assert response.status_code == 201
+    with app.app_context():
+        assert db.session.get(User, response.get_json()['user_id']).role.name == 'admin'
+
+def test_register_without_a_role_is_open(app):
+    body = {'username': 'new', 'password': 'pw', 'email': 'new@example.com'}
+    response = app.test_client().post('/api/v1/auth/register', json=body)
+    assert response.status_code == 201
+    with app.app_context():
+        assert db.session.get(User, response.get_json()['user_id']).role is None
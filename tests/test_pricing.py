@@ -0,0 +1,81 @@
+"""Pricing rules: which rules a quote applies, and editing the base price.
+
+Each test gets its own temp-file SQLite database. Quotes carry no location,
+so the demand model is never consulted.
+"""
+import pytest
+from flask import Flask
+
+from api import pricing
+from extensions import db
+from pricing_engine import pricing_engine
+
+CONFIG = {'DEMAND_REFRESH_INTERVAL_S': 3600, 'DEMAND_UTC_OFFSET_HOURS': 0}
+MONDAY_NOON = '2026-10-12T12:00:00'
+SATURDAY_NOON = '2026-10-17T12:00:00'
+
+@pytest.fixture
+def client(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'pricing.db'}"
+    app.config.update(CONFIG)
+    db.init_app(app)
+    app.register_blueprint(pricing.bp)
+    with app.app_context():
+        db.create_all()
+    pricing_engine.invalidate()
+    yield app.test_client()
+    pricing_engine.invalidate()
+
+def _rule(client, rule_type, price_modifier, name='rule', **conditions):
+    response = client.post('/api/v1/pricing/rules', json={'name': name, 'rule_type': rule_type,
+                                                          'price_modifier': price_modifier,
+                                                          'conditions': conditions})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['rule_id']
+
+def _quote(client, start_time=MONDAY_NOON, minutes=0):
+    return client.post('/api/v1/pricing/quote', json={'start_time': start_time, 'duration_minutes': minutes})
+
+def test_newest_matching_base_rule_wins(client):
+    old = _rule(client, 'base', 1.0)
+    weekend = _rule(client, 'base', 3.0, days=[5, 6])
+    assert _quote(client, MONDAY_NOON).get_json()['rule_ids'] == [old]
+    assert _quote(client, SATURDAY_NOON).get_json()['rule_ids'] == [weekend]
+    newest = _rule(client, 'base', 2.0, per_minute=0.5, minimum_fare=4.0)
+    quote = _quote(client, SATURDAY_NOON, minutes=2).get_json()
+    assert (quote['rule_ids'], quote['fare']) == ([newest], 4.0)
+    assert _quote(client, SATURDAY_NOON, minutes=10).get_json()['fare'] == 7.0
+
+def test_largest_surge_wins_and_time_based_multipliers_stack(client):
+    base = _rule(client, 'base', 10.0)
+    _rule(client, 'surge', 1.5)
+    big_surge = _rule(client, 'surge', 2.0)
+    peak = _rule(client, 'time-based', 1.1, hours=[12])
+    weekday = _rule(client, 'time-based', 0.5, days=[0, 1, 2, 3, 4])
+    _rule(client, 'time-based', 3.0, hours=[3])
+    quote = _quote(client).get_json()
+    assert quote['rule_ids'] == [base, peak, weekday, big_surge]
+    assert (quote['multiplier'], quote['surge_multiplier'], quote['fare']) == (0.55, 2.0, 11.0)
+
+def test_no_matching_base_rule_is_409(client):
+    _rule(client, 'base', 1.0, hours=[8])
+    assert _quote(client).status_code == 409
+
+def test_set_base_price_edits_the_rule_quotes_use(client):
+    _rule(client, 'base', 1.0)
+    newest = _rule(client, 'base', 2.0, days=[0, 1, 2, 3, 4], per_minute=0.2)
+    response = client.post('/api/v1/pricing/base', json={'base_price': 3.0, 'minimum_fare': 5.0})
+    assert response.status_code == 200
+    quote = _quote(client, minutes=10).get_json()
+    assert (quote['rule_ids'], quote['base_fare'], quote['fare']) == ([newest], 3.0, 5.0)
+    assert _quote(client, minutes=20).get_json()['fare'] == 7.0
+    rules = {rule['id']: rule for rule in client.get('/api/v1/pricing/rules').get_json()}
+    # Only the named fields change; the weekday condition and per_minute survive.
+    assert rules[newest]['conditions'] == {'days': [0, 1, 2, 3, 4], 'per_minute': 0.2, 'minimum_fare': 5.0}
+    assert len(rules) == 2
+
+def test_set_base_price_creates_a_rule_when_there_is_none(client):
+    assert _quote(client).status_code == 409
+    assert client.post('/api/v1/pricing/base', json={'base_price': 2.5}).status_code == 200
+    assert _quote(client).get_json()['fare'] == 2.5
@@ -0,0 +1,67 @@
+"""Telemetry buffer: stale pings and what a flush writes and publishes.
+
+Each test gets its own temp-file SQLite database and its own buffer; the
+flusher thread is never started, flushes are called directly.
+"""
+import pytest
+from flask import Flask
+
+from extensions import db
+from models import Vehicle
+from spatial_index import vehicle_index
+from telemetry_buffer import TelemetryBuffer
+
+@pytest.fixture
+def ctx(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'telemetry.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield
+    vehicle_index.clear()
+
+def _vehicle(lat, lon, last_ping_ts=None):
+    vehicle = Vehicle(name='v', status='available', location='depot', latitude=lat, longitude=lon,
+                      last_ping_ts=last_ping_ts)
+    db.session.add(vehicle)
+    db.session.commit()
+    vehicle_index.replace([(vehicle.id, lat, lon, vehicle.status)])
+    return vehicle.id
+
+def _position(vehicle_id):
+    db.session.expire_all()
+    vehicle = db.session.get(Vehicle, vehicle_id)
+    return vehicle.latitude, vehicle.longitude
+
+def test_ping_older_than_the_stored_position_moves_nothing(ctx):
+    # Another worker already wrote the position from t=100.
+    vehicle_id = _vehicle(1.0, 1.0, last_ping_ts=100.0)
+    buffer = TelemetryBuffer()
+    buffer.add([(vehicle_id, 2.0, 2.0, None, 50.0)])
+    buffer.flush()
+    assert _position(vehicle_id) == (1.0, 1.0)
+    assert vehicle_index.get(vehicle_id)[:2] == (1.0, 1.0)
+
+    buffer.add([(vehicle_id, 3.0, 3.0, 'in_use', 150.0)])
+    buffer.flush()
+    assert _position(vehicle_id) == (3.0, 3.0)
+    assert vehicle_index.get(vehicle_id) == (3.0, 3.0, 'in_use')
+
+def test_ping_older_than_one_flushed_here_is_stale(ctx):
+    vehicle_id = _vehicle(1.0, 1.0)
+    buffer = TelemetryBuffer()
+    buffer.add([(vehicle_id, 2.0, 2.0, None, 100.0)])
+    buffer.flush()
+    buffer.add([(vehicle_id, 3.0, 3.0, None, 90.0)])
+    assert buffer.stats['stale'] == 1
+    assert buffer.flush() == 0
+
+def test_flushed_timestamps_are_bounded_by_max_buffered(ctx):
+    buffer = TelemetryBuffer(max_buffered=3)
+    # Ids need not exist; each flush still remembers them.
+    for first in range(1, 31, 3):
+        buffer.add([(vehicle_id, 1.0, 1.0, None, 10.0) for vehicle_id in range(first, first + 3)])
+        buffer.flush()
+        assert len(buffer._flushed) <= 3
+    assert list(buffer._flushed) == [28, 29, 30]
@@ -0,0 +1,5 @@
+from datetime import timezone
+
+def naive_utc(value):
+    """``value`` as the naive UTC datetime the database stores; a naive value is taken to be UTC already."""
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value.tzinfo else value
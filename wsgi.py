@@ -0,0 +1,8 @@
+"""Production entry point: ``gunicorn -c gunicorn.conf.py wsgi:app``.
+
+Without ``preload_app`` each server worker imports this module after it
+is forked, so its engine and pool are created in the worker itself.
+"""
+from main import create_app
+
+app = create_app()